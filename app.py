@@ -1,17 +1,52 @@
 """
 app.py
 Main Streamlit app for Face Recognition Attendance System
+
+Modules only some pages need (pandas, plotly, the multi-camera, video and bulk
+enrollment engines, the service client) are imported inside those pages, and
+face_recognition loads its dlib models in a background warm-up, so a cold start
+renders the first page without paying for all of them.
 """
 import streamlit as st
 import cv2
 import numpy as np
-import pandas as pd
-import plotly.express as px
 import time
 import os
 from datetime import datetime, timedelta
 from database import Database
 from face_utils import FaceUtils
+from utils.pipeline import FramePipeline, DisplayThrottle
+from utils.tracking import FaceTracker
+from utils.detection import DetectionPolicy
+from utils.liveness import LivenessChecker, live_key, LIVE, PENDING, SPOOF
+from utils.presence import PresenceIndex
+from utils.export import ATTENDANCE_COLUMNS, parquet_available, remove_old_exports, write_csv, write_parquet
+from utils import metrics
+
+EXPORT_DIR = os.path.join(os.path.dirname(__file__), 'data', 'exports')
+# Exports are offered as a browser download up to this size (Streamlit holds the file in memory
+# to serve it); larger ones stay on disk. Export files are deleted after this many seconds.
+EXPORT_DOWNLOAD_MAX_MB = 200
+EXPORT_MAX_AGE_S = 3600
+# Live views redraw at most this often and never wider than this; recognition runs on every frame
+DISPLAY_FPS = 10
+DISPLAY_WIDTH = 960
+# Blink-liveness work allowed per frame in the live views
+LIVENESS_BUDGET_MS = 4.0
+# A recognized person is sent to the database at most once per this many seconds until marked
+MARK_COOLDOWN_S = 30.0
+# Set to e.g. http://recognition-node:8080 to recognize uploads through service.py
+SERVICE_URL = os.environ.get('ATTENDANCE_SERVICE_URL')
+# Default Analytics range (about a semester), and the start of day punctuality is measured against
+ANALYTICS_DAYS = 120
+WORKDAY_START = '09:00'
+LATE_GRACE_MINUTES = 5
+# Set to serve this process's metrics for Prometheus at http://127.0.0.1:<port>/metrics
+METRICS_PORT = os.environ.get('ATTENDANCE_METRICS_PORT')
+
+DISPLAY_SECONDS = metrics.histogram('attendance_display_seconds', 'Annotate and render time per displayed frame')
+VIDEO_FRAME_SECONDS = metrics.histogram('attendance_frame_latency_seconds', 'Capture to recognized frame',
+                                        loop='video')
 
 # --- Modern CSS for improved UI ---
 st.markdown("""
@@ -57,29 +92,45 @@ st.markdown("""
 @st.cache_resource
 
 def get_face_utils():
-    return FaceUtils()
+    face_utils = FaceUtils()
+    # Models load and run once off the script thread; the first frame waits only if it beats them
+    face_utils.warm_up(background=True)
+    return face_utils
 
 @st.cache_resource
 
 def get_db():
     return Database()
 
+@st.cache_resource
+
+def start_metrics_server(port):
+    return metrics.start_http_server(port)
+
+@st.cache_resource
+
+def get_presence(_db):
+    # Shared by every session and camera; warmed from today's attendance
+    return PresenceIndex(_db, cooldown=MARK_COOLDOWN_S)
+
 face_utils = get_face_utils()
 db = get_db()
-
-# --- Session state for attendance memory ---
-if 'marked_today' not in st.session_state:
-    st.session_state['marked_today'] = set()
+presence = get_presence(db)
+if METRICS_PORT:
+    start_metrics_server(int(METRICS_PORT))
 
 # --- Sidebar Menu ---
 menu = [
     'Dashboard',
     'Register New User',
+    'Bulk Enrollment',
     'Mark Attendance (Live Camera)',
+    'Multi-Camera',
     'Upload Image',
     'Upload Video',
     'Attendance Records',
-    'Analytics'
+    'Analytics',
+    'System'
 ]
 choice = st.sidebar.selectbox('Menu', menu)
 
@@ -89,13 +140,21 @@ dark_mode = st.sidebar.checkbox('Enable Dark Mode', value=True)
 if dark_mode:
     st.markdown('<style>body { background-color: #222; color: #eee; }</style>', unsafe_allow_html=True)
 
+cache_stats = db.cache_stats()
+st.sidebar.caption(f"Query cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+                   f"({cache_stats['hit_rate']:.0%}), {cache_stats['entries']} entries")
+
 # --- Dashboard ---
+def cached_figure(name, build):
+    # Plotly figures are rebuilt only when the underlying data version changes
+    return db.cache.get_or_compute(('figure', name, datetime.now().date()), build, db.data_version())
+
 def dashboard():
+    import pandas as pd
+    import plotly.express as px
     st.title('📊 Dashboard')
-    users = db.get_all_users()
-    attendance_today = db.get_attendance_today()
-    total_users = len(users)
-    present_today = len(attendance_today)
+    total_users = db.count_users()
+    present_today = db.count_attendance_today()
     attendance_pct = (present_today / total_users * 100) if total_users else 0
     st.metric('Total Registered Users', total_users)
     st.metric("Today's Attendance", present_today)
@@ -104,17 +163,19 @@ def dashboard():
     dept_data = db.get_department_attendance()
     if dept_data:
         df_dept = pd.DataFrame(dept_data, columns=['Department', 'Count'])
-        st.plotly_chart(px.bar(df_dept, x='Department', y='Count', title='Department-wise Attendance'))
+        st.plotly_chart(cached_figure('department', lambda: px.bar(df_dept, x='Department', y='Count',
+                                                                   title='Department-wise Attendance')))
     # Attendance trend (last 7 days)
     trend = db.get_attendance_trend()
     if trend:
         df_trend = pd.DataFrame(trend, columns=['Date', 'Count'])
-        df_trend = df_trend.sort_values('Date')
-        st.plotly_chart(px.line(df_trend, x='Date', y='Count', title='Attendance Trend (Last 7 Days)'))
+        st.plotly_chart(cached_figure('trend', lambda: px.line(df_trend, x='Date', y='Count',
+                                                               title='Attendance Trend (Last 7 Days)')))
     # Present vs Absent pie chart
     absent = total_users - present_today
-    st.plotly_chart(px.pie(pd.DataFrame({'Status': ['Present', 'Absent'], 'Count': [present_today, absent]}),
-                          names='Status', values='Count', title='Present vs Absent'))
+    st.plotly_chart(cached_figure('present', lambda: px.pie(
+        pd.DataFrame({'Status': ['Present', 'Absent'], 'Count': [present_today, absent]}),
+        names='Status', values='Count', title='Present vs Absent')))
 
 # --- Register New User ---
 def register_user():
@@ -171,24 +232,25 @@ def register_user():
             else:
                 st.session_state['last_frame'] = frame
                 frame_placeholder.image(frame, channels='BGR')
-                boxes = face_utils.detect_faces(frame)
+                boxes, encodings, _, _ = face_utils.process_frame(frame)
                 if not boxes:
                     st.warning('No face detected! Try again.')
                 else:
-                    encodings = face_utils.encode_faces(frame, boxes)
                     if encodings:
-                        samples.append(encodings[0])
+                        quality = face_utils.template_qualities(frame, boxes[:1])[0]
+                        samples.append((encodings[0], quality))
                         st.session_state['samples'] = samples
                         st.session_state['captured'] = captured + 1
-                        st.success(f'Sample {captured+1} captured!')
+                        st.success(f'Sample {captured+1} captured! (quality {quality:.2f})')
                     else:
                         st.warning('Face encoding failed! Try again.')
         st.write(f"Samples captured: {len(samples)}/5")
         if len(samples) == 5:
-            avg_encoding = np.mean(samples, axis=0)
             if st.button('Save Registration'):
                 user_id = st.session_state['reg_user_id']
-                face_utils.add_encoding(avg_encoding, user_id, st.session_state['reg_name'], st.session_state['reg_department'])
+                # Every sample is kept as its own template, ranked by quality
+                face_utils.add_encodings([e for e, _ in samples], [user_id] * 5, [st.session_state['reg_name']] * 5,
+                                         [st.session_state['reg_department']] * 5, [q for _, q in samples])
                 db.register_user(user_id, st.session_state['reg_name'], st.session_state['reg_department'])
                 st.success('User registered successfully!')
                 st.session_state['samples'] = []
@@ -196,123 +258,390 @@ def register_user():
                 st.session_state['last_frame'] = None
                 st.session_state['registration_ready'] = False
 
+# --- Bulk Enrollment ---
+def bulk_enrollment():
+    import pandas as pd
+    from bulk_enroll import bulk_enroll, collect
+    st.title('👥 Bulk Enrollment')
+    st.caption('A zip with one folder per person (`<department>/<user_id> - Name/*.jpg`), '
+               'or a zip of images plus a CSV manifest with columns user_id,name,department,image.')
+    archive = st.file_uploader('Photos (zip)', type=['zip'])
+    manifest = st.file_uploader('Manifest (optional CSV)', type=['csv'])
+    department = st.text_input('Department for everyone (optional, overrides folders)')
+    workers = st.number_input('Worker processes', 1, os.cpu_count() or 1, os.cpu_count() or 1)
+    dry_run = st.checkbox('Validate only (do not enroll)')
+    if not archive or not st.button('Start Enrollment'):
+        return
+    stamp = int(time.time())
+    zip_path = os.path.join('data', f'enroll_{stamp}.zip')
+    csv_path = os.path.join('data', f'enroll_{stamp}.csv') if manifest else None
+    with open(zip_path, 'wb') as f:
+        f.write(archive.read())
+    if csv_path:
+        with open(csv_path, 'wb') as f:
+            f.write(manifest.read())
+    progress_bar = st.progress(0.0)
+    try:
+        items = collect(csv_path, department or None, images=zip_path) if csv_path else collect(zip_path, department or None)
+        report = bulk_enroll(items, face_utils, db, workers=int(workers), dry_run=dry_run,
+                             progress=lambda done, total: progress_bar.progress(done / total))
+    finally:
+        for path in (zip_path, csv_path):
+            if path:
+                os.remove(path)
+    verb = 'validated' if dry_run else 'enrolled'
+    st.success(f"{report['people']} people ({report['templates']} templates) {verb} from {report['images']} images in {report['elapsed_s']:.1f}s "
+               f"({report['images_per_s']:.1f} images/s).")
+    if report['failures']:
+        failures = pd.DataFrame(report['failures'], columns=['Image', 'User ID', 'Reason'])
+        st.warning(f"{len(failures)} images or people were rejected.")
+        st.dataframe(failures)
+        st.download_button('Download failures (CSV)', failures.to_csv(index=False), 'enrollment_failures.csv',
+                           'text/csv')
+
+# --- Shared recognition handling for camera, image and video ---
+def recognition_scope():
+    """Sidebar choice of the gallery shards (departments) to match first. Returns (shards, fallback)."""
+    shards = st.sidebar.multiselect('Match these departments first', face_utils.shard_names())
+    fallback = st.sidebar.checkbox('Then search everyone else', value=True) if shards else True
+    return shards or None, fallback
+
+def handle_recognitions(encodings, threshold, source, mark=True, scope=(None, None), live=None):
+    # Returns display names and the accepted (user or None, confidence) per face.
+    # live: per-face liveness flags; faces flagged False are recognized but never marked
+    shards, fallback = scope
+    matches, confidences, _ = face_utils.recognize_many(encodings, threshold=1-threshold/100, shards=shards,
+                                                        fallback=fallback)
+    live = [True] * len(matches) if live is None else live
+    names, results, to_mark = [], [], []
+    for user, conf, is_live in zip(matches, confidences, live):
+        if user and conf >= threshold:
+            if mark and is_live:
+                to_mark.append((user, conf))
+            names.append(user['name'] + ('' if is_live else ' (spoof?)'))
+            results.append((user, conf))
+        else:
+            names.append('Unknown')
+            results.append((None, conf))
+            st.warning('Unknown face detected!')
+    mark_users(to_mark, source)
+    return names, results
+
+def mark_users(to_mark, source):
+    # People present today or forwarded within the cooldown never reach the database
+    best = {}
+    for user, conf in to_mark:
+        if user['id'] not in best or conf > best[user['id']][1]:
+            best[user['id']] = (user, conf)
+    to_mark = [best[user_id] for user_id in presence.due(best)]
+    if not to_mark:
+        return
+    # All of this frame's attendance goes to SQLite in a single transaction
+    inserted = db.mark_attendance_many([(user['id'], user['name'], user['department'], conf, source)
+                                        for user, conf in to_mark])
+    presence.mark_present(user['id'] for user, _ in to_mark)
+    for (user, conf), is_new in zip(to_mark, inserted):
+        if is_new:
+            # Email notification stub
+            # send_email(user['name'], user['id'])
+            st.success(f"Attendance marked for {user['name']} ({conf:.1f}%)")
+        else:
+            st.info('Already marked today!')
+
+def mark_live_tracks(tracks, statuses, source):
+    """Liveness-gated marking: a recognized track is marked once it blinked as that person. Returns display names."""
+    # A track re-identified after the liveness check has no status under its new identity yet
+    live = [statuses.get(live_key(t), PENDING) for t in tracks]
+    mark_users([(t.user, t.confidence) for t, status in zip(tracks, live) if t.user and status == LIVE], source)
+    hints = {SPOOF: ' (spoof?)', LIVE: ''}
+    return [t.label + (hints.get(status, ' (blink)') if t.user else '') for t, status in zip(tracks, live)]
+
 # --- Mark Attendance (Live Camera) ---
 def mark_attendance_camera():
     st.title('📷 Mark Attendance (Live Camera)')
     threshold = st.slider('Confidence Threshold (%)', 60, 100, 70)
-    cap = cv2.VideoCapture(0)
+    detect_every = st.sidebar.slider('Run full detection every N frames', 1, 15, 5)
+    workers = st.sidebar.number_input('Detection workers (without tracking)', 1, 8, 2)
+    min_face = st.sidebar.slider('Smallest face to detect (px)', 20, 200, 80)
+    require_liveness = st.sidebar.checkbox('Require a blink before marking (liveness)', value=True)
+    scope = recognition_scope()
+    # Clicking reruns the script, which unwinds the loop below and stops the pipeline
+    if st.button('Stop Camera', key='stop_camera_btn'):
+        st.info('Camera stopped.')
+        return
+    # detect_every == 1 means no tracking: every frame is detected and encoded in parallel.
+    # Liveness is judged per track, so it always needs the tracker.
+    tracker = FaceTracker(detect_every=detect_every) if detect_every > 1 or require_liveness else None
+    liveness = LivenessChecker(LIVENESS_BUDGET_MS) if require_liveness else None
+    # Detection runs at the lowest resolution that still finds min_face; encodings use full frames
+    policy = DetectionPolicy(min_face=min_face, min_face_ratio=0)
+    pipeline = FramePipeline(cv2.VideoCapture(0), face_utils, workers=int(workers), tracker=tracker,
+                             policy=policy, liveness=liveness).start()
     fps_display = st.empty()
     frame_display = st.empty()
-    while True:
-        start = time.time()
-        ret, frame = cap.read()
-        if not ret:
-            st.error('Camera error!')
-            break
-        small = cv2.resize(frame, (0,0), fx=0.5, fy=0.5)
-        boxes = face_utils.detect_faces(small)
-        encodings = face_utils.encode_faces(small, boxes)
-        names = []
-        for encoding in encodings:
-            user, conf = face_utils.recognize(encoding, threshold=1-threshold/100)
-            if user and conf >= threshold:
-                if user['id'] not in st.session_state['marked_today']:
-                    if db.mark_attendance(user['id'], user['name'], user['department'], conf, 'Camera'):
-                        st.session_state['marked_today'].add(user['id'])
-                        # Email notification stub
-                        # send_email(user['name'], user['id'])
-                        st.success(f"Attendance marked for {user['name']} ({conf:.1f}%)")
-                    else:
-                        st.info('Already marked today!')
-                names.append(user['name'])
-            else:
-                names.append('Unknown')
-                st.warning('Unknown face detected!')
-        frame = face_utils.draw_boxes(small, boxes, names)
-        frame_display.image(frame, channels='BGR')
-        fps = 1/(time.time()-start)
-        fps_display.text(f'FPS: {fps:.2f}')
-        if st.button('Stop Camera', key='stop_camera_btn'):
-            break
-    cap.release()
+    throttle = DisplayThrottle(DISPLAY_FPS)
+    try:
+        while True:
+            result = pipeline.get(timeout=2.0)
+            if result is None:
+                if pipeline.finished:
+                    st.error('Camera error!')
+                    break
+                continue
+            start = time.perf_counter()
+            names, results = handle_recognitions(result.encodings, threshold, 'Camera', mark=liveness is None,
+                                                 scope=scope)
+            if tracker is not None:
+                tracker.assign(result.pending, results)
+                names = [t.label for t in result.tracks]
+            pipeline.stats.record('recognize', time.perf_counter() - start)
+            if liveness is not None:
+                # Liveness ran on the pipeline worker, on the RGB frame detection already converted
+                names = mark_live_tracks(result.tracks, result.statuses, 'Camera')
+            if not throttle.ready():
+                continue
+            start = time.perf_counter()
+            frame = face_utils.annotate(result.frame, result.boxes, names, max_width=DISPLAY_WIDTH)
+            frame_display.image(frame, channels='BGR')
+            pipeline.stats.record('display', time.perf_counter() - start)
+            DISPLAY_SECONDS.observe(time.perf_counter() - start)
+            fps_display.text(pipeline.stats.format())
+    finally:
+        pipeline.stop()
+
+# --- Multi-Camera ---
+def multi_camera():
+    import pandas as pd
+    from stream_manager import StreamManager, parse_source
+    st.title('🎦 Multi-Camera')
+    threshold = st.slider('Confidence Threshold (%)', 60, 100, 70)
+    sources = st.text_area('Sources, one per line ([name=]device index, RTSP URL or video file)', '0')
+    workers = st.sidebar.number_input('Shared detection workers', 1, 16, 4)
+    detect_every = st.sidebar.slider('Run full detection every N frames', 1, 15, 5)
+    require_liveness = st.sidebar.checkbox('Require a blink before marking (liveness)', value=True)
+    shards, fallback = recognition_scope()
+    if not st.checkbox('Run cameras'):
+        return
+    manager = StreamManager(face_utils, db, workers=int(workers), threshold=threshold, detect_every=detect_every,
+                            liveness_budget_ms=LIVENESS_BUDGET_MS if require_liveness else None, presence=presence,
+                            fallback=fallback)
+    for index, line in enumerate(l.strip() for l in sources.splitlines()):
+        if line:
+            manager.add_camera(*parse_source(line, index), shards=shards)
+    columns = st.columns(min(len(manager.cameras), 3) or 1)
+    displays = [columns[i % len(columns)].empty() for i in range(len(manager.cameras))]
+    stats_display = st.empty()
+    events_display = st.empty()
+    manager.start()
+    try:
+        # Unchecking the box reruns the script, which unwinds this loop and stops the manager
+        while not manager.finished:
+            for camera, display in zip(manager.cameras, displays):
+                if camera.last_result is not None:
+                    frame, boxes, names = camera.last_result
+                    display.image(face_utils.annotate(frame, boxes, names, max_width=DISPLAY_WIDTH // 2),
+                                  channels='BGR', caption=camera.name)
+            stats_display.dataframe(pd.DataFrame(manager.camera_stats()).T)
+            events = [(datetime.fromtimestamp(e['time']).strftime('%H:%M:%S'), e['camera'], e['user']['name'],
+                       f"{e['confidence']:.1f}", 'Marked' if e['marked'] else 'Already marked')
+                      for e in reversed(manager.events)]
+            if events:
+                events_display.dataframe(pd.DataFrame(events, columns=['Time', 'Camera', 'Name', 'Confidence', 'Status']))
+            time.sleep(0.2)
+    finally:
+        manager.stop()
+
+# --- Remote recognition through service.py ---
+def recognize_via_service(data, threshold, source, scope=(None, None)):
+    from service_client import post_frame
+    # The service matches and marks attendance itself; this only reports the outcome
+    shards, fallback = scope
+    try:
+        result = post_frame(SERVICE_URL, data, threshold=threshold, source=source, shards=shards, fallback=fallback)
+    except OSError as e:
+        st.error(f'Recognition service unavailable: {e}')
+        return [], []
+    boxes, names = [], []
+    for face in result.get('faces', []):
+        boxes.append(tuple(face['box']))
+        user = face['user']
+        if user is None:
+            names.append('Unknown')
+            st.warning('Unknown face detected!')
+            continue
+        # Faces failing the service's texture check are never marked
+        if not face.get('live', True):
+            names.append(user['name'] + ' (spoof?)')
+            st.warning(f"{user['name']} looks like a printed photo or a screen; not marked.")
+            continue
+        names.append(user['name'])
+        if face['marked']:
+            presence.mark_present([user['id']])
+            st.success(f"Attendance marked for {user['name']} ({face['confidence']:.1f}%)")
+        else:
+            st.info('Already marked today!')
+    return boxes, names
 
 # --- Upload Image ---
 def upload_image():
     st.title('🖼️ Upload Image')
     threshold = st.slider('Confidence Threshold (%)', 60, 100, 70)
+    # One image can't show a blink, so only the print/screen texture check runs
+    require_liveness = st.checkbox('Reject printed photos and screens (liveness)', value=True)
+    scope = recognition_scope()
     uploaded = st.file_uploader('Upload an image', type=['jpg', 'png'])
     if uploaded:
         file_bytes = np.asarray(bytearray(uploaded.read()), dtype=np.uint8)
         frame = cv2.imdecode(file_bytes, 1)
-        boxes = face_utils.detect_faces(frame)
-        encodings = face_utils.encode_faces(frame, boxes)
-        names = []
-        for encoding in encodings:
-            user, conf = face_utils.recognize(encoding, threshold=1-threshold/100)
-            if user and conf >= threshold:
-                if user['id'] not in st.session_state['marked_today']:
-                    if db.mark_attendance(user['id'], user['name'], user['department'], conf, 'Image'):
-                        st.session_state['marked_today'].add(user['id'])
-                        st.success(f"Attendance marked for {user['name']} ({conf:.1f}%)")
-                    else:
-                        st.info('Already marked today!')
-                names.append(user['name'])
-            else:
-                names.append('Unknown')
-                st.warning('Unknown face detected!')
-        frame = face_utils.draw_boxes(frame, boxes, names)
-        st.image(frame, channels='BGR')
+        if SERVICE_URL:
+            boxes, names = recognize_via_service(file_bytes.tobytes(), threshold, 'Image', scope)
+        else:
+            boxes, encodings, _, _ = face_utils.process_frame(frame)
+            live = face_utils.basic_liveness(frame, boxes) if require_liveness else None
+            names, _ = handle_recognitions(encodings, threshold, 'Image', scope=scope, live=live)
+        st.image(face_utils.annotate(frame, boxes, names, max_width=DISPLAY_WIDTH), channels='BGR')
 
 # --- Upload Video ---
 def upload_video():
+    import pandas as pd
+    from video_ingest import ingest_video
     st.title('🎥 Upload Video')
     threshold = st.slider('Confidence Threshold (%)', 60, 100, 70)
+    batch_mode = st.checkbox('Fast batch mode (no live preview)', value=True)
+    # Preview tracks faces and waits for a blink; batch mode samples frames and checks texture only
+    require_liveness = st.checkbox('Require liveness before marking', value=True)
+    scope = recognition_scope()
+    if batch_mode:
+        stride = st.slider('Process every Nth frame', 1, 30, 5)
+        workers = st.number_input('Worker processes', 1, os.cpu_count() or 1, os.cpu_count() or 1)
     uploaded = st.file_uploader('Upload a video', type=['mp4', 'avi'])
     if uploaded:
         tfile = os.path.join('data', f'temp_{int(time.time())}.mp4')
         with open(tfile, 'wb') as f:
             f.write(uploaded.read())
+        if batch_mode:
+            progress_bar = st.progress(0.0)
+            try:
+                report = ingest_video(tfile, face_utils, db, workers=int(workers), stride=stride, threshold=threshold,
+                                      progress=lambda done, total: progress_bar.progress(done / total),
+                                      shards=scope[0], fallback=scope[1], liveness=require_liveness)
+            finally:
+                os.remove(tfile)
+            presence.mark_present(report['marked'])
+            st.success(f"Processed {report['frames']} frames ({report['sampled']} sampled) in "
+                       f"{report['elapsed_s']:.1f}s, {report['frames_per_s']:.0f} frames/s. "
+                       f"Marked {len(report['marked'])} of {len(report['people'])} recognized people.")
+            if report['spoofs']:
+                st.warning(f"{report['spoofs']} sightings failed the liveness check and were not counted.")
+            if report['people']:
+                st.dataframe(pd.DataFrame([{
+                    'Name': p['user']['name'], 'User ID': p['user']['id'], 'Department': p['user']['department'],
+                    'Sightings': p['sightings'], 'Best Confidence': round(p['best_confidence'], 1),
+                    'First Seen (s)': round(p['first_seen_s'], 1),
+                    'Marked': p['user']['id'] in report['marked']
+                } for p in report['people']]))
+            return
         cap = cv2.VideoCapture(tfile)
         fps_display = st.empty()
         frame_display = st.empty()
+        tracker = FaceTracker(detect_every=5)
+        liveness = LivenessChecker(LIVENESS_BUDGET_MS) if require_liveness else None
+        policy = DetectionPolicy(min_face=80, min_face_ratio=0)
+        throttle = DisplayThrottle(DISPLAY_FPS)
         while cap.isOpened():
             start = time.time()
             ret, frame = cap.read()
             if not ret:
                 break
-            small = cv2.resize(frame, (0,0), fx=0.5, fy=0.5)
-            boxes = face_utils.detect_faces(small)
-            encodings = face_utils.encode_faces(small, boxes)
-            names = []
-            for encoding in encodings:
-                user, conf = face_utils.recognize(encoding, threshold=1-threshold/100)
-                if user and conf >= threshold:
-                    if user['id'] not in st.session_state['marked_today']:
-                        if db.mark_attendance(user['id'], user['name'], user['department'], conf, 'Video'):
-                            st.session_state['marked_today'].add(user['id'])
-                            st.success(f"Attendance marked for {user['name']} ({conf:.1f}%)")
-                        else:
-                            st.info('Already marked today!')
-                    names.append(user['name'])
+            with VIDEO_FRAME_SECONDS.time():
+                boxes, encodings, tracks, pending = face_utils.process_frame(frame, policy, tracker)
+                _, results = handle_recognitions(encodings, threshold, 'Video', mark=liveness is None, scope=scope)
+                tracker.assign(pending, results)
+                if liveness is None:
+                    labels = [t.label for t in tracks]
                 else:
-                    names.append('Unknown')
-                    st.warning('Unknown face detected!')
-            frame = face_utils.draw_boxes(small, boxes, names)
-            frame_display.image(frame, channels='BGR')
-            fps = 1/(time.time()-start)
-            fps_display.text(f'FPS: {fps:.2f}')
+                    statuses = liveness.update(frame, tracks, rgb=face_utils.converted_rgb(frame))
+                    labels = mark_live_tracks(tracks, statuses, 'Video')
+            if throttle.ready():
+                with DISPLAY_SECONDS.time():
+                    frame = face_utils.annotate(frame, boxes, labels, max_width=DISPLAY_WIDTH)
+                    frame_display.image(frame, channels='BGR')
+                fps = 1/(time.time()-start)
+                fps_display.text(f'FPS: {fps:.2f}')
             if st.button('Stop Video'):
                 break
         cap.release()
         os.remove(tfile)
 
 # --- Attendance Records ---
+def discard_export(path):
+    # The download is served from memory, so the file is no longer needed once clicked
+    st.session_state['records_export'] = None
+    if os.path.exists(path):
+        os.remove(path)
+
 def attendance_records():
+    import pandas as pd
     st.title('📋 Attendance Records')
-    records = db.get_attendance_records()
-    df = pd.DataFrame(records, columns=['ID', 'User ID', 'Name', 'Department', 'Date', 'Time', 'Confidence', 'Source'])
+    # Filters are pushed down into SQL; only the current page is ever loaded
+    col1, col2 = st.columns(2)
+    date_range = col1.date_input('Date range', value=())
+    department = col2.selectbox('Department', ['All'] + db.get_departments())
+    user_id = col1.text_input('User ID')
+    source = col2.selectbox('Source', ['All', 'Camera', 'Image', 'Video'])
+    page_size = st.selectbox('Rows per page', [25, 50, 100, 500], index=2)
+    filters = {
+        'date_from': date_range[0] if len(date_range) > 0 else None,
+        'date_to': date_range[1] if len(date_range) > 1 else None,
+        'department': None if department == 'All' else department,
+        'user_id': user_id.strip() or None,
+        'source': None if source == 'All' else source,
+    }
+    filter_key = repr((sorted(filters.items(), key=lambda item: item[0]), page_size))
+    if st.session_state.get('records_filter_key') != filter_key:
+        st.session_state['records_filter_key'] = filter_key
+        st.session_state['records_cursors'] = [None]
+        st.session_state['records_last'] = None
+    cursors = st.session_state['records_cursors']
+    prev_col, page_col, next_col = st.columns([1, 2, 1])
+    if prev_col.button('Previous', disabled=len(cursors) == 1):
+        cursors.pop()
+    if next_col.button('Next', disabled=st.session_state['records_last'] is None):
+        cursors.append(st.session_state['records_last'])
+    records = db.get_attendance_page(limit=page_size, after=cursors[-1], **filters)
+    # (date, time, id) of the last row is the keyset cursor for the next page
+    st.session_state['records_last'] = (records[-1][4], records[-1][5], records[-1][0]) if len(records) == page_size else None
+    page_col.write(f'Page {len(cursors)}')
+    df = pd.DataFrame(records, columns=ATTENDANCE_COLUMNS)
     st.dataframe(df)
-    st.download_button('Download CSV', df.to_csv(index=False), file_name='attendance.csv')
+
+    st.subheader('Export')
+    formats = ['CSV', 'Parquet'] if parquet_available() else ['CSV']
+    export_format = st.radio('Format', formats, horizontal=True)
+    if st.button('Prepare Export'):
+        # Streamed to disk chunk by chunk from a cursor, not built in memory
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        remove_old_exports(EXPORT_DIR, EXPORT_MAX_AGE_S)
+        previous = st.session_state.get('records_export')
+        if previous and os.path.exists(previous[0]):
+            os.remove(previous[0])
+        ext = 'parquet' if export_format == 'Parquet' else 'csv'
+        path = os.path.join(EXPORT_DIR, f"attendance_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{ext}")
+        count = write_parquet(db, path, **filters) if ext == 'parquet' else write_csv(db, path, **filters)
+        st.session_state['records_export'] = (path, count)
+    export = st.session_state.get('records_export')
+    if export and os.path.exists(export[0]):
+        path, count = export
+        size_mb = os.path.getsize(path) / 2**20
+        if size_mb <= EXPORT_DOWNLOAD_MAX_MB:
+            with open(path, 'rb') as f:
+                data = f.read(EXPORT_DOWNLOAD_MAX_MB * 2**20)
+            st.download_button(f'Download {os.path.basename(path)} ({count} rows)', data,
+                               file_name=os.path.basename(path), on_click=discard_export, args=(path,))
+        else:
+            st.warning(f'{count} rows ({size_mb:.0f} MB) is over the {EXPORT_DOWNLOAD_MAX_MB} MB browser '
+                       f'download limit. Copy {path} from the server within {EXPORT_MAX_AGE_S // 60} minutes, '
+                       'or narrow the filters.')
 
     st.subheader('Delete User by User ID')
     user_id_to_delete = st.text_input('Enter User ID to delete user and all their attendance records:')
@@ -323,6 +652,8 @@ def attendance_records():
             if user:
                 db.delete_user(user_id_to_delete)
                 face_utils.delete_user(user_id_to_delete)
+                # Their attendance rows are gone too
+                presence.warm()
                 st.success(f'User {user_id_to_delete} deleted successfully!')
             else:
                 st.warning('User ID not found.')
@@ -330,18 +661,123 @@ def attendance_records():
             st.warning('Please enter a User ID.')
 
 # --- Analytics ---
+@st.cache_resource
+
+def get_analytics(_db):
+    # One per process, so materialized views are shared by every session
+    from utils.analytics import AttendanceAnalytics
+    return AttendanceAnalytics(_db)
+
 def analytics():
+    import plotly.express as px
     st.title('📈 Analytics')
-    # Reuse dashboard charts, or add more advanced analytics here
-    dashboard()
+    engine = get_analytics(db)
+    today = datetime.now().date()
+    col1, col2 = st.columns(2)
+    date_range = col1.date_input('Date range', value=(today - timedelta(days=ANALYTICS_DAYS - 1), today))
+    department = col2.selectbox('Department', ['All'] + db.get_departments())
+    if len(date_range) < 2:
+        st.info('Pick the last day of the range.')
+        return
+    date_from, date_to = date_range
+    department = None if department == 'All' else department
+    col1, col2, col3 = st.columns(3)
+    period = col1.selectbox('Trend period', ['week', 'month', 'day'])
+    start = col2.time_input('Start time', datetime.strptime(WORKDAY_START, '%H:%M').time())
+    grace = col3.number_input('Grace (minutes)', 0, 120, LATE_GRACE_MINUTES)
+    key = (date_from, date_to, department)
+
+    daily = engine.daily(date_from, date_to, department)
+    if not daily['Present'].any():
+        st.info('No attendance in this range.')
+        return
+    open_days = daily[daily['Present'] > 0]
+    punctuality = engine.punctuality(date_from, date_to, start.strftime('%H:%M'), grace, department)
+    distribution = engine.arrival_distribution(date_from, date_to, department)
+    median = distribution['Time'][distribution['Cumulative %'].searchsorted(50.0)]
+    on_time = (punctuality['Days'] * punctuality['On time %']).sum() / punctuality['Days'].sum()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric('Open days', len(open_days))
+    col2.metric('Present per day', f"{open_days['Present'].mean():.0f}", f"{open_days['Rate %'].mean():.1f}%")
+    col3.metric('On time', f'{on_time:.1f}%')
+    col4.metric('Median arrival', median)
+
+    st.plotly_chart(cached_figure(('analytics-daily',) + key, lambda: px.line(
+        daily.reset_index(), x='Date', y='Present', title='Present per Day')))
+    trend = engine.department_trend(date_from, date_to, period)
+    st.plotly_chart(cached_figure(('analytics-departments', date_from, date_to, period), lambda: px.line(
+        trend, x='Period', y='Rate %', color='Department', markers=True,
+        title=f'Department Attendance Rate per {period.title()}')))
+    layout = st.radio('Calendar', ['Week', 'Month'], horizontal=True)
+    st.plotly_chart(cached_figure(('analytics-calendar', layout) + key, lambda: px.imshow(
+        engine.calendar(date_from, date_to, department, layout.lower()), aspect='auto',
+        labels={'color': 'Present'}, title=f'Present by Day ({layout.lower()}ly calendar)')))
+    st.plotly_chart(cached_figure(('analytics-arrivals',) + key, lambda: px.imshow(
+        engine.arrival_heatmap(date_from, date_to, department), aspect='auto',
+        labels={'color': 'Arrivals'}, title='First Arrivals by Weekday and Hour')))
+    st.plotly_chart(cached_figure(('analytics-distribution',) + key, lambda: px.bar(
+        distribution, x='Time', y='Arrivals', hover_data=['Cumulative %'],
+        title='First-Arrival Time Distribution')))
+
+    st.subheader('Punctuality')
+    st.caption(f"On time means first arrival by {start.strftime('%H:%M')} plus {grace} minutes; "
+               'attendance % counts open days only.')
+    st.dataframe(punctuality)
+    st.download_button('Download CSV', punctuality.to_csv(index=False), 'punctuality.csv', 'text/csv')
+
+# --- System ---
+def system_page():
+    import pandas as pd
+    st.title('🖥️ System')
+    if not metrics.is_enabled():
+        st.warning('Metrics are disabled (ATTENDANCE_METRICS=0).')
+    col1, col2 = st.columns(2)
+    col1.button('Refresh')
+    if col2.button('Reset metrics'):
+        metrics.REGISTRY.reset()
+        db.metrics.reset()
+    rows = metrics.snapshot()
+
+    def labels(row):
+        return ', '.join(f'{k}={v}' for k, v in row['labels'].items())
+
+    timings = [r for r in rows if r['type'] == 'histogram' and r['count']]
+    st.subheader('Latency')
+    if timings:
+        st.dataframe(pd.DataFrame([{
+            'Metric': r['name'], 'Labels': labels(r), 'Count': r['count'], 'Mean (ms)': round(r['mean_ms'], 2),
+            'p50 (ms)': round(r['p50_ms'], 2), 'p95 (ms)': round(r['p95_ms'], 2), 'p99 (ms)': round(r['p99_ms'], 2)
+        } for r in timings]))
+    else:
+        st.info('No timings recorded yet in this process.')
+    st.subheader('Counters')
+    st.dataframe(pd.DataFrame([{'Metric': r['name'], 'Labels': labels(r), 'Value': r['value']}
+                               for r in rows if r['type'] != 'histogram']))
+    st.subheader('Database')
+    pool = db.pool_stats()
+    st.dataframe(pd.DataFrame([{'Stat': k, 'Value': round(v, 4) if isinstance(v, float) else v}
+                               for k, v in {**pool, **{f'cache_{k}': v for k, v in db.cache_stats().items()}}.items()]))
+    st.subheader('Prometheus')
+    if METRICS_PORT:
+        st.caption(f'Scrape http://127.0.0.1:{METRICS_PORT}/metrics')
+    else:
+        st.caption('Set ATTENDANCE_METRICS_PORT to serve these metrics for scraping.')
+    text = metrics.export_prometheus()
+    st.download_button('Download metrics', text, 'metrics.txt', 'text/plain')
+    with st.expander('Text format'):
+        st.code(text, language='text')
 
 # --- Main Routing ---
 if choice == 'Dashboard':
     dashboard()
 elif choice == 'Register New User':
     register_user()
+elif choice == 'Bulk Enrollment':
+    bulk_enrollment()
 elif choice == 'Mark Attendance (Live Camera)':
     mark_attendance_camera()
+elif choice == 'Multi-Camera':
+    multi_camera()
 elif choice == 'Upload Image':
     upload_image()
 elif choice == 'Upload Video':
@@ -350,3 +786,5 @@ elif choice == 'Attendance Records':
     attendance_records()
 elif choice == 'Analytics':
     analytics()
+elif choice == 'System':
+    system_page()
@@ -0,0 +1,103 @@
+"""
+analytics_benchmark.py
+Time to compute each Analytics page view over a synthetic semester.
+
+A temporary database is filled with --users people in --departments departments
+over --days days (weekdays only, each person present with --presence probability,
+first arrivals normally distributed around 08:55). Every view is computed cold
+(query cache and materialized views empty) and warm, --repeat times each.
+
+Usage: python -m benchmarks.analytics_benchmark --users 2000 --days 120 --json analytics.json
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from database import Database
+from utils.analytics import AttendanceAnalytics
+from benchmarks.common import summarize
+
+
+def seed(db, users, departments, days, presence, seed=0):
+    rng = np.random.default_rng(seed)
+    people = [(f'user{i:06d}', f'User {i}', f'Dept {i % departments}') for i in range(users)]
+    db.register_users(people)
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    rows = 0
+    for offset in range(days - 1, -1, -1):
+        day = today - timedelta(days=offset)
+        if day.weekday() >= 5:
+            continue
+        present = np.flatnonzero(rng.random(users) < presence)
+        arrivals = np.clip(rng.normal(8.9 * 3600, 900, len(present)), 6 * 3600, 12 * 3600).astype(int)
+        db.mark_attendance_many([people[i] + (90.0, 'Camera', day + timedelta(seconds=int(s)))
+                                 for i, s in zip(present.tolist(), arrivals.tolist())])
+        rows += len(present)
+    return (today - timedelta(days=days - 1)).date(), today.date(), rows
+
+
+def views(engine, date_from, date_to):
+    return [
+        ('daily', lambda: engine.daily(date_from, date_to)),
+        ('department_trend', lambda: engine.department_trend(date_from, date_to, 'week')),
+        ('calendar', lambda: engine.calendar(date_from, date_to)),
+        ('arrival_heatmap', lambda: engine.arrival_heatmap(date_from, date_to)),
+        ('arrival_distribution', lambda: engine.arrival_distribution(date_from, date_to)),
+        ('punctuality', lambda: engine.punctuality(date_from, date_to)),
+    ]
+
+
+def run(db, date_from, date_to, repeat):
+    cold, warm = {}, {}
+    for _ in range(repeat):
+        db.cache.clear()
+        engine = AttendanceAnalytics(db)
+        for name, view in views(engine, date_from, date_to):
+            start = time.perf_counter()
+            view()
+            cold.setdefault(name, []).append(time.perf_counter() - start)
+        for name, view in views(engine, date_from, date_to):
+            start = time.perf_counter()
+            view()
+            warm.setdefault(name, []).append(time.perf_counter() - start)
+    return {name: {'cold': summarize(cold[name]), 'warm': summarize(warm[name])} for name in cold}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--departments', type=int, default=8)
+    parser.add_argument('--days', type=int, default=120, help='Calendar days of history, ending today')
+    parser.add_argument('--presence', type=float, default=0.85, help='Chance each person comes on a weekday')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help='Write results to this file')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='analytics-benchmark-')
+    db = Database(os.path.join(directory, 'attendance.db'))
+    try:
+        db.create_tables()
+        start = time.perf_counter()
+        date_from, date_to, rows = seed(db, args.users, args.departments, args.days, args.presence)
+        print(f'Seeded {rows} attendance rows ({date_from} to {date_to}) in {time.perf_counter() - start:.1f} s')
+        results = run(db, date_from, date_to, args.repeat)
+    finally:
+        db.close()
+        shutil.rmtree(directory, ignore_errors=True)
+    print(f"{'view':>22} {'cold p50':>9} {'cold max':>9} {'warm p50':>9}  (ms)")
+    for name, result in results.items():
+        print(f"{name:>22} {result['cold']['p50_ms']:9.1f} {result['cold']['max_ms']:9.1f} "
+              f"{result['warm']['p50_ms']:9.3f}")
+    total = sum(result['cold']['p50_ms'] for result in results.values())
+    print(f"{'page (cold)':>22} {total:9.1f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'rows': rows, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+ann_benchmark.py
+Recall/latency comparison of the exact, IVF and IVF-PQ gallery indexes.
+
+Usage: python -m benchmarks.ann_benchmark --size 100000 --nprobe 4 8 16 32
+"""
+import argparse
+import json
+import time
+import numpy as np
+from utils.gallery import Gallery
+from utils.ann_index import make_index
+from benchmarks.common import synthetic_gallery, synthetic_queries, summarize, time_calls
+
+
+def build_gallery(data):
+    gallery = Gallery(capacity=len(data))
+    ids = [f'user{i}' for i in range(len(data))]
+    gallery.extend(data, ids, ids, ['bench'] * len(data))
+    return gallery
+
+
+def run_index(gallery, kind, queries, truth, **params):
+    params = {k: v for k, v in params.items() if v is not None}
+    extra = {'min_train_size': 0} if kind != 'exact' else {}
+    index = make_index(kind, gallery, **params, **extra)
+    start = time.perf_counter()
+    index.rebuild()
+    build_s = time.perf_counter() - start
+    found = [int(index.search(q[None, :], k=1)[1][0, 0]) for q in queries]
+    latencies = time_calls(lambda q: index.search(q[None, :], k=1), queries)
+    result = {'index': kind, 'params': params, 'build_s': build_s,
+              'recall_at_1': float(np.mean(np.asarray(found) == truth))}
+    result.update(summarize(latencies))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--noise', type=float, default=0.02)
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[4, 8, 16, 32])
+    parser.add_argument('--rerank', type=int, default=64)
+    parser.add_argument('--skip-pq', action='store_true')
+    parser.add_argument('--json', help='Write results to this file')
+    args = parser.parse_args()
+
+    data = synthetic_gallery(args.size)
+    queries, truth = synthetic_queries(data, args.queries, noise=args.noise)
+    gallery = build_gallery(data)
+    # Ground truth is the exact index, not the row the query was derived from
+    exact = make_index('exact', gallery)
+    truth = np.array([int(exact.search(q[None, :], k=1)[1][0, 0]) for q in queries])
+
+    results = [run_index(gallery, 'exact', queries, truth)]
+    for nprobe in args.nprobe:
+        results.append(run_index(gallery, 'ivf', queries, truth, nlist=args.nlist, nprobe=nprobe))
+        if not args.skip_pq:
+            results.append(run_index(gallery, 'ivfpq', queries, truth, nlist=args.nlist,
+                                     nprobe=nprobe, rerank=args.rerank))
+
+    print(f"{'index':8} {'params':40} {'recall@1':>9} {'p50 ms':>8} {'p95 ms':>8} {'build s':>8}")
+    for r in results:
+        params = ', '.join(f'{k}={v}' for k, v in r['params'].items())
+        print(f"{r['index']:8} {params:40} {r['recall_at_1']:9.3f} {r['p50_ms']:8.3f} "
+              f"{r['p95_ms']:8.3f} {r['build_s']:8.2f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'size': args.size, 'queries': args.queries, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
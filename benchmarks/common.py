@@ -0,0 +1,48 @@
+"""
+common.py
+Shared helpers for the benchmark scripts: synthetic galleries and latency summaries.
+"""
+import time
+import numpy as np
+
+ENCODING_DIM = 128
+
+
+def synthetic_gallery(size, dim=ENCODING_DIM, seed=0):
+    """Random unit vectors standing in for enrolled face encodings."""
+    rng = np.random.default_rng(seed)
+    data = rng.standard_normal((size, dim)).astype(np.float32)
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    return data
+
+
+def synthetic_queries(gallery, count, noise=0.02, seed=1):
+    """Noisy copies of random gallery rows; returns (queries, true_rows)."""
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(gallery), count)
+    queries = gallery[rows] + noise * rng.standard_normal((count, gallery.shape[1])).astype(np.float32)
+    return queries.astype(np.float32), rows
+
+
+def summarize(latencies):
+    """Latency percentiles in milliseconds from a list of durations in seconds."""
+    ms = np.asarray(latencies, dtype=np.float64) * 1000.0
+    if not len(ms):
+        return {'count': 0}
+    return {
+        'count': int(len(ms)),
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'max_ms': float(ms.max()),
+    }
+
+
+def time_calls(fn, items):
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - start)
+    return latencies
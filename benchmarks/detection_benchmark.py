@@ -0,0 +1,125 @@
+"""
+detection_benchmark.py
+Latency against detection recall for DetectionPolicy presets on a folder of photos.
+
+Recall is measured against a reference policy (full-resolution HOG with one
+upsample, i.e. the old detect_faces) unless --reference names another preset.
+
+Usage: python -m benchmarks.detection_benchmark photos/ --policies legacy half adaptive adaptive-haar
+"""
+import argparse
+import json
+import os
+import cv2
+import numpy as np
+from utils.detection import DetectionPolicy
+from utils.tracking import iou_matrix
+from benchmarks.common import summarize, time_calls
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+PRESETS = {
+    'legacy': {'scale': 1.0, 'upsample': 1},
+    'half': {'scale': 0.5, 'upsample': 1},
+    'adaptive': {},
+    'adaptive-up0': {'upsample': 0},
+    'adaptive-haar': {'prefilter': 'haar'},
+    'adaptive-haar-roi': {'prefilter': 'haar', 'prefilter_mode': 'roi'},
+    'adaptive-dnn': {'prefilter': 'dnn'},
+    'cnn': {'model': 'cnn', 'upsample': 1},
+}
+
+
+def load_images(paths, max_images=None):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += [os.path.join(path, n) for n in sorted(os.listdir(path)) if n.lower().endswith(IMAGE_EXTENSIONS)]
+        else:
+            files.append(path)
+    images = []
+    for path in files[:max_images]:
+        frame = cv2.imread(path)
+        if frame is not None:
+            images.append((path, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
+    return images
+
+
+def match_counts(found, truth, iou=0.5):
+    """(true positives, found, truth) with each reference box matched at most once."""
+    if not found or not truth:
+        return 0, len(found), len(truth)
+    overlaps = iou_matrix(found, truth)
+    matched = 0
+    for _ in range(min(len(found), len(truth))):
+        fi, ti = np.unravel_index(np.argmax(overlaps), overlaps.shape)
+        if overlaps[fi, ti] < iou:
+            break
+        matched += 1
+        overlaps[fi, :] = 0
+        overlaps[:, ti] = 0
+    return matched, len(found), len(truth)
+
+
+def run_policy(name, policy, images, truth, repeat=1):
+    boxes = [policy.detect(rgb) for _, rgb in images]
+    latencies = time_calls(policy.detect, [rgb for _ in range(repeat) for _, rgb in images])
+    tp = found = total = 0
+    for got, expected in zip(boxes, truth):
+        counts = match_counts(got, expected)
+        tp, found, total = tp + counts[0], found + counts[1], total + counts[2]
+    result = {
+        'policy': name,
+        'params': repr(policy),
+        'faces': found,
+        'recall': tp / total if total else 1.0,
+        'precision': tp / found if found else 1.0,
+        'mean_scale': float(np.mean([policy.scale_for(rgb.shape) for _, rgb in images])),
+    }
+    result.update(summarize(latencies))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', help='Images or directories of images')
+    parser.add_argument('--policies', nargs='+', default=['legacy', 'half', 'adaptive', 'adaptive-up0',
+                                                          'adaptive-haar', 'adaptive-haar-roi'],
+                        choices=sorted(PRESETS))
+    parser.add_argument('--reference', default='legacy', choices=sorted(PRESETS))
+    parser.add_argument('--min-face', type=int, default=40, help='min_face for the adaptive presets')
+    parser.add_argument('--min-face-ratio', type=float, default=0.04)
+    parser.add_argument('--max-images', type=int, default=None)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--json', help='Write results to this file')
+    args = parser.parse_args()
+
+    images = load_images(args.paths, args.max_images)
+    if not images:
+        parser.error('No readable images found')
+
+    def make(name):
+        params = {'min_face': args.min_face, 'min_face_ratio': args.min_face_ratio}
+        params.update(PRESETS[name])
+        return DetectionPolicy(**params)
+
+    reference = make(args.reference)
+    truth = [reference.detect(rgb) for _, rgb in images]
+    print(f'{len(images)} images, {sum(map(len, truth))} reference faces ({args.reference})')
+    results = []
+    for name in args.policies:
+        try:
+            result = run_policy(name, make(name), images, truth, args.repeat)
+        except IOError as e:
+            print(f'{name:>18}: skipped ({e})')
+            continue
+        results.append(result)
+        print(f"{name:>18}: recall {result['recall']:.3f}  precision {result['precision']:.3f}  "
+              f"scale {result['mean_scale']:.2f}  p50 {result['p50_ms']:8.1f} ms  p95 {result['p95_ms']:8.1f} ms")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+frame_benchmark.py
+Per-frame latency and transient memory of the old detect/encode/display path
+(a color conversion per call, a fresh resize, every frame drawn and encoded for
+display) against FaceUtils.process_frame with a throttled display.
+
+--overhead-only skips the dlib calls (fixed boxes, no encodings) so the frame
+handling cost is not hidden behind detection time.
+
+Usage: python -m benchmarks.frame_benchmark --video clip.mp4 --frames 200 --camera-fps 30 --display-fps 10
+"""
+import argparse
+import json
+import tempfile
+import time
+import tracemalloc
+import cv2
+import numpy as np
+from face_utils import FaceUtils
+from utils.detection import DetectionPolicy
+from benchmarks.common import summarize
+
+
+def load_frames(video, count, width, height, seed=0):
+    if video:
+        cap = cv2.VideoCapture(video)
+        frames = []
+        while len(frames) < count:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+        if frames:
+            return frames
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def synthetic_boxes(frame):
+    height, width = frame.shape[:2]
+    side = height // 4
+    return [(height // 3, width // 2 + side // 2, height // 3 + side, width // 2 - side // 2)]
+
+
+def display_encode(frame):
+    # What st.image(frame, channels='BGR') does: swap channels, then compress
+    cv2.imencode('.jpg', cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+
+def legacy_frame(face_utils, policy, frame, index, display_every, overhead_only):
+    scale = policy.scale_for(frame.shape)
+    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    small = cv2.resize(rgb, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else rgb
+    if overhead_only:
+        boxes = synthetic_boxes(frame)
+    else:
+        import face_recognition
+        found = face_recognition.face_locations(small, number_of_times_to_upsample=policy.upsample, model=policy.model)
+        boxes = [tuple(int(v / scale) for v in box) for box in found]
+    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    if not overhead_only and boxes:
+        face_recognition.face_encodings(rgb, boxes)
+    display_encode(face_utils.draw_boxes(frame, boxes))
+
+
+def process_frame(face_utils, policy, frame, index, display_every, overhead_only):
+    if overhead_only:
+        rgb = face_utils.to_rgb(frame)
+        scale = policy.scale_for(frame.shape)
+        if scale < 1:
+            policy._resize(rgb, scale)
+        boxes = synthetic_boxes(frame)
+    else:
+        boxes, _, _, _ = face_utils.process_frame(frame, policy)
+    if index % display_every == 0:
+        display_encode(face_utils.annotate(frame, boxes, max_width=960))
+
+
+PATHS = {'legacy': legacy_frame, 'process_frame': process_frame}
+
+
+def run_path(name, face_utils, policy, frames, display_every, overhead_only):
+    fn = PATHS[name]
+    # Warm-up: buffers and detector state
+    for index, frame in enumerate(frames[:3]):
+        fn(face_utils, policy, frame.copy(), index, display_every, overhead_only)
+    # Drawing happens in place, so every run gets fresh copies made outside the timed region
+    work = [frame.copy() for frame in frames]
+    latencies = []
+    for index, frame in enumerate(work):
+        start = time.perf_counter()
+        fn(face_utils, policy, frame, index, display_every, overhead_only)
+        latencies.append(time.perf_counter() - start)
+    # Transient allocation per frame, measured in a separate pass since tracing slows everything down
+    work = [frame.copy() for frame in frames]
+    tracemalloc.start()
+    transient = []
+    for index, frame in enumerate(work):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        fn(face_utils, policy, frame, index, display_every, overhead_only)
+        transient.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    result = {'path': name, 'transient_kb_mean': float(np.mean(transient)) / 1024,
+              'transient_kb_max': float(np.max(transient)) / 1024}
+    result.update(summarize(latencies))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video', help='Video file to take frames from (default: synthetic noise frames)')
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--min-face', type=int, default=80)
+    parser.add_argument('--camera-fps', type=float, default=30)
+    parser.add_argument('--display-fps', type=float, default=10)
+    parser.add_argument('--overhead-only', action='store_true', help='Skip detection/encoding, time frame handling only')
+    parser.add_argument('--json', help='Write results to this file')
+    args = parser.parse_args()
+
+    frames = load_frames(args.video, args.frames, args.width, args.height)
+    # Empty throwaway gallery: recognition is not part of this benchmark
+    face_utils = FaceUtils(tempfile.mkdtemp(), legacy_path=None)
+    policy = DetectionPolicy(min_face=args.min_face, min_face_ratio=0)
+    display_every = max(1, int(round(args.camera_fps / args.display_fps)))
+    print(f'{len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]}, display every {display_every} frames')
+    results = []
+    for name in PATHS:
+        result = run_path(name, face_utils, policy, frames, display_every, args.overhead_only)
+        results.append(result)
+        print(f"{name:>14}: p50 {result['p50_ms']:7.2f} ms  p95 {result['p95_ms']:7.2f} ms  "
+              f"transient {result['transient_kb_mean']:8.0f} KB/frame (max {result['transient_kb_max']:.0f} KB)")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
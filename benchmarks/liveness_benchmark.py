@@ -0,0 +1,109 @@
+"""
+liveness_benchmark.py
+Per-frame cost of LivenessChecker.update against its budget, and how often each
+track gets sampled (a blink lasts 100-300 ms, so tracks must be sampled more
+often than that to catch one).
+
+Synthetic runs use --faces fixed boxes on noise frames, the worst case: nobody
+ever blinks, so every track stays undecided and keeps costing. With --video,
+boxes come from detection and tracking like the camera page.
+
+Usage: python -m benchmarks.liveness_benchmark --faces 1 4 8 --budget-ms 2 4 8 --fps 30
+"""
+import argparse
+import json
+import time
+import cv2
+import numpy as np
+import face_recognition
+from utils.liveness import LivenessChecker, texture_score
+from utils.tracking import FaceTracker, Track
+from utils.detection import DetectionPolicy
+from benchmarks.common import summarize, time_calls
+from benchmarks.frame_benchmark import load_frames
+
+
+def synthetic_tracks(frame, count, side=160):
+    height, width = frame.shape[:2]
+    per_row = max(1, width // side)
+    tracks = []
+    for i in range(count):
+        top, left = (i // per_row) * side % max(height - side, 1), (i % per_row) * side
+        tracks.append(Track(i, (top, left + side, top + side, left)))
+    return tracks
+
+
+def video_tracks(frames, min_face):
+    # Visible tracks per frame from the same detect-and-track loop the camera page runs
+    policy = DetectionPolicy(min_face=min_face, min_face_ratio=0)
+    tracker = FaceTracker(detect_every=5)
+    return [tracker.step(frame, lambda f: policy.detect(cv2.cvtColor(f, cv2.COLOR_BGR2RGB)))[0]
+            for frame in frames]
+
+
+def run_budget(frames, tracks_per_frame, budget_ms, fps):
+    checker = LivenessChecker(budget_ms=budget_ms)
+    latencies, samples = [], []
+    last_sampled, gaps = {}, []
+    for index, (frame, tracks) in enumerate(zip(frames, tracks_per_frame)):
+        start = time.perf_counter()
+        checker.update(frame, tracks)
+        latencies.append(time.perf_counter() - start)
+        samples.append(checker.last_checked)
+        for track in tracks:
+            state = checker._states.get(track.id)
+            if state is not None and state.last_checked == checker.frame_index:
+                if track.id in last_sampled:
+                    gaps.append(index - last_sampled[track.id])
+                last_sampled[track.id] = index
+    result = {'budget_ms': budget_ms, 'faces': int(np.mean([len(t) for t in tracks_per_frame])),
+              'samples_per_frame': float(np.mean(samples)),
+              'sample_gap_ms_mean': float(np.mean(gaps)) * 1000 / fps if gaps else None,
+              'sample_gap_ms_max': float(np.max(gaps)) * 1000 / fps if gaps else None,
+              'over_budget': float(np.mean(np.asarray(latencies) * 1000 > budget_ms * 1.25))}
+    result.update(summarize(latencies))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video', help='Video with real faces (default: synthetic frames and boxes)')
+    parser.add_argument('--frames', type=int, default=150)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--faces', type=int, nargs='+', default=[1, 4, 8], help='Synthetic faces per frame')
+    parser.add_argument('--budget-ms', type=float, nargs='+', default=[2.0, 4.0, 8.0])
+    parser.add_argument('--fps', type=float, default=30, help='Camera frame rate, to turn sample gaps into ms')
+    parser.add_argument('--min-face', type=int, default=80)
+    parser.add_argument('--json', help='Write results to this file')
+    args = parser.parse_args()
+
+    frames = load_frames(args.video, args.frames, args.width, args.height)
+    rgb = cv2.cvtColor(frames[0], cv2.COLOR_BGR2RGB)
+    box = synthetic_tracks(frames[0], 1)[0].box
+    landmark_ms = summarize(time_calls(lambda _: face_recognition.face_landmarks(rgb, [box]), range(50)))['p50_ms']
+    texture_ms = summarize(time_calls(lambda _: texture_score(rgb, box), range(200)))['p50_ms']
+    print(f'One sample: landmarks {landmark_ms:.2f} ms, texture {texture_ms:.2f} ms (p50)')
+
+    scenarios = [('video', video_tracks(frames, args.min_face))] if args.video else \
+        [(f'{n} faces', [synthetic_tracks(frames[0], n)] * len(frames)) for n in args.faces]
+    results = []
+    print(f"{'scenario':>10} {'budget':>7} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'samples':>8} "
+          f"{'gap ms':>8} {'max gap':>8}")
+    for name, tracks_per_frame in scenarios:
+        for budget in args.budget_ms:
+            result = run_budget(frames, tracks_per_frame, budget, args.fps)
+            result['scenario'] = name
+            results.append(result)
+            gap = result['sample_gap_ms_mean']
+            max_gap = result['sample_gap_ms_max']
+            print(f"{name:>10} {budget:6.1f}ms {result['p50_ms']:8.2f} {result['p95_ms']:8.2f} "
+                  f"{result['max_ms']:8.2f} {result['samples_per_frame']:8.2f} "
+                  f"{gap if gap is not None else float('nan'):8.0f} {max_gap if max_gap is not None else float('nan'):8.0f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'landmark_ms': landmark_ms, 'texture_ms': texture_ms, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+"""
+run_benchmarks.py
+Stage-by-stage benchmark of the attendance loop, headless on CPU.
+
+Every fixture frame goes through what the camera page does, each stage timed on
+its own: decode (JPEG bytes -> BGR), detect, encode, match (recognize_many against
+a synthetic gallery of random unit vectors, once per --gallery-size) and db
+(mark_attendance_many into a throwaway SQLite database). Fixtures are a recorded
+video and/or a folder of images; without any, synthetic frames are used. Frames
+where nothing is detected are encoded at a fixed box so the encode stage is still
+measured.
+
+Results (per-stage percentiles, end-to-end throughput per gallery size, peak RSS
+after each phase) are printed and written as JSON with --json. --compare reads an
+earlier JSON run and reports every stage whose p50 or p95 grew by more than
+--tolerance; the exit status is 1 if any did.
+
+Usage: python -m benchmarks.run_benchmarks --video clip.mp4 --gallery-size 1000 100000 --json run.json
+       python -m benchmarks.run_benchmarks --images photos/ --compare baseline.json --tolerance 0.15
+"""
+import argparse
+import cProfile
+import json
+import os
+import platform
+import pstats
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+import cv2
+import numpy as np
+from face_utils import FaceUtils
+from database import Database
+from utils.detection import DetectionPolicy
+from benchmarks.common import synthetic_gallery, summarize
+from benchmarks.detection_benchmark import IMAGE_EXTENSIONS
+from benchmarks.frame_benchmark import load_frames, synthetic_boxes
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+PIPELINE_STAGES = ('decode', 'detect', 'encode')
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def load_fixtures(video, images, count, width, height):
+    frames = load_frames(video, count, width, height) if video else []
+    if images:
+        paths = [os.path.join(images, n) for n in sorted(os.listdir(images))
+                 if n.lower().endswith(IMAGE_EXTENSIONS)] if os.path.isdir(images) else [images]
+        for path in paths[:max(count - len(frames), 0)]:
+            frame = cv2.imread(path)
+            if frame is not None:
+                frames.append(frame)
+    if not frames:
+        frames = load_frames(None, count, width, height)
+    # Encoded once up front so the decode stage times exactly what a kiosk upload costs
+    return [cv2.imencode('.jpg', frame)[1].tobytes() for frame in frames]
+
+
+def run_pipeline(face_utils, policy, jpegs, warmup=3):
+    """Decode, detect and encode every frame; returns (per-stage latencies, encodings per frame, faces found)."""
+    latencies = {stage: [] for stage in PIPELINE_STAGES}
+    encodings, faces = [], 0
+    for index, data in enumerate(list(jpegs[:warmup]) + list(jpegs)):
+        timed = index >= warmup
+        start = time.perf_counter()
+        frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        decoded = time.perf_counter()
+        rgb = face_utils.to_rgb(frame)
+        boxes = face_utils.detect_faces(frame, policy, rgb=rgb)
+        detected = time.perf_counter()
+        found = face_utils.encode_faces(frame, boxes or synthetic_boxes(frame), rgb=rgb)
+        encoded = time.perf_counter()
+        if timed:
+            latencies['decode'].append(decoded - start)
+            latencies['detect'].append(detected - decoded)
+            latencies['encode'].append(encoded - detected)
+            encodings.append(np.asarray(found, dtype=np.float32).reshape(-1, 128))
+            faces += len(boxes)
+    return latencies, encodings, faces
+
+
+def build_face_utils(path, size, templates, index, policy):
+    face_utils = FaceUtils(path, index=index, legacy_path=None, detection=policy)
+    data = synthetic_gallery(size)
+    ids = [f'user{i // templates}' for i in range(size)]
+    # Straight into memory: the benchmark gallery is never journaled or checkpointed
+    face_utils.gallery.extend(data, ids, ids, ['bench'] * size)
+    face_utils.index.rebuild()
+    return face_utils
+
+
+def run_match(face_utils, encodings, threshold=0.6):
+    face_utils.recognize_many(encodings[0], threshold=threshold)
+    latencies = []
+    for frame_encodings in encodings:
+        start = time.perf_counter()
+        face_utils.recognize_many(frame_encodings, threshold=threshold)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_db(db, encodings):
+    # A new person per face, so every frame commits real inserts
+    latencies = []
+    for index, frame_encodings in enumerate(encodings):
+        events = [(f'bench{index}-{k}', 'Bench', 'bench', 90.0, 'Benchmark') for k in range(len(frame_encodings))]
+        start = time.perf_counter()
+        db.mark_attendance_many(events)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              timeout=5, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(args):
+    policy = DetectionPolicy(min_face=args.min_face)
+    jpegs = load_fixtures(args.video, args.images, args.frames, args.width, args.height)
+    workdir = tempfile.mkdtemp(prefix='attendance-bench-')
+    memory = {'start': peak_rss_mb()}
+    face_utils = FaceUtils(os.path.join(workdir, 'empty'), legacy_path=None, detection=policy)
+
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    pipeline, encodings, faces = run_pipeline(face_utils, policy, jpegs)
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+    memory['pipeline'] = peak_rss_mb()
+
+    stages = {stage: summarize(latencies) for stage, latencies in pipeline.items()}
+    frame_base = np.sum([pipeline[stage] for stage in PIPELINE_STAGES], axis=0)
+
+    db = Database(os.path.join(workdir, 'bench.db'))
+    db_latencies = run_db(db, encodings)
+    db.close()
+    stages['db'] = summarize(db_latencies)
+    frame_base = frame_base + np.asarray(db_latencies)
+    memory['db'] = peak_rss_mb()
+
+    throughput = {}
+    for size in args.gallery_size:
+        gallery_utils = build_face_utils(os.path.join(workdir, f'gallery-{size}'), size, args.templates,
+                                         args.index, policy)
+        match = run_match(gallery_utils, encodings)
+        stages[f'match@{size}'] = summarize(match)
+        total = frame_base + np.asarray(match)
+        stages[f'frame@{size}'] = summarize(total)
+        throughput[str(size)] = len(total) / float(total.sum()) if total.sum() else 0.0
+        memory[f'gallery@{size}'] = peak_rss_mb()
+        del gallery_utils
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'frames': len(jpegs),
+            'faces_detected': faces,
+            'policy': repr(policy),
+            'index': args.index,
+            'templates_per_person': args.templates,
+        },
+        'stages': stages,
+        'frames_per_s': throughput,
+        'peak_rss_mb': memory,
+    }
+
+
+def compare(current, baseline, tolerance, min_delta_ms=0.05):
+    """Stages slower than baseline by more than tolerance (and min_delta_ms): [(stage, metric, old, new)]."""
+    regressions = []
+    for stage, values in current['stages'].items():
+        old = baseline.get('stages', {}).get(stage)
+        if not old or not values.get('count') or not old.get('count'):
+            continue
+        for metric in ('p50_ms', 'p95_ms'):
+            if values[metric] > old[metric] * (1 + tolerance) and values[metric] - old[metric] > min_delta_ms:
+                regressions.append((stage, metric, old[metric], values[metric]))
+    return regressions
+
+
+def print_report(result, baseline=None):
+    meta = result['meta']
+    print(f"{meta['frames']} frames, {meta['faces_detected']} faces detected, {meta['policy']}, index={meta['index']}")
+    print(f"{'stage':>14} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}" +
+          (f" {'base p50':>9} {'change':>8}" if baseline else ''))
+    for stage, values in result['stages'].items():
+        if not values.get('count'):
+            continue
+        line = (f"{stage:>14} {values['p50_ms']:9.2f} {values['p95_ms']:9.2f} {values['p99_ms']:9.2f} "
+                f"{values['max_ms']:9.2f}")
+        old = (baseline or {}).get('stages', {}).get(stage)
+        if old and old.get('count'):
+            change = (values['p50_ms'] / old['p50_ms'] - 1) * 100 if old['p50_ms'] else 0.0
+            line += f" {old['p50_ms']:9.2f} {change:+7.1f}%"
+        print(line)
+    for size, fps in result['frames_per_s'].items():
+        print(f'gallery {int(size):>9,}: {fps:7.1f} frames/s end to end')
+    print('peak RSS (MB): ' + ', '.join(f'{phase} {mb:.0f}' for phase, mb in result['peak_rss_mb'].items()
+                                        if mb is not None))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video', help='Recorded video fixture')
+    parser.add_argument('--images', help='Image fixture, or a directory of them')
+    parser.add_argument('--frames', type=int, default=100, help='Frames to benchmark')
+    parser.add_argument('--width', type=int, default=1280, help='Size of synthetic frames')
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--gallery-size', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Synthetic gallery rows to match against')
+    parser.add_argument('--templates', type=int, default=1, help='Templates per synthetic person')
+    parser.add_argument('--index', default='exact', choices=['exact', 'ivf', 'ivfpq'])
+    parser.add_argument('--min-face', type=int, default=40)
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--compare', help='Earlier --json output to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed slowdown before a regression')
+    parser.add_argument('--profile', help='Write cProfile stats of the decode/detect/encode pass to this file')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    result = run(args)
+    print_report(result, baseline)
+    if args.profile:
+        pstats.Stats(args.profile).sort_stats('cumulative').print_stats(15)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    if baseline is not None:
+        regressions = compare(result, baseline, args.tolerance)
+        for stage, metric, old, new in regressions:
+            print(f'REGRESSION {stage} {metric}: {old:.2f} -> {new:.2f} ms ({(new / old - 1) * 100:+.0f}%)')
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == '__main__':
+    main()
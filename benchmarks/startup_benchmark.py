@@ -0,0 +1,173 @@
+"""
+startup_benchmark.py
+Cold-start cost of the app and time to its first recognized frame.
+
+Every run is a fresh Python process, since import and model loading costs only
+show up once per process:
+  imports  incremental import time of what app.py imports at startup, then of
+           the modules it defers to the pages (pandas, plotly, face_recognition...)
+  cold     startup imports, FaceUtils(), then the first frame (detect, encode,
+           match) paying for the dlib models itself
+  warm     the same with FaceUtils.warm_up(background=True) started right after
+           construction and --render-ms of page rendering before the first frame,
+           as the app does
+Each scenario is repeated --repeat times and the median is reported. "to first
+frame" counts from process launch, interpreter startup included.
+
+Usage: python -m benchmarks.startup_benchmark --repeat 5 --image photo.jpg --json startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# What app.py imports before rendering any page (streamlit aside)
+APP_MODULES = ('cv2', 'numpy', 'database', 'face_utils', 'utils.pipeline', 'utils.tracking', 'utils.detection',
+               'utils.liveness', 'utils.presence', 'utils.export', 'utils.metrics')
+# Imported only by the pages (or the first inference) that use them
+DEFERRED_MODULES = ('pandas', 'plotly.express', 'face_recognition', 'stream_manager', 'video_ingest', 'utils.analytics',
+                    'bulk_enroll', 'service_client')
+SCENARIOS = ('imports', 'cold', 'warm')
+
+
+def _import_times(modules):
+    import importlib
+    times = {}
+    for name in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            times[name] = None
+            continue
+        times[name] = time.perf_counter() - start
+    return times
+
+
+def _first_frames(args, warm):
+    start = time.perf_counter()
+    _import_times(APP_MODULES)
+    imported = time.perf_counter()
+    import cv2
+    import numpy as np
+    from face_utils import FaceUtils, GALLERY_PATH
+    face_utils = FaceUtils(args.gallery or GALLERY_PATH, legacy_path=None)
+    constructed = time.perf_counter()
+    thread = face_utils.warm_up(background=True) if warm else None
+    if warm:
+        time.sleep(args.render_ms / 1000.0)
+    frame = cv2.imread(args.image) if args.image else None
+    if frame is None:
+        frame = np.random.default_rng(0).integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+    height, width = frame.shape[:2]
+    # Encoded when nothing is detected (synthetic frames), so the encoder still runs
+    fixed_box = (height // 3, width // 2 + height // 8, height // 3 + height // 4, width // 2 - height // 8)
+    latencies = []
+    for _ in range(2):
+        frame_start = time.perf_counter()
+        boxes = face_utils.detect_faces(frame)
+        encodings = face_utils.encode_faces(frame, boxes or [fixed_box])
+        face_utils.recognize_many(encodings)
+        latencies.append(time.perf_counter() - frame_start)
+        if len(latencies) == 1:
+            first_done = time.time()
+    if thread is not None:
+        thread.join()
+    return {
+        'import_s': imported - start,
+        'construct_s': constructed - imported,
+        'warm_up_s': face_utils.warm_up_seconds,
+        'first_frame_s': latencies[0],
+        'steady_frame_s': latencies[1],
+        'to_first_frame_s': first_done - args.launched,
+        'gallery': len(face_utils.gallery),
+    }
+
+
+def run_child(args):
+    if args.child == 'imports':
+        result = {'startup': _import_times(APP_MODULES), 'deferred': _import_times(DEFERRED_MODULES)}
+    else:
+        result = _first_frames(args, warm=args.child == 'warm')
+    print(json.dumps(result))
+
+
+def run_scenario(args, scenario):
+    command = [sys.executable, '-m', 'benchmarks.startup_benchmark', '--child', scenario,
+               '--render-ms', str(args.render_ms), '--width', str(args.width), '--height', str(args.height)]
+    if args.gallery:
+        command += ['--gallery', args.gallery]
+    if args.image:
+        command += ['--image', args.image]
+    runs = []
+    for _ in range(args.repeat):
+        out = subprocess.run(command + ['--launched', repr(time.time())], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        if out.returncode != 0:
+            raise RuntimeError(f'{scenario} run failed:\n{out.stderr}')
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return runs
+
+
+def median_of(runs):
+    """Per-key median over runs; nested dicts (import times) are reduced key by key."""
+    result = {}
+    for key, value in runs[0].items():
+        if isinstance(value, dict):
+            result[key] = median_of([run[key] for run in runs])
+        elif value is None or any(run[key] is None for run in runs):
+            result[key] = None
+        else:
+            result[key] = statistics.median(run[key] for run in runs)
+    return result
+
+
+def print_report(results):
+    imports = results.get('imports')
+    if imports:
+        for group in ('startup', 'deferred'):
+            print(f'{group} imports (incremental, ms):')
+            for name, seconds in imports[group].items():
+                print(f"  {name:>18} {'not installed' if seconds is None else f'{seconds * 1000:9.1f}'}")
+            print(f"  {'total':>18} {sum(s or 0 for s in imports[group].values()) * 1000:9.1f}")
+    rows = [(name, results[name]) for name in ('cold', 'warm') if name in results]
+    if rows:
+        print(f"{'scenario':>9} {'imports':>9} {'construct':>10} {'warm-up':>9} {'1st frame':>10} "
+              f"{'steady':>9} {'to 1st frame':>13}  (ms)")
+        for name, r in rows:
+            warm_up = f"{r['warm_up_s'] * 1000:9.1f}" if r['warm_up_s'] is not None else f"{'-':>9}"
+            print(f"{name:>9} {r['import_s'] * 1000:9.1f} {r['construct_s'] * 1000:10.1f} {warm_up} "
+                  f"{r['first_frame_s'] * 1000:10.1f} {r['steady_frame_s'] * 1000:9.1f} "
+                  f"{r['to_first_frame_s'] * 1000:13.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument('--repeat', type=int, default=3, help='Fresh processes per scenario')
+    parser.add_argument('--gallery', help='Gallery directory (default: the app gallery)')
+    parser.add_argument('--image', help='Image for the first frame (default: synthetic noise)')
+    parser.add_argument('--width', type=int, default=1280, help='Size of the synthetic frame')
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--render-ms', type=float, default=300,
+                        help='Page rendering between startup and the first frame in the warm scenario')
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--child', choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument('--launched', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+    results = {scenario: median_of(run_scenario(args, scenario)) for scenario in args.scenarios}
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
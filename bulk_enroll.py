@@ -0,0 +1,260 @@
+"""
+bulk_enroll.py
+Enroll many people at once from ID photos: encode in a process pool, then commit
+everyone in one gallery append and one database transaction.
+
+Accepted layouts (a directory or a .zip with the same structure):
+  <root>/<department>/<user_id>[ - Name]/*.jpg
+  <root>/<user_id>[ - Name]/*.jpg                 with --department
+or a CSV manifest with columns user_id,name,department,image, where image is a
+path relative to the manifest (or inside --images, a directory or .zip).
+--department overrides department folders, e.g. for a zip with one wrapper folder.
+
+Images with no face or more than one face are rejected, as are photos that disagree
+with the rest of the person's photos. Every accepted photo becomes one template with
+its quality score; FaceUtils keeps the best max_templates of them.
+
+Usage: python bulk_enroll.py intake_2025.zip --department "First Year" --workers 8 --report failures.csv
+"""
+import argparse
+import csv
+import os
+import time
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Per-process FaceUtils and open zip files, created lazily in each worker
+_worker_face_utils = None
+_worker_zips = {}
+
+
+def _init_worker(gallery_path):
+    global _worker_face_utils
+    from face_utils import FaceUtils
+    # Workers only detect and encode, so they load no gallery rows
+    _worker_face_utils = FaceUtils(gallery_path, shards=())
+
+
+def _read_bytes(source):
+    # source is a file path or (zip path, member name)
+    if isinstance(source, tuple):
+        zip_path, member = source
+        archive = _worker_zips.get(zip_path)
+        if archive is None:
+            archive = _worker_zips[zip_path] = zipfile.ZipFile(zip_path)
+        return archive.read(member)
+    with open(source, 'rb') as f:
+        return f.read()
+
+
+def encode_image(source):
+    """Detect and encode the single face of one enrollment photo (runs in a worker process)."""
+    try:
+        data = _read_bytes(source)
+    except (OSError, KeyError, zipfile.BadZipFile) as e:
+        return {'error': f'unreadable: {e}'}
+    frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        return {'error': 'not an image'}
+    boxes, encodings, _, _ = _worker_face_utils.process_frame(frame)
+    if not boxes:
+        return {'error': 'no face found'}
+    if len(boxes) > 1:
+        return {'error': f'{len(boxes)} faces found'}
+    if not len(encodings):
+        return {'error': 'encoding failed'}
+    return {'encoding': np.asarray(encodings[0], dtype=np.float32),
+            'quality': _worker_face_utils.template_qualities(frame, boxes)[0]}
+
+
+def _split_person(folder):
+    # "<user_id> - Name" or just "<user_id>"
+    user_id, sep, name = folder.partition(' - ')
+    return user_id.strip(), (name.strip() if sep else user_id.strip())
+
+
+def _layout_items(names, department=None):
+    """(user_id, name, department, member) for image names laid out per person."""
+    items = []
+    for member in names:
+        if not member.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        folders = [p for p in member.replace('\\', '/').split('/') if p][:-1]
+        if not folders:
+            continue
+        # The innermost folder is the person and its parent the department, unless one is given
+        user_id, name = _split_person(folders[-1])
+        items.append((user_id, name, department or (folders[-2] if len(folders) > 1 else 'General'), member))
+    return items
+
+
+def collect(path, department=None, images=None):
+    """List (user_id, name, department, source) for a directory, zip or CSV manifest."""
+    if path.lower().endswith('.csv'):
+        base = images or os.path.dirname(os.path.abspath(path))
+        with open(path, newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+        items = []
+        for row in rows:
+            image = row['image'].strip()
+            source = (base, image) if base.lower().endswith('.zip') else os.path.join(base, image)
+            items.append((row['user_id'].strip(), (row.get('name') or row['user_id']).strip(),
+                          (row.get('department') or department or 'General').strip(), source))
+        return items
+    if path.lower().endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            names = [n for n in archive.namelist() if not n.endswith('/')]
+        return [(u, n, d, (path, member)) for u, n, d, member in _layout_items(names, department)]
+    names = []
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            names.append(os.path.relpath(os.path.join(root, name), path))
+    return [(u, n, d, os.path.join(path, member)) for u, n, d, member in _layout_items(sorted(names), department)]
+
+
+def consistent_samples(encodings, max_spread=0.5):
+    """Mask of the samples within max_spread of the mean; with fewer than 3 there is no majority."""
+    encodings = np.asarray(encodings, dtype=np.float32)
+    if len(encodings) < 3:
+        return np.ones(len(encodings), dtype=bool)
+    keep = np.linalg.norm(encodings - encodings.mean(axis=0), axis=1) <= max_spread
+    return keep if keep.any() else np.ones(len(encodings), dtype=bool)
+
+
+def _source_label(source):
+    return f'{source[0]}:{source[1]}' if isinstance(source, tuple) else source
+
+
+def bulk_enroll(items, face_utils, db=None, workers=None, max_spread=0.5, dry_run=False, progress=None):
+    """
+    Encode every image of items (from collect), then enroll all new people at once.
+    progress(done, total) is called as images finish. Returns a report dict.
+    """
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    failures = []
+    samples = {}
+    people = {}
+    for user_id, name, department, source in items:
+        if face_utils.is_duplicate_registration(user_id):
+            failures.append((_source_label(source), user_id, 'already registered'))
+            continue
+        people.setdefault(user_id, (name, department))
+        samples.setdefault(user_id, [])
+
+    todo = [(user_id, source) for user_id, _, _, source in items if user_id in samples]
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(face_utils.gallery_path,)) as pool:
+        # A bounded window of submissions keeps memory flat for very large intakes
+        pending, queue = {}, iter(todo)
+        while True:
+            while len(pending) < workers * 4:
+                job = next(queue, None)
+                if job is None:
+                    break
+                pending[pool.submit(encode_image, job[1])] = job
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                user_id, source = pending.pop(future)
+                result = future.result()
+                if 'error' in result:
+                    failures.append((_source_label(source), user_id, result['error']))
+                else:
+                    samples[user_id].append((source, result['encoding'], result['quality']))
+                done += 1
+            if progress:
+                progress(done, len(todo))
+    encode_s = time.perf_counter() - started
+
+    ids, templates = [], []
+    for user_id, user_samples in samples.items():
+        if not user_samples:
+            failures.append(('', user_id, 'no usable photos'))
+            continue
+        keep = consistent_samples([e for _, e, _ in user_samples], max_spread)
+        name, department = people[user_id]
+        for (source, encoding, quality), kept in zip(user_samples, keep):
+            if kept:
+                templates.append((encoding, user_id, name, department, quality))
+            else:
+                failures.append((_source_label(source), user_id, 'inconsistent with the person\'s other photos'))
+        ids.append(user_id)
+
+    # Templates stored per person, after FaceUtils keeps only the best max_templates
+    cap = face_utils.max_templates
+    per_person = Counter(template[1] for template in templates)
+    stored = sum(min(count, cap) if cap else count for count in per_person.values())
+    if ids and not dry_run:
+        # Database first: if it fails, nothing was added to the gallery
+        if db is not None:
+            db.register_users([(user_id, *people[user_id]) for user_id in ids])
+        encodings, template_ids, names, departments, qualities = zip(*templates)
+        face_utils.add_encodings(np.asarray(encodings, dtype=np.float32), template_ids, names, departments,
+                                 qualities)
+        # Counted from the gallery, which also holds what re-enrolled people already had
+        stored = sum(len(face_utils.gallery.rows_for(user_id)) for user_id in ids)
+    elapsed = time.perf_counter() - started
+    return {
+        'images': len(items),
+        'encoded': sum(len(s) for s in samples.values()),
+        'enrolled': [] if dry_run else ids,
+        'people': len(ids),
+        'templates': stored,
+        'failures': failures,
+        'elapsed_s': elapsed,
+        'encode_s': encode_s,
+        'images_per_s': len(todo) / encode_s if encode_s else 0.0,
+    }
+
+
+def write_failures(failures, path):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['image', 'user_id', 'reason'])
+        writer.writerows(failures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='Directory, .zip or .csv manifest')
+    parser.add_argument('--images', help='Directory or .zip holding the images of a CSV manifest')
+    parser.add_argument('--department', default=None, help='Department for everyone (overrides department folders)')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-spread', type=float, default=0.5,
+                        help='Drop photos farther than this from the person\'s mean encoding')
+    parser.add_argument('--dry-run', action='store_true', help='Encode and validate without enrolling anyone')
+    parser.add_argument('--report', help='Write rejected images to this CSV file')
+    args = parser.parse_args()
+
+    from face_utils import FaceUtils
+    from database import Database
+    items = collect(args.path, args.department, args.images)
+    if not items:
+        parser.error('No images found')
+    face_utils = FaceUtils()
+
+    def progress(done, total):
+        print(f'\rEncoded {done}/{total} images', end='', flush=True)
+
+    report = bulk_enroll(items, face_utils, None if args.dry_run else Database(), workers=args.workers,
+                         max_spread=args.max_spread, dry_run=args.dry_run, progress=progress)
+    print(f"\r{report['images']} images, {report['encoded']} encoded in {report['encode_s']:.1f}s "
+          f"({report['images_per_s']:.1f} images/s); "
+          f"{report['people']} people {'validated' if args.dry_run else 'enrolled'}, "
+          f"{len(report['failures'])} failures")
+    for image, user_id, reason in report['failures'][:20]:
+        print(f'  {user_id}: {reason} {image}')
+    if args.report:
+        write_failures(report['failures'], args.report)
+
+
+if __name__ == '__main__':
+    main()
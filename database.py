@@ -1,105 +1,579 @@
 """
 database.py
 Handles SQLite database operations for attendance and user registration.
+
+Reads lease a connection from a bounded pool (WAL lets them run concurrently
+with each other and with the writer). All writes are funnelled through one
+dedicated writer thread that owns the only write connection, so concurrent
+kiosks and dashboards never interleave cursors on a shared connection.
 """
 import sqlite3
-from datetime import datetime
+import threading
+import queue
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 import os
+from utils.query_cache import QueryCache, cached_query
+from utils import metrics
 
 DB_PATH = os.path.join(os.path.dirname(__file__), 'data', 'attendance.db')
+# Max host parameters per statement on older SQLite builds
+SQLITE_MAX_VARIABLES = 999
+# Seconds since midnight of an attendance row's HH:MM:SS time, for aggregates in SQL
+ARRIVAL_SECONDS = ('(CAST(substr(time, 1, 2) AS INTEGER) * 3600 + CAST(substr(time, 4, 2) AS INTEGER) * 60'
+                   ' + CAST(substr(time, 7, 2) AS INTEGER))')
+
+READ_WAIT_SECONDS = metrics.histogram('attendance_db_read_wait_seconds', 'Wait for a pooled read connection')
+WRITE_WAIT_SECONDS = metrics.histogram('attendance_db_write_wait_seconds',
+                                       'Time a write waits in the writer queue (lock contention shows here)')
+WRITE_EXEC_SECONDS = metrics.histogram('attendance_db_write_exec_seconds', 'Time a write transaction runs')
+MARK_SECONDS = metrics.histogram('attendance_mark_seconds', 'mark_attendance_many call time, queueing included')
+MARKED = metrics.counter('attendance_marked_total', 'Attendance rows inserted')
+ALREADY_MARKED = metrics.counter('attendance_already_marked_total', 'Attendance events for people already marked')
+
+
+class PoolMetrics:
+    """Wait-time and contention counters for the read pool and the writer queue."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.values = {
+                'read_acquires': 0, 'read_contended': 0, 'read_timeouts': 0,
+                'read_wait_total_s': 0.0, 'read_wait_max_s': 0.0,
+                'writes': 0, 'write_timeouts': 0, 'write_errors': 0,
+                'write_wait_total_s': 0.0, 'write_wait_max_s': 0.0,
+                'write_exec_total_s': 0.0, 'write_queue_max': 0,
+            }
+
+    def observe_read(self, waited, contended):
+        READ_WAIT_SECONDS.observe(waited)
+        with self._lock:
+            v = self.values
+            v['read_acquires'] += 1
+            v['read_contended'] += int(contended)
+            v['read_wait_total_s'] += waited
+            v['read_wait_max_s'] = max(v['read_wait_max_s'], waited)
+
+    def observe_write(self, waited, executed, queue_depth):
+        WRITE_WAIT_SECONDS.observe(waited)
+        WRITE_EXEC_SECONDS.observe(executed)
+        with self._lock:
+            v = self.values
+            v['writes'] += 1
+            v['write_wait_total_s'] += waited
+            v['write_wait_max_s'] = max(v['write_wait_max_s'], waited)
+            v['write_exec_total_s'] += executed
+            v['write_queue_max'] = max(v['write_queue_max'], queue_depth)
+
+    def incr(self, key):
+        with self._lock:
+            self.values[key] += 1
+
+    def snapshot(self):
+        with self._lock:
+            snap = dict(self.values)
+        snap['read_wait_avg_s'] = snap['read_wait_total_s'] / snap['read_acquires'] if snap['read_acquires'] else 0.0
+        snap['write_wait_avg_s'] = snap['write_wait_total_s'] / snap['writes'] if snap['writes'] else 0.0
+        return snap
+
+
+def _connect(db_path, busy_timeout):
+    # Connections move between threads through the pool, never used by two at once
+    conn = sqlite3.connect(db_path, check_same_thread=False, timeout=busy_timeout)
+    conn.execute(f'PRAGMA busy_timeout={int(busy_timeout * 1000)}')
+    return conn
+
+
+class ReadPool:
+    def __init__(self, db_path, size, timeout, metrics):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self.metrics = metrics
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._all = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        start = time.perf_counter()
+        contended = not self._slots.acquire(blocking=False)
+        if contended and not self._slots.acquire(timeout=self.timeout):
+            self.metrics.incr('read_timeouts')
+            raise sqlite3.OperationalError(f'Timed out after {self.timeout}s waiting for a read connection')
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = _connect(self.db_path, self.timeout)
+                conn.execute('PRAGMA query_only=1')
+                with self._lock:
+                    self._all.append(conn)
+            self.metrics.observe_read(time.perf_counter() - start, contended)
+            try:
+                yield conn
+            finally:
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            for conn in self._all:
+                conn.close()
+            self._all = []
+
+
+class WriterThread(threading.Thread):
+    """Owns the single write connection and runs submitted jobs one at a time."""
+
+    def __init__(self, db_path, timeout, synchronous, metrics):
+        super().__init__(name='sqlite-writer', daemon=True)
+        self.db_path = db_path
+        self.timeout = timeout
+        self.synchronous = synchronous
+        self.metrics = metrics
+        self.jobs = queue.Queue()
+        self._ready = Future()
+
+    def run(self):
+        try:
+            conn = _connect(self.db_path, self.timeout)
+            # WAL lets readers proceed during writes, and with synchronous=NORMAL a commit
+            # appends to the WAL without an fsync (durability is kept up to the last checkpoint)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        except Exception as e:
+            self._ready.set_exception(e)
+            return
+        self._ready.set_result(True)
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            fn, future, queued_at = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            started = time.perf_counter()
+            try:
+                future.set_result(fn(conn))
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                self.metrics.incr('write_errors')
+                future.set_exception(e)
+            self.metrics.observe_write(started - queued_at, time.perf_counter() - started, self.jobs.qsize())
+        conn.close()
+
+    def wait_ready(self):
+        return self._ready.result(timeout=self.timeout)
+
+    def submit(self, fn):
+        future = Future()
+        self.jobs.put((fn, future, time.perf_counter()))
+        return future
+
+    def stop(self):
+        self.jobs.put(None)
+        self.join(timeout=self.timeout)
+
 
 class Database:
-    def __init__(self, db_path=DB_PATH):
+    def __init__(self, db_path=DB_PATH, pool_size=4, timeout=10.0, synchronous='NORMAL', cache_size=256):
         self.db_path = db_path
-        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.timeout = timeout
+        self.metrics = PoolMetrics()
+        self.cache = QueryCache(cache_size)
+        self._writer = WriterThread(db_path, timeout, synchronous, self.metrics)
+        self._writer.start()
+        self._writer.wait_ready()
+        self._readers = ReadPool(db_path, pool_size, timeout, self.metrics)
+        # PRAGMA data_version on this connection changes whenever any other connection
+        # (another kiosk process, or our own writer) commits
+        self._watch = _connect(db_path, timeout)
+        self._watch_lock = threading.Lock()
         self.create_tables()
 
+    def _write(self, fn):
+        # Jobs submitted from the writer thread itself would deadlock waiting on the queue
+        if threading.current_thread() is self._writer:
+            raise RuntimeError('Nested database write from the writer thread')
+        future = self._writer.submit(fn)
+        try:
+            result = future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            self.metrics.incr('write_timeouts')
+            raise sqlite3.OperationalError(f'Timed out after {self.timeout}s waiting for the database writer')
+        # Bumped only after the commit, so no reader can cache pre-write data under the new version
+        self.cache.bump()
+        return result
+
+    def _read(self):
+        return self._readers.connection()
+
+    def pool_stats(self):
+        return self.metrics.snapshot()
+
+    def data_version(self):
+        with self._watch_lock:
+            external = self._watch.execute('PRAGMA data_version').fetchone()[0]
+        return (self.cache.version, external)
+
+    def cache_stats(self):
+        return self.cache.stats()
+
     def delete_user(self, user_id):
-        c = self.conn.cursor()
-        # Delete from users table
-        c.execute('DELETE FROM users WHERE id=?', (user_id,))
-        # Delete all attendance records for this user
-        c.execute('DELETE FROM attendance WHERE user_id=?', (user_id,))
-        self.conn.commit()
+        def write(conn):
+            c = conn.cursor()
+            # Delete from users table
+            c.execute('DELETE FROM users WHERE id=?', (user_id,))
+            # Delete all attendance records for this user
+            c.execute('DELETE FROM attendance WHERE user_id=?', (user_id,))
+            conn.commit()
+        self._write(write)
 
     def create_tables(self):
-        c = self.conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS users (
-            id TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            department TEXT NOT NULL,
-            registered_at TEXT NOT NULL
-        )''')
-        c.execute('''CREATE TABLE IF NOT EXISTS attendance (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT NOT NULL,
-            name TEXT NOT NULL,
-            department TEXT NOT NULL,
+        def write(conn):
+            c = conn.cursor()
+            c.execute('''CREATE TABLE IF NOT EXISTS users (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                department TEXT NOT NULL,
+                registered_at TEXT NOT NULL
+            )''')
+            c.execute('''CREATE TABLE IF NOT EXISTS attendance (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                department TEXT NOT NULL,
+                date TEXT NOT NULL,
+                time TEXT NOT NULL,
+                confidence REAL NOT NULL,
+                source TEXT NOT NULL,
+                UNIQUE(user_id, date)
+            )''')
+            # UNIQUE(user_id, date) leads with user_id, so date filters need their own indexes
+            c.execute('CREATE INDEX IF NOT EXISTS idx_attendance_date_department ON attendance(date, department)')
+            c.execute('CREATE INDEX IF NOT EXISTS idx_attendance_department_date ON attendance(department, date)')
+            # Keyset pagination order for the records view
+            c.execute('CREATE INDEX IF NOT EXISTS idx_attendance_date_time ON attendance(date, time)')
+            # Covers the per-person arrival aggregates of the Analytics page without table lookups
+            c.execute('CREATE INDEX IF NOT EXISTS idx_attendance_date_user_time ON attendance(date, user_id, time)')
+            self._create_rollups(c)
+            conn.commit()
+        self._write(write)
+
+    def _create_rollups(self, c):
+        # Per-day and per-department-per-day present counts, kept current by triggers.
+        # UNIQUE(user_id, date) makes a row count equal to COUNT(DISTINCT user_id).
+        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='daily_summary'")
+        backfill = c.fetchone() is None
+        c.execute('''CREATE TABLE IF NOT EXISTS daily_summary (
+            date TEXT PRIMARY KEY,
+            present INTEGER NOT NULL
+        ) WITHOUT ROWID''')
+        c.execute('''CREATE TABLE IF NOT EXISTS department_daily (
             date TEXT NOT NULL,
-            time TEXT NOT NULL,
-            confidence REAL NOT NULL,
-            source TEXT NOT NULL,
-            UNIQUE(user_id, date)
-        )''')
-        self.conn.commit()
+            department TEXT NOT NULL,
+            present INTEGER NOT NULL,
+            PRIMARY KEY (date, department)
+        ) WITHOUT ROWID''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS attendance_rollup_insert AFTER INSERT ON attendance BEGIN
+            INSERT INTO daily_summary (date, present) VALUES (NEW.date, 1)
+                ON CONFLICT(date) DO UPDATE SET present = present + 1;
+            INSERT INTO department_daily (date, department, present) VALUES (NEW.date, NEW.department, 1)
+                ON CONFLICT(date, department) DO UPDATE SET present = present + 1;
+        END''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS attendance_rollup_delete AFTER DELETE ON attendance BEGIN
+            UPDATE daily_summary SET present = present - 1 WHERE date = OLD.date;
+            UPDATE department_daily SET present = present - 1
+                WHERE date = OLD.date AND department = OLD.department;
+        END''')
+        if backfill:
+            c.execute('''INSERT INTO daily_summary (date, present)
+                         SELECT date, COUNT(*) FROM attendance GROUP BY date''')
+            c.execute('''INSERT INTO department_daily (date, department, present)
+                         SELECT date, department, COUNT(*) FROM attendance GROUP BY date, department''')
 
     def register_user(self, user_id, name, department):
-        c = self.conn.cursor()
-        c.execute('INSERT INTO users (id, name, department, registered_at) VALUES (?, ?, ?, ?)',
-                  (user_id, name, department, datetime.now().isoformat()))
-        self.conn.commit()
+        def write(conn):
+            c = conn.cursor()
+            c.execute('INSERT INTO users (id, name, department, registered_at) VALUES (?, ?, ?, ?)',
+                      (user_id, name, department, datetime.now().isoformat()))
+            conn.commit()
+        self._write(write)
 
+    def register_users(self, users):
+        """
+        Insert (user_id, name, department) rows in one transaction, skipping ids that
+        already exist. Returns the number of users inserted.
+        """
+        if not users:
+            return 0
+        registered_at = datetime.now().isoformat()
+
+        def write(conn):
+            c = conn.cursor()
+            c.execute('BEGIN IMMEDIATE')
+            before = conn.total_changes
+            c.executemany('''INSERT INTO users (id, name, department, registered_at) VALUES (?, ?, ?, ?)
+                             ON CONFLICT(id) DO NOTHING''',
+                          [(user_id, name, department, registered_at) for user_id, name, department in users])
+            inserted = conn.total_changes - before
+            conn.commit()
+            return inserted
+        return self._write(write)
+
+    @cached_query
     def get_user(self, user_id):
-        c = self.conn.cursor()
-        c.execute('SELECT * FROM users WHERE id=?', (user_id,))
-        return c.fetchone()
+        with self._read() as conn:
+            c = conn.cursor()
+            c.execute('SELECT * FROM users WHERE id=?', (user_id,))
+            return c.fetchone()
 
+    @cached_query
     def get_all_users(self):
-        c = self.conn.cursor()
-        c.execute('SELECT * FROM users')
-        return c.fetchall()
+        with self._read() as conn:
+            c = conn.cursor()
+            c.execute('SELECT * FROM users')
+            return c.fetchall()
 
     def mark_attendance(self, user_id, name, department, confidence, source):
-        c = self.conn.cursor()
-        now = datetime.now()
-        date = now.strftime('%Y-%m-%d')
-        time = now.strftime('%H:%M:%S')
-        try:
-            c.execute('''INSERT INTO attendance (user_id, name, department, date, time, confidence, source)
-                         VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                      (user_id, name, department, date, time, confidence, source))
-            self.conn.commit()
-            return True
-        except sqlite3.IntegrityError:
-            return False  # Already marked today
+        return self.mark_attendance_many([(user_id, name, department, confidence, source)])[0]
 
+    @metrics.timed(MARK_SECONDS)
+    def mark_attendance_many(self, events):
+        """
+        Insert attendance events (user_id, name, department, confidence, source[, timestamp])
+        in one transaction. Returns a list of booleans: True where a row was newly inserted,
+        False where the user was already marked that day (or earlier in the same batch).
+        """
+        if not events:
+            return []
+        rows = []
+        for event in events:
+            user_id, name, department, confidence, source = event[:5]
+            when = event[5] if len(event) > 5 and event[5] else datetime.now()
+            rows.append((user_id, name, department, when.strftime('%Y-%m-%d'), when.strftime('%H:%M:%S'),
+                         float(confidence), source))
+
+        def write(conn):
+            c = conn.cursor()
+            # IMMEDIATE takes the write lock up front so the existence check below stays valid
+            c.execute('BEGIN IMMEDIATE')
+            seen = self._existing_attendance(c, rows)
+            inserted, new_rows = [], []
+            for row in rows:
+                key = (row[0], row[3])
+                is_new = key not in seen
+                inserted.append(is_new)
+                if is_new:
+                    seen.add(key)
+                    new_rows.append(row)
+            c.executemany('''INSERT INTO attendance (user_id, name, department, date, time, confidence, source)
+                             VALUES (?, ?, ?, ?, ?, ?, ?)
+                             ON CONFLICT(user_id, date) DO NOTHING''', new_rows)
+            conn.commit()
+            return inserted
+        inserted = self._write(write)
+        MARKED.inc(sum(inserted))
+        ALREADY_MARKED.inc(len(inserted) - sum(inserted))
+        return inserted
+
+    def _existing_attendance(self, c, rows):
+        by_date = {}
+        for row in rows:
+            by_date.setdefault(row[3], set()).add(row[0])
+        existing = set()
+        for date, user_ids in by_date.items():
+            user_ids = list(user_ids)
+            for start in range(0, len(user_ids), SQLITE_MAX_VARIABLES - 1):
+                chunk = user_ids[start:start + SQLITE_MAX_VARIABLES - 1]
+                c.execute(f'''SELECT user_id FROM attendance
+                              WHERE date=? AND user_id IN ({','.join('?' * len(chunk))})''', [date] + chunk)
+                existing.update((user_id, date) for (user_id,) in c.fetchall())
+        return existing
+
+    @cached_query
     def get_attendance_today(self):
-        c = self.conn.cursor()
-        date = datetime.now().strftime('%Y-%m-%d')
-        c.execute('SELECT * FROM attendance WHERE date=?', (date,))
-        return c.fetchall()
+        with self._read() as conn:
+            c = conn.cursor()
+            date = datetime.now().strftime('%Y-%m-%d')
+            c.execute('SELECT * FROM attendance WHERE date=?', (date,))
+            return c.fetchall()
 
+    @cached_query
     def get_attendance_by_date(self, date):
-        c = self.conn.cursor()
-        c.execute('SELECT * FROM attendance WHERE date=?', (date,))
-        return c.fetchall()
+        with self._read() as conn:
+            c = conn.cursor()
+            c.execute('SELECT * FROM attendance WHERE date=?', (date,))
+            return c.fetchall()
+
+    def _attendance_filters(self, date_from=None, date_to=None, department=None, user_id=None, source=None):
+        clauses, params = [], []
+        if date_from:
+            clauses.append('date >= ?')
+            params.append(str(date_from))
+        if date_to:
+            clauses.append('date <= ?')
+            params.append(str(date_to))
+        for column, value in (('department', department), ('user_id', user_id), ('source', source)):
+            if value:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        return clauses, params
+
+    @cached_query
+    def get_attendance_page(self, limit=100, after=None, **filters):
+        """
+        One page of attendance rows, newest first, with filters applied in SQL.
+        after is the (date, time, id) of the last row of the previous page (keyset
+        pagination), so every page costs the same no matter how deep it is.
+        """
+        clauses, params = self._attendance_filters(**filters)
+        if after is not None:
+            clauses.append('(date, time, id) < (?, ?, ?)')
+            params.extend(after)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        with self._read() as conn:
+            c = conn.cursor()
+            c.execute(f'''SELECT * FROM attendance {where}
+                          ORDER BY date DESC, time DESC, id DESC LIMIT ?''', params + [limit])
+            return c.fetchall()
+
+    @cached_query
+    def count_attendance(self, **filters):
+        clauses, params = self._attendance_filters(**filters)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        with self._read() as conn:
+            c = conn.cursor()
+            c.execute(f'SELECT COUNT(*) FROM attendance {where}', params)
+            return c.fetchone()[0]
+
+    def iter_attendance(self, chunk_size=5000, **filters):
+        """Yield filtered attendance rows in chunks from one cursor, never holding the full table."""
+        clauses, params = self._attendance_filters(**filters)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        with self._read() as conn:
+            c = conn.cursor()
+            c.execute(f'SELECT * FROM attendance {where} ORDER BY date DESC, time DESC, id DESC', params)
+            while True:
+                rows = c.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
 
-    def get_attendance_records(self):
-        c = self.conn.cursor()
-        c.execute('SELECT * FROM attendance ORDER BY date DESC, time DESC')
-        return c.fetchall()
+    @cached_query
+    def get_departments(self):
+        with self._read() as conn:
+            c = conn.cursor()
+            c.execute('SELECT DISTINCT department FROM department_daily ORDER BY department')
+            return [row[0] for row in c.fetchall()]
 
+    @cached_query
     def get_attendance_trend(self, days=7):
-        c = self.conn.cursor()
-        c.execute('''SELECT date, COUNT(DISTINCT user_id) as count FROM attendance
-                     GROUP BY date ORDER BY date DESC LIMIT ?''', (days,))
-        return c.fetchall()
+        """(date, count) for each of the last `days` calendar days, oldest first, 0 where nobody came."""
+        today = datetime.now().date()
+        dates = [(today - timedelta(days=offset)).isoformat() for offset in range(days - 1, -1, -1)]
+        counts = dict(self.get_daily_presence(dates[0], dates[-1])) if dates else {}
+        return [(date, counts.get(date, 0)) for date in dates]
 
+    @cached_query
+    def get_daily_presence(self, date_from, date_to, department=None):
+        """(date, present) rollup rows in [date_from, date_to]; days without attendance are absent."""
+        with self._read() as conn:
+            c = conn.cursor()
+            if department:
+                c.execute('''SELECT date, present FROM department_daily
+                             WHERE department=? AND date BETWEEN ? AND ? AND present > 0 ORDER BY date''',
+                          (department, str(date_from), str(date_to)))
+            else:
+                c.execute('''SELECT date, present FROM daily_summary
+                             WHERE date BETWEEN ? AND ? AND present > 0 ORDER BY date''',
+                          (str(date_from), str(date_to)))
+            return c.fetchall()
+
+    @cached_query
+    def get_department_presence(self, date_from, date_to):
+        """(date, department, present) rollup rows in [date_from, date_to]."""
+        with self._read() as conn:
+            c = conn.cursor()
+            c.execute('''SELECT date, department, present FROM department_daily
+                         WHERE date BETWEEN ? AND ? AND present > 0 ORDER BY date, department''',
+                      (str(date_from), str(date_to)))
+            return c.fetchall()
+
+    @cached_query
+    def get_arrival_counts(self, date_from, date_to, bin_seconds=300, department=None):
+        """
+        First arrivals per (date, time bin) in [date_from, date_to], where bin is
+        seconds since midnight // bin_seconds. A semester is a few thousand rows
+        however many people came.
+        """
+        clauses, params = self._attendance_filters(date_from=date_from, date_to=date_to, department=department)
+        with self._read() as conn:
+            c = conn.cursor()
+            c.execute(f'''SELECT date, {ARRIVAL_SECONDS} / ? AS bin, COUNT(*) FROM attendance
+                          WHERE {' AND '.join(clauses)} GROUP BY date, bin''', [int(bin_seconds)] + params)
+            return c.fetchall()
+
+    @cached_query
+    def get_arrival_stats(self, date_from, date_to, late_after, department=None):
+        """
+        Per user in [date_from, date_to]: (user_id, days, late days, sum, sum of squares,
+        min and max of arrival seconds, seconds late in total). A day is late when the
+        first arrival is after late_after (seconds since midnight).
+        """
+        clauses, params = self._attendance_filters(date_from=date_from, date_to=date_to, department=department)
+        late_after = int(late_after)
+        with self._read() as conn:
+            c = conn.cursor()
+            # LIMIT -1 keeps SQLite from flattening the subquery, which would parse every time once per aggregate
+            c.execute(f'''SELECT user_id, COUNT(*), SUM(s > ?), SUM(s), SUM(s * s), MIN(s), MAX(s), SUM(MAX(s - ?, 0))
+                          FROM (SELECT user_id, {ARRIVAL_SECONDS} AS s FROM attendance
+                                WHERE {' AND '.join(clauses)} LIMIT -1)
+                          GROUP BY user_id''', [late_after, late_after] + params)
+            return c.fetchall()
+
+    @cached_query
+    def count_users_by_department(self):
+        with self._read() as conn:
+            c = conn.cursor()
+            c.execute('SELECT department, COUNT(*) FROM users GROUP BY department')
+            return c.fetchall()
+
+    @cached_query
     def get_department_attendance(self):
-        c = self.conn.cursor()
-        c.execute('''SELECT department, COUNT(DISTINCT user_id) as count FROM attendance
-                     WHERE date=? GROUP BY department''', (datetime.now().strftime('%Y-%m-%d'),))
-        return c.fetchall()
+        with self._read() as conn:
+            c = conn.cursor()
+            c.execute('''SELECT department, present as count FROM department_daily
+                         WHERE date=? AND present > 0''', (datetime.now().strftime('%Y-%m-%d'),))
+            return c.fetchall()
+
+    @cached_query
+    def count_users(self):
+        with self._read() as conn:
+            c = conn.cursor()
+            c.execute('SELECT COUNT(*) FROM users')
+            return c.fetchone()[0]
+
+    @cached_query
+    def count_attendance_today(self):
+        with self._read() as conn:
+            c = conn.cursor()
+            c.execute('SELECT present FROM daily_summary WHERE date=?', (datetime.now().strftime('%Y-%m-%d'),))
+            row = c.fetchone()
+            return row[0] if row else 0
 
     def close(self):
-        self.conn.close()
+        self._writer.stop()
+        self._readers.close()
+        self._watch.close()
@@ -1,98 +1,414 @@
 """
 face_utils.py
 Face detection, encoding, recognition, and liveness detection utilities.
+
+Recognition can be scoped to shards of the gallery: a shard is a department, or
+a group of departments named in shard_map (e.g. a building). A scoped search is
+an exact scan of just those rows, with an optional fall back to the whole
+gallery for faces it leaves unmatched.
+
+face_recognition (and the dlib models it loads on import) is imported on first
+use, so constructing FaceUtils only loads the gallery; warm_up() pays for the
+models and the first inference ahead of the first real frame.
 """
-import face_recognition
 import numpy as np
 import cv2
-import pickle
 import os
 import hashlib
+import threading
+import time
 from datetime import datetime
+from utils.gallery import Gallery
+from utils.ann_index import make_index, top_k as nearest
+from utils.gallery_store import GalleryStore, migrate_pickle
+from utils.detection import DetectionPolicy
+from utils.quality import face_quality
+from utils.liveness import is_live
+from utils.logger import log_info
+from utils import metrics
 
+GALLERY_PATH = os.path.join(os.path.dirname(__file__), 'gallery')
+# Legacy pickle format, migrated into GALLERY_PATH on first start
 ENCODINGS_PATH = os.path.join(os.path.dirname(__file__), 'encodings.pkl')
+TEMPLATE_REDUCTIONS = ('min', 'weighted')
+# Templates of zero quality still count a little in weighted matching
+MIN_TEMPLATE_WEIGHT = 0.05
+# Side of the blank frame warm_up() runs detection and encoding on
+WARM_UP_SIZE = 160
+
+DETECT_SECONDS = metrics.histogram('attendance_detect_seconds', 'Face detection time per frame')
+ENCODE_SECONDS = metrics.histogram('attendance_encode_seconds', 'Face encoding time per frame')
+MATCH_SECONDS = metrics.histogram('attendance_match_seconds', 'Gallery matching time per recognize_many call')
+FACES_DETECTED = metrics.counter('attendance_faces_detected_total', 'Faces found by detection')
+FACES_RECOGNIZED = metrics.counter('attendance_faces_recognized_total', 'Faces matched below the distance threshold')
+SCOPE_FALLBACKS = metrics.counter('attendance_scope_fallbacks_total',
+                                  'Faces searched in the whole gallery after no scoped match')
+FACES_UNKNOWN = metrics.counter('attendance_faces_unknown_total', 'Faces with no match below the distance threshold')
+GALLERY_TEMPLATES = metrics.gauge('attendance_gallery_templates', 'Templates in the loaded gallery')
 
 class FaceUtils:
-    def __init__(self, encodings_path=ENCODINGS_PATH):
-        self.encodings_path = encodings_path
-        self.known_encodings = []
-        self.known_ids = []
-        self.known_names = []
-        self.known_departments = []
+    def __init__(self, gallery_path=GALLERY_PATH, index='exact', legacy_path=ENCODINGS_PATH, detection=None,
+                 max_templates=5, template_reduce='min', shard_map=None, shards=None, fallback=True,
+                 **index_params):
+        # index: 'exact', 'ivf' or 'ivfpq' (see utils/ann_index.py for tuning params)
+        # detection: default DetectionPolicy for detect_faces (see utils/detection.py)
+        # max_templates: templates kept per person, best quality first (None = unlimited)
+        # template_reduce: how a person's template distances combine, 'min' or quality-'weighted' mean
+        # shard_map: department -> shard name; unmapped departments are shards of their own
+        # shards: load only these shards (read-only, e.g. a kiosk's worker process); None loads all
+        # fallback: default of recognize_many's fallback to the whole gallery for scoped searches
+        if template_reduce not in TEMPLATE_REDUCTIONS:
+            raise ValueError(f'Unknown template reduction: {template_reduce}')
+        self.gallery_path = gallery_path
+        self.detection = detection or DetectionPolicy()
+        # Constructor settings, so reopen() rebuilds with the same index, templates and scope
+        self._options = dict(index=index, legacy_path=legacy_path, detection=self.detection,
+                             max_templates=max_templates, template_reduce=template_reduce, shard_map=shard_map,
+                             shards=shards, fallback=fallback, **index_params)
+        self.max_templates = max_templates
+        self.template_reduce = template_reduce
+        self.shard_map = dict(shard_map or {})
+        self.loaded_shards = frozenset(shards) if shards is not None else None
+        self.fallback = fallback
+        # frozenset of shards -> (gallery version, rows or (start, stop), encodings, squared norms)
+        self._scopes = {}
+        # Per-thread RGB conversion buffers, reused while the frame size stays the same
+        self._local = threading.local()
+        # Held by searches and by every gallery change: a delete swap-moves rows and an add may
+        # reallocate the arrays, so a search must never see rows move under it. Reentrant because
+        # add_encodings deletes (through _cap_templates) and recognize calls recognize_many.
+        self._lock = threading.RLock()
+        self.legacy_path = legacy_path
+        self.gallery = Gallery()
+        self.store = GalleryStore(gallery_path)
+        self.index = make_index(index, self.gallery, **index_params)
+        # Set once warm_up() has loaded the models; warm_up_seconds is what that took
+        self.warmed = threading.Event()
+        self.warm_up_seconds = None
         self.load_encodings()
 
+    # Read-only views kept for callers that still expect the old parallel lists
+    @property
+    def known_encodings(self):
+        return self.gallery.encodings
+
+    @property
+    def known_ids(self):
+        return self.gallery.ids
+
+    @property
+    def known_names(self):
+        return self.gallery.names
+
+    @property
+    def known_departments(self):
+        return self.gallery.departments
+
+    def reopen(self):
+        """A new FaceUtils on the same gallery directory and settings, reading what is on disk now."""
+        return FaceUtils(self.gallery_path, **self._options)
+
+    def shard_of(self, department):
+        return self.shard_map.get(department, department)
+
+    def shard_names(self):
+        with self._lock:
+            return sorted({self.shard_of(department) for department in self.gallery.department_names()})
+
+    def _check_writable(self):
+        if self.loaded_shards is not None:
+            raise ValueError('This gallery was loaded with only some shards; enroll and delete through a full one')
+
     def delete_user(self, user_id):
         # Remove all encodings, names, departments for this user_id
-        indices = [i for i, uid in enumerate(self.known_ids) if uid == user_id]
-        for idx in sorted(indices, reverse=True):
-            del self.known_encodings[idx]
-            del self.known_ids[idx]
-            del self.known_names[idx]
-            del self.known_departments[idx]
-        self.save_encodings()
+        with self._lock:
+            self._check_writable()
+            rows = sorted(self.gallery.rows_for(user_id), reverse=True)
+            if not rows:
+                return
+            for row in rows:
+                moved = self.gallery.remove_row(row)
+                self.index.remove(row, moved)
+            self.store.append_delete(user_id)
+            self._maybe_compact()
+            GALLERY_TEMPLATES.set(len(self.gallery))
 
     def hash_id(self, id_str):
         return hashlib.sha256(id_str.encode()).hexdigest()
 
     def load_encodings(self):
-        if os.path.exists(self.encodings_path):
-            with open(self.encodings_path, 'rb') as f:
-                data = pickle.load(f)
-                self.known_encodings = data['encodings']
-                self.known_ids = data['ids']
-                self.known_names = data['names']
-                self.known_departments = data['departments']
-        else:
-            self.known_encodings = []
-            self.known_ids = []
-            self.known_names = []
-            self.known_departments = []
+        with self._lock:
+            if not self.store.exists() and self.legacy_path and os.path.exists(self.legacy_path):
+                count = migrate_pickle(self.legacy_path, self.store, self.gallery)
+                log_info(f'Migrated {count} encodings from {self.legacy_path} to {self.gallery_path}')
+            keep = None
+            if self.loaded_shards is not None:
+                keep = lambda department: self.shard_of(department) in self.loaded_shards
+            self.store.load(self.gallery, keep)
+            self.index.rebuild()
+            GALLERY_TEMPLATES.set(len(self.gallery))
 
     def save_encodings(self):
-        data = {
-            'encodings': self.known_encodings,
-            'ids': self.known_ids,
-            'names': self.known_names,
-            'departments': self.known_departments
-        }
-        with open(self.encodings_path, 'wb') as f:
-            pickle.dump(data, f)
-
-    def add_encoding(self, encoding, user_id, name, department):
-        self.known_encodings.append(encoding)
-        self.known_ids.append(user_id)
-        self.known_names.append(name)
-        self.known_departments.append(department)
-        self.save_encodings()
+        # Full checkpoint; routine adds/deletes only append to the journal
+        with self._lock:
+            self.store.checkpoint(self.gallery)
+
+    def _maybe_compact(self):
+        if self.store.needs_compaction():
+            self.save_encodings()
+
+    def add_encoding(self, encoding, user_id, name, department, quality=1.0):
+        return self.add_encodings([encoding], [user_id], [name], [department], [quality])
+
+    def add_encodings(self, encodings, ids, names, departments, qualities=None):
+        # Bulk enrollment: one gallery extend, one incremental index update, one journal append
+        with self._lock:
+            self._check_writable()
+            encodings = np.asarray(encodings, dtype=np.float32).reshape(len(ids), -1)
+            qualities = np.ones(len(ids), dtype=np.float32) if qualities is None else \
+                np.asarray(qualities, dtype=np.float32).reshape(len(ids))
+            if self.max_templates:
+                encodings, ids, names, departments, qualities = self._cap_templates(
+                    encodings, list(ids), list(names), list(departments), qualities)
+            rows = self.gallery.extend(encodings, ids, names, departments, qualities)
+            self.index.add(list(rows))
+            self.store.append_adds(encodings, ids, names, departments, qualities)
+            self._maybe_compact()
+            GALLERY_TEMPLATES.set(len(self.gallery))
+            return rows
+
+    def _cap_templates(self, encodings, ids, names, departments, qualities):
+        """
+        Keep at most max_templates per person, the highest quality ones across stored
+        and new templates. Returns the templates still to add; a person losing a stored
+        template is deleted first and their kept templates are re-added with the batch.
+        """
+        by_user = {}
+        for i, user_id in enumerate(ids):
+            by_user.setdefault(user_id, []).append(i)
+        keep = []
+        for user_id, new in by_user.items():
+            stored = self.gallery.rows_for(user_id)
+            if len(stored) + len(new) <= self.max_templates:
+                keep += [(encodings[i], ids[i], names[i], departments[i], qualities[i]) for i in new]
+                continue
+            ranked = sorted([(float(self.gallery.qualities[r]), 'stored', r) for r in stored] +
+                            [(float(qualities[i]), 'new', i) for i in new], key=lambda c: -c[0])
+            kept = ranked[:self.max_templates]
+            if any(kind == 'stored' for _, kind, _ in ranked[self.max_templates:]):
+                for _, kind, r in kept:
+                    if kind == 'stored':
+                        record = self.gallery.record(r)
+                        keep.append((self.gallery.encodings[r].copy(), user_id, record['name'],
+                                     record['department'], self.gallery.qualities[r]))
+                self.delete_user(user_id)
+            keep += [(encodings[i], ids[i], names[i], departments[i], qualities[i])
+                     for _, kind, i in kept if kind == 'new']
+        if not keep:
+            return np.zeros((0, self.gallery.dim), dtype=np.float32), [], [], [], np.zeros(0, dtype=np.float32)
+        encodings, ids, names, departments, qualities = zip(*keep)
+        return (np.asarray(encodings, dtype=np.float32), list(ids), list(names), list(departments),
+                np.asarray(qualities, dtype=np.float32))
 
     def is_duplicate_registration(self, user_id):
-        return user_id in self.known_ids
+        return user_id in self.gallery
 
-    def detect_faces(self, frame):
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        boxes = face_recognition.face_locations(rgb)
+    def to_rgb(self, frame):
+        """
+        BGR -> RGB into this thread's reusable buffer. The result is overwritten by
+        the next conversion on the same thread, so don't keep it across frames.
+        """
+        buffer = getattr(self._local, 'rgb', None)
+        if buffer is None or buffer.shape != frame.shape:
+            buffer = self._local.rgb = np.empty(frame.shape, dtype=np.uint8)
+        self._local.source = frame
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=buffer)
+
+    def converted_rgb(self, frame):
+        """This thread's RGB buffer if it holds frame (e.g. from process_frame), else None."""
+        return self._local.rgb if getattr(self._local, 'source', None) is frame else None
+
+    @metrics.timed(DETECT_SECONDS)
+    def detect_faces(self, frame, policy=None, rgb=None):
+        # Boxes are in frame's own coordinates, whatever resolution the policy detected at
+        rgb = self.to_rgb(frame) if rgb is None else rgb
+        boxes = (policy or self.detection).detect(rgb)
+        FACES_DETECTED.inc(len(boxes))
         return boxes
 
-    def encode_faces(self, frame, boxes):
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    @metrics.timed(ENCODE_SECONDS)
+    def encode_faces(self, frame, boxes, rgb=None):
+        import face_recognition
+        rgb = self.to_rgb(frame) if rgb is None else rgb
         encodings = face_recognition.face_encodings(rgb, boxes)
         return encodings
 
-    def recognize(self, encoding, threshold=0.6):
-        if not self.known_encodings:
-            return None, 0.0
-        dists = face_recognition.face_distance(self.known_encodings, encoding)
-        min_idx = np.argmin(dists)
-        min_dist = dists[min_idx]
-        confidence = (1 - min_dist) * 100
-        if min_dist < threshold:
-            return {
-                'id': self.known_ids[min_idx],
-                'name': self.known_names[min_idx],
-                'department': self.known_departments[min_idx]
-            }, confidence
+    def process_frame(self, frame, policy=None, tracker=None, stats=None):
+        """
+        Detect and encode one BGR frame with a single color conversion, done only
+        if detection or encoding actually runs. Returns (boxes, encodings, tracks, pending);
+        with a tracker, boxes belong to the visible tracks and encodings to pending.
+        stats (utils.pipeline.StageStats) receives 'detect' and 'encode' latencies.
+        """
+        start = time.perf_counter()
+        rgb = None
+
+        def converted():
+            nonlocal rgb
+            if rgb is None:
+                rgb = self.to_rgb(frame)
+            return rgb
+
+        def detect(image):
+            return self.detect_faces(image, policy, rgb=converted())
+
+        tracks = pending = None
+        if tracker is not None:
+            tracks, pending = tracker.step(frame, detect)
+            boxes = [t.box for t in tracks]
+            to_encode = [t.box for t in pending]
+        else:
+            boxes = to_encode = detect(frame)
+        detected = time.perf_counter()
+        encodings = self.encode_faces(frame, to_encode, rgb=converted()) if to_encode else []
+        if stats is not None:
+            stats.record('detect', detected - start)
+            stats.record('encode', time.perf_counter() - detected)
+        return boxes, encodings, tracks, pending
+
+    def template_qualities(self, frame, boxes, rgb=None):
+        """Quality score (utils/quality.py) of each face, with landmarks for the pose term."""
+        import face_recognition
+        rgb = self.to_rgb(frame) if rgb is None else rgb
+        landmarks = face_recognition.face_landmarks(rgb, boxes) if boxes else []
+        return [face_quality(rgb, box, marks)['score'] for box, marks in zip(boxes, landmarks)]
+
+    def recognize(self, encoding, threshold=0.6, shards=None, fallback=None):
+        matches, confidences, _ = self.recognize_many([encoding], threshold=threshold, top_k=1, shards=shards,
+                                                      fallback=fallback)
+        return matches[0], float(confidences[0])
+
+    def _scope(self, shards):
+        """Rows of the given shards, with their encodings; rebuilt only after the gallery changes."""
+        gallery = self.gallery
+        cached = self._scopes.get(shards)
+        if cached is not None and cached[0] == gallery.version:
+            return cached[1:]
+        departments = [d for d in gallery.department_names() if self.shard_of(d) in shards]
+        rows = gallery.rows_in(departments)
+        if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+            # Contiguous, as every shard is right after loading a snapshot: slice per search, no copy
+            scope = (rows, (int(rows[0]), int(rows[-1]) + 1), None, None)
+        else:
+            scope = (rows, None, gallery.encodings[rows], gallery.sq_norms[rows])
+        self._scopes[shards] = (gallery.version,) + scope
+        return scope
+
+    def _scoped_search(self, queries, k, shards):
+        """Exact (distances, rows) of the k nearest templates within shards, like index.search."""
+        rows, span, encodings, sq_norms = self._scope(shards)
+        if not len(rows):
+            return (np.full((len(queries), 0), np.inf, dtype=np.float32),
+                    np.full((len(queries), 0), -1, dtype=np.int64))
+        if span is not None:
+            encodings = self.gallery.encodings[span[0]:span[1]]
+            sq_norms = self.gallery.sq_norms[span[0]:span[1]]
+        d2 = queries @ encodings.T
+        d2 *= -2.0
+        d2 += sq_norms
+        d2 += np.einsum('ij,ij->i', queries, queries)[:, None]
+        np.maximum(d2, 0.0, out=d2)
+        dists, cols = nearest(np.sqrt(d2, out=d2), k)
+        return dists, rows[cols]
+
+    def _identity_distances(self, queries, candidate_rows):
+        """
+        Reduce every template of each candidate person to one distance per (face, person).
+        Returns (segment face index, segment distance, best row of the segment), with the
+        segments of each face contiguous.
+        """
+        gallery = self.gallery
+        ids = gallery.ids
+        seg_face, rows = [], []
+        for face, face_rows in enumerate(candidate_rows.tolist()):
+            for user_id in dict.fromkeys(ids[r] for r in face_rows if r >= 0):
+                user_rows = gallery.rows_for(user_id)
+                seg_face.append(face)
+                rows.append(user_rows)
+        lengths = np.fromiter(map(len, rows), dtype=np.intp, count=len(rows))
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        flat = np.fromiter((r for user_rows in rows for r in user_rows), dtype=np.intp, count=int(lengths.sum()))
+        seg_face = np.asarray(seg_face, dtype=np.intp)
+        face_of_row = np.repeat(seg_face, lengths)
+        # Exact distances from each face to every template of its candidate people
+        templates = gallery.encodings[flat]
+        q = queries[face_of_row]
+        d2 = gallery.sq_norms[flat] + np.einsum('ij,ij->i', q, q) - 2 * np.einsum('ij,ij->i', templates, q)
+        dists = np.sqrt(np.maximum(d2, 0.0))
+        if self.template_reduce == 'min':
+            seg_dists = np.minimum.reduceat(dists, starts)
         else:
-            return None, confidence
+            weights = np.maximum(gallery.qualities[flat], MIN_TEMPLATE_WEIGHT)
+            seg_dists = np.add.reduceat(dists * weights, starts) / np.add.reduceat(weights, starts)
+        # Closest template of each segment, to report which row matched
+        order = np.lexsort((dists, np.repeat(np.arange(len(rows)), lengths)))
+        return seg_face, seg_dists, flat[order[starts]]
+
+    @metrics.timed(MATCH_SECONDS)
+    def recognize_many(self, encodings, threshold=0.6, top_k=3, shards=None, fallback=None):
+        """
+        Match every face of a frame in one pass.
+        Returns (matches, confidences, candidates): per face the matched user
+        dict or None, the best confidence, and up to top_k (user, confidence) pairs.
+        A person's distance combines all their templates (template_reduce).
+        shards limits the search to those shards; faces without a match there are
+        searched in the whole gallery if fallback (default: self.fallback).
+        """
+        with self._lock:
+            count = len(encodings)
+            if count == 0 or not len(self.gallery):
+                FACES_UNKNOWN.inc(count)
+                return [None] * count, np.zeros(count), [[] for _ in range(count)]
+            queries = np.asarray(encodings, dtype=np.float32).reshape(count, -1)
+            # Enough nearest rows that top_k people survive one person filling several slots
+            k = top_k * (self.max_templates or 1)
+            if shards:
+                _, top = self._scoped_search(queries, k, frozenset(shards))
+            else:
+                _, top = self.index.search(queries, k=k)
+            matches, confidences, candidates = self._match(queries, top, threshold, top_k)
+            if shards and (self.fallback if fallback is None else fallback):
+                retry = [face for face, match in enumerate(matches) if match is None]
+                if retry:
+                    SCOPE_FALLBACKS.inc(len(retry))
+                    _, top = self.index.search(queries[retry], k=k)
+                    # The whole gallery includes the scope, so its answer replaces the scoped one
+                    retried = self._match(queries[retry], top, threshold, top_k)
+                    for face, match, confidence, found in zip(retry, *retried):
+                        matches[face], confidences[face], candidates[face] = match, confidence, found
+            recognized = sum(match is not None for match in matches)
+            FACES_RECOGNIZED.inc(recognized)
+            FACES_UNKNOWN.inc(count - recognized)
+            return matches, confidences, candidates
+
+    def _match(self, queries, top, threshold, top_k):
+        count = len(queries)
+        matches, confidences, candidates = [None] * count, np.zeros(count), [[] for _ in range(count)]
+        if not (top >= 0).any():
+            return matches, confidences, candidates
+        seg_face, seg_dists, seg_rows = self._identity_distances(queries, top)
+        # Per face, people sorted by their combined distance
+        order = np.lexsort((seg_dists, seg_face))
+        for face, dist, row in zip(seg_face[order].tolist(), seg_dists[order].tolist(), seg_rows[order].tolist()):
+            found = candidates[face]
+            if len(found) >= top_k:
+                continue
+            if not found:
+                confidences[face] = (1 - dist) * 100
+                if dist < threshold:
+                    matches[face] = self.gallery.record(row)
+            found.append((self.gallery.record(row), (1 - dist) * 100))
+        return matches, confidences, candidates
 
     def draw_boxes(self, frame, boxes, names=None):
         for i, box in enumerate(boxes):
@@ -103,6 +419,38 @@ class FaceUtils:
             cv2.putText(frame, label, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
         return frame
 
+    def annotate(self, frame, boxes, names=None, max_width=None):
+        """draw_boxes for display: frames wider than max_width are drawn on a downscaled copy."""
+        if max_width and frame.shape[1] > max_width:
+            scale = max_width / frame.shape[1]
+            frame = cv2.resize(frame, (max_width, int(round(frame.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+            boxes = [tuple(int(v * scale) for v in box) for box in boxes]
+        return self.draw_boxes(frame, boxes, names)
+
+    def warm_up(self, background=False):
+        """
+        Import face_recognition (loading the dlib models) and run the default policy's
+        detectors, the encoder and the landmark model once on a blank frame. With
+        background=True this runs in a daemon thread, which is returned; otherwise
+        returns the seconds it took. Timings stay out of the detect/encode metrics.
+        """
+        if background:
+            thread = threading.Thread(target=self.warm_up, name='face-warm-up', daemon=True)
+            thread.start()
+            return thread
+        start = time.perf_counter()
+        import face_recognition
+        rgb = np.zeros((WARM_UP_SIZE, WARM_UP_SIZE, 3), dtype=np.uint8)
+        box = (WARM_UP_SIZE // 4, WARM_UP_SIZE * 3 // 4, WARM_UP_SIZE * 3 // 4, WARM_UP_SIZE // 4)
+        self.detection.warm_up(rgb)
+        face_recognition.face_encodings(rgb, [box])
+        face_recognition.face_landmarks(rgb, [box])
+        self.warm_up_seconds = time.perf_counter() - start
+        self.warmed.set()
+        log_info(f'Face models warmed up in {self.warm_up_seconds:.2f}s')
+        return self.warm_up_seconds
+
     def basic_liveness(self, frame, boxes):
-        # Optional: Simple blink detection stub (returns True for now)
-        return [True for _ in boxes]
+        # Single-frame texture check of a BGR frame; blink liveness needs tracks (utils.liveness.LivenessChecker)
+        rgb = self.converted_rgb(frame)
+        return is_live(self.to_rgb(frame) if rgb is None else rgb, boxes)
@@ -1,14 +1,14 @@
-import pickle
+import os
+from utils.gallery import Gallery
+from utils.gallery_store import GalleryStore
 
-# Sample data structure expected by your app
-sample_data = {
-    'encodings': [],  # List of face encodings (numpy arrays, empty for now)
-    'ids': [],        # List of user IDs
-    'names': [],      # List of user names
-    'departments': [] # List of user departments
-}
+GALLERY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gallery')
 
-with open('encodings.pkl', 'wb') as f:
-    pickle.dump(sample_data, f)
-
-print('Sample encodings.pkl created.')
+# Empty gallery in the on-disk format expected by your app:
+# gallery/CURRENT, matrix-000000.npy (0 x 128 float32), meta-000000.json, journal-000000.log
+store = GalleryStore(GALLERY_PATH)
+if store.exists():
+    print(f'Gallery already exists at {GALLERY_PATH}, leaving it untouched.')
+else:
+    store.checkpoint(Gallery())
+    print(f'Empty gallery created at {GALLERY_PATH}.')
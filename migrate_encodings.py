@@ -0,0 +1,23 @@
+"""
+migrate_encodings.py
+One-time migration of the legacy encodings.pkl into the memory-mapped gallery format.
+FaceUtils does this automatically on first start; run this to do it ahead of time.
+"""
+import os
+import sys
+from utils.gallery import Gallery
+from utils.gallery_store import GalleryStore, migrate_pickle
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+GALLERY_PATH = os.path.join(ROOT, 'gallery')
+ENCODINGS_PATH = os.path.join(ROOT, 'encodings.pkl')
+
+source = sys.argv[1] if len(sys.argv) > 1 else ENCODINGS_PATH
+target = sys.argv[2] if len(sys.argv) > 2 else GALLERY_PATH
+
+store = GalleryStore(target)
+if store.exists():
+    print(f'{target} already holds a gallery; remove it first to migrate again.')
+    sys.exit(1)
+count = migrate_pickle(source, store, Gallery())
+print(f'Migrated {count} encodings from {source} to {target}.')
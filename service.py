@@ -0,0 +1,377 @@
+"""
+service.py
+Headless recognition service: an asyncio HTTP/WebSocket API around FaceUtils and Database.
+
+Kiosks and cameras post JPEG frames; decoding, detection and encoding run in a
+process pool, matching runs in one vectorized pass and attendance is written in
+one transaction per request. The Streamlit app is just another client.
+
+A single frame cannot show a blink, so faces are marked only if they pass the
+single-frame texture check (utils.liveness.is_live: no print/screen moire).
+--no-liveness turns that off, for supervised kiosks whose frames are trusted.
+
+Usage: python service.py --port 8080 --workers 4
+       python service.py --port 8081 --shards Physics Chemistry   (a node holding two shards)
+
+Endpoints:
+  GET  /health            gallery size, in-flight frames and per-stage latency
+  POST /recognize         body: one JPEG; query: threshold (%), source, mark (1/0),
+                          shards (comma-separated gallery shards to match first), fallback (1/0)
+  POST /recognize/batch   multipart body, one JPEG per part; same query parameters
+  POST /gallery/reload    reload the gallery after enrollments from another process
+  GET  /metrics           Prometheus text format
+  GET  /ws                WebSocket: binary messages are JPEG frames, text messages are
+                          JSON settings ({"threshold": 70, "source": "Kiosk 1", "mark": true,
+                          "shards": ["Physics"]});
+                          each frame is answered with a JSON result carrying its seq
+Each face in a result carries "live"; faces that fail the texture check are recognized
+but never marked.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import cv2
+import numpy as np
+from aiohttp import web, WSMsgType
+from utils.pipeline import StageStats
+from utils.liveness import is_live
+from utils.presence import PresenceIndex
+from utils.logger import log_error, log_info
+from utils import metrics
+
+REQUEST_SECONDS = metrics.histogram('attendance_service_request_seconds', 'Recognition request time, all frames')
+DECODE_SECONDS = metrics.histogram('attendance_decode_seconds', 'JPEG decode time per frame')
+REJECTED = metrics.counter('attendance_service_rejected_total', 'Frames answered with 503')
+
+DEFAULT_THRESHOLD = 70
+
+# Per-process FaceUtils, created by _init_worker
+_worker_face_utils = None
+
+
+def _init_worker(gallery_path):
+    global _worker_face_utils
+    from face_utils import FaceUtils
+    # Workers only detect and encode, so they load no gallery rows at all
+    _worker_face_utils = FaceUtils(gallery_path, shards=())
+    # Loads the models while the process starts instead of on its first frame
+    _worker_face_utils.warm_up()
+
+
+def _worker_ready():
+    return os.getpid()
+
+
+def _set_worker(face_utils):
+    # Thread executors share the service's FaceUtils instead of loading their own
+    global _worker_face_utils
+    _worker_face_utils = face_utils
+
+
+def encode_jpeg(data, policy=None, liveness=True):
+    """
+    Decode, detect and encode one JPEG (runs in a worker). Boxes are in full-resolution pixels.
+    With liveness, each face also gets the single-frame texture check (live is all True without).
+    """
+    timings = {}
+    start = time.perf_counter()
+    frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        return {'error': 'Could not decode image'}
+    decoded = time.perf_counter()
+    # One color conversion shared by detection and encoding
+    rgb = _worker_face_utils.to_rgb(frame)
+    boxes = _worker_face_utils.detect_faces(frame, policy, rgb=rgb)
+    detected = time.perf_counter()
+    encodings = _worker_face_utils.encode_faces(frame, boxes, rgb=rgb) if boxes else []
+    encoded = time.perf_counter()
+    live = is_live(rgb, boxes) if liveness else [True] * len(boxes)
+    timings['decode'] = decoded - start
+    timings['detect'] = detected - decoded
+    timings['encode'] = encoded - detected
+    timings['liveness'] = time.perf_counter() - encoded
+    return {
+        'boxes': [list(box) for box in boxes],
+        'encodings': np.asarray(encodings, dtype=np.float32).reshape(-1, 128),
+        'live': live,
+        'size': [frame.shape[1], frame.shape[0]],
+        'timings': timings,
+    }
+
+
+class Overloaded(Exception):
+    pass
+
+
+class AttendanceService:
+    def __init__(self, face_utils, db, workers=None, max_inflight=None, policy=None, executor='process',
+                 presence=None, liveness=True):
+        self.face_utils = face_utils
+        self.db = db
+        # False marks faces that fail the texture check too (trusted, supervised kiosks only)
+        self.liveness = liveness
+        # People already marked today are answered from memory without touching SQLite
+        self.presence = presence if presence is not None else PresenceIndex(db)
+        # None uses the worker FaceUtils' default DetectionPolicy
+        self.policy = policy
+        self.workers = workers or os.cpu_count() or 1
+        # Frames beyond this are rejected with 503 instead of queueing up latency
+        self.max_inflight = max_inflight or self.workers * 4
+        self.inflight = 0
+        self.stats = StageStats()
+        if executor == 'process':
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             initargs=(face_utils.gallery_path,))
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='encode',
+                                            initializer=_set_worker, initargs=(face_utils,))
+        # Matching and SQLite writes are short and release the GIL in numpy/sqlite
+        self._io = ThreadPoolExecutor(max_workers=2, thread_name_prefix='match')
+
+    async def _encode(self, data):
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self._pool, encode_jpeg, data, self.policy, self.liveness)
+        timings = result.get('timings', {})
+        for stage, seconds in timings.items():
+            self.stats.record(stage, seconds)
+        if timings:
+            DECODE_SECONDS.observe(timings['decode'])
+            if isinstance(self._pool, ProcessPoolExecutor):
+                # Worker processes have their own registries; their timings come back with the result
+                from face_utils import DETECT_SECONDS, ENCODE_SECONDS
+                DETECT_SECONDS.observe(timings['detect'])
+                ENCODE_SECONDS.observe(timings['encode'])
+        return result
+
+    async def process(self, frames, threshold=DEFAULT_THRESHOLD, source='Service', mark=True, shards=None,
+                      fallback=None):
+        """Recognize a list of JPEG byte strings and mark attendance; returns one result per frame."""
+        if self.inflight + len(frames) > self.max_inflight:
+            self.stats.incr('rejected', len(frames))
+            REJECTED.inc(len(frames))
+            raise Overloaded()
+        self.inflight += len(frames)
+        try:
+            start = time.perf_counter()
+            encoded = await asyncio.gather(*[self._encode(data) for data in frames])
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(self._io, self._match_and_mark, encoded, threshold, source, mark,
+                                                 shards, fallback)
+            self.stats.incr('frames_out', len(frames))
+            self.stats.record('request', time.perf_counter() - start)
+            REQUEST_SECONDS.observe(time.perf_counter() - start)
+            return results
+        finally:
+            self.inflight -= len(frames)
+
+    def _match_and_mark(self, encoded, threshold, source, mark, shards=None, fallback=None):
+        start = time.perf_counter()
+        # One recognize_many call over every face of every frame in the request
+        face_utils = self.face_utils
+        batches = [r['encodings'] for r in encoded if 'error' not in r and len(r['encodings'])]
+        all_encodings = np.concatenate(batches) if batches else np.zeros((0, 128), dtype=np.float32)
+        matches, confidences, _ = face_utils.recognize_many(all_encodings, threshold=1-threshold/100, shards=shards,
+                                                            fallback=fallback)
+        self.stats.record('match', time.perf_counter() - start)
+
+        results, best = [], {}
+        face_index = 0
+        for r in encoded:
+            if 'error' in r:
+                results.append({'error': r['error'], 'faces': []})
+                continue
+            faces = []
+            for box, live in zip(r['boxes'], r['live']):
+                user, conf = matches[face_index], float(confidences[face_index])
+                face_index += 1
+                accepted = user is not None and conf >= threshold
+                face = {'box': box, 'user': user if accepted else None, 'confidence': conf, 'live': bool(live),
+                        'marked': False}
+                faces.append(face)
+                if not live:
+                    self.stats.incr('spoofs')
+                    continue
+                if accepted and conf > best.get(user['id'], (None, -1))[1]:
+                    best[user['id']] = (face, conf)
+            results.append({'faces': faces, 'size': r['size']})
+
+        if mark and best:
+            start = time.perf_counter()
+            chosen = [best[user_id] for user_id in self.presence.due(best)]
+            inserted = self.db.mark_attendance_many([
+                (face['user']['id'], face['user']['name'], face['user']['department'], conf, source)
+                for face, conf in chosen
+            ])
+            for (face, _), is_new in zip(chosen, inserted):
+                face['marked'] = is_new
+            self.presence.mark_present(face['user']['id'] for face, _ in chosen)
+            self.stats.record('mark', time.perf_counter() - start)
+            self.stats.incr('marked', sum(inserted))
+        return results
+
+    async def reload_gallery(self):
+        # Build the new gallery off the event loop (same index and settings), then swap it in with one assignment
+        loop = asyncio.get_running_loop()
+        face_utils = await loop.run_in_executor(self._io, self.face_utils.reopen)
+        self.face_utils = face_utils
+        if isinstance(self._pool, ThreadPoolExecutor):
+            _set_worker(face_utils)
+        return len(face_utils.gallery)
+
+    async def warm_up(self):
+        """Start every worker and load its models before the first frame arrives."""
+        loop = asyncio.get_running_loop()
+        if isinstance(self._pool, ProcessPoolExecutor):
+            # Processes are spawned on demand; one task per worker starts them all (each warms up in _init_worker)
+            pids = await asyncio.gather(*[loop.run_in_executor(self._pool, _worker_ready)
+                                          for _ in range(self.workers)])
+            log_info(f'{len(set(pids))} worker processes warmed up')
+        else:
+            await loop.run_in_executor(self._io, self.face_utils.warm_up)
+
+    def health(self):
+        return {
+            'status': 'ok',
+            'gallery': len(self.face_utils.gallery),
+            'workers': self.workers,
+            'inflight': self.inflight,
+            'max_inflight': self.max_inflight,
+            'stats': self.stats.snapshot(),
+        }
+
+    def close(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._io.shutdown(wait=True)
+
+
+def _flag(value):
+    return str(value).lower() not in ('0', 'false', 'no')
+
+
+def _request_options(query):
+    return {
+        'threshold': float(query.get('threshold', DEFAULT_THRESHOLD)),
+        'source': query.get('source', 'Service'),
+        'mark': _flag(query.get('mark', '1')),
+        'shards': [shard for shard in query.get('shards', '').split(',') if shard] or None,
+        'fallback': _flag(query['fallback']) if 'fallback' in query else None,
+    }
+
+
+async def handle_health(request):
+    return web.json_response(request.app['service'].health())
+
+
+async def handle_recognize(request):
+    data = await request.read()
+    if not data:
+        raise web.HTTPBadRequest(text='Expected a JPEG request body')
+    try:
+        results = await request.app['service'].process([data], **_request_options(request.query))
+    except Overloaded:
+        raise web.HTTPServiceUnavailable(text='Too many frames in flight')
+    return web.json_response(results[0])
+
+
+async def handle_batch(request):
+    if not request.content_type.startswith('multipart/'):
+        raise web.HTTPBadRequest(text='Expected a multipart body with one JPEG per part')
+    frames = []
+    reader = await request.multipart()
+    async for part in reader:
+        frames.append(await part.read())
+    try:
+        results = await request.app['service'].process(frames, **_request_options(request.query))
+    except Overloaded:
+        raise web.HTTPServiceUnavailable(text='Too many frames in flight')
+    return web.json_response({'frames': results})
+
+
+async def handle_metrics(request):
+    return web.Response(body=metrics.export_prometheus().encode('utf-8'),
+                        headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+async def handle_reload(request):
+    count = await request.app['service'].reload_gallery()
+    log_info(f'Service gallery reloaded: {count} encodings')
+    return web.json_response({'gallery': count})
+
+
+async def handle_ws(request):
+    service = request.app['service']
+    ws = web.WebSocketResponse(max_msg_size=16 * 1024 * 1024)
+    await ws.prepare(request)
+    options = _request_options(request.query)
+    seq = 0
+    async for msg in ws:
+        if msg.type == WSMsgType.TEXT:
+            try:
+                settings = json.loads(msg.data)
+                options.update({k: settings[k] for k in ('threshold', 'source', 'mark', 'shards', 'fallback')
+                                if k in settings})
+            except (ValueError, TypeError):
+                await ws.send_json({'error': 'Settings must be a JSON object'})
+        elif msg.type == WSMsgType.BINARY:
+            try:
+                results = await service.process([msg.data], **options)
+                await ws.send_json(dict(results[0], seq=seq))
+            except Overloaded:
+                await ws.send_json({'seq': seq, 'error': 'overloaded'})
+            seq += 1
+        elif msg.type == WSMsgType.ERROR:
+            log_error(f'WebSocket closed with {ws.exception()}')
+    return ws
+
+
+def create_app(service):
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app['service'] = service
+    app.router.add_get('/health', handle_health)
+    app.router.add_get('/metrics', handle_metrics)
+    app.router.add_post('/recognize', handle_recognize)
+    app.router.add_post('/recognize/batch', handle_batch)
+    app.router.add_post('/gallery/reload', handle_reload)
+    app.router.add_get('/ws', handle_ws)
+
+    async def on_startup(app):
+        # In the background, so the service answers (slowly) while models are still loading
+        app['warm_up'] = asyncio.ensure_future(app['service'].warm_up())
+
+    async def on_cleanup(app):
+        app['service'].close()
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=None, help='Detection/encoding processes')
+    parser.add_argument('--max-inflight', type=int, default=None,
+                        help='Frames accepted concurrently before answering 503 (default 4 per worker)')
+    parser.add_argument('--min-face', type=int, default=40, help='Smallest face to detect, in image pixels')
+    parser.add_argument('--index', default='exact', choices=['exact', 'ivf', 'ivfpq'])
+    parser.add_argument('--shards', nargs='+', default=None,
+                        help='Load only these gallery shards (departments); enrollment stays with the app')
+    parser.add_argument('--no-liveness', action='store_true',
+                        help='Also mark faces that fail the print/screen texture check (trusted kiosks only)')
+    args = parser.parse_args()
+
+    from face_utils import FaceUtils
+    from database import Database
+    from utils.detection import DetectionPolicy
+    service = AttendanceService(FaceUtils(index=args.index, shards=args.shards), Database(), workers=args.workers,
+                                max_inflight=args.max_inflight, policy=DetectionPolicy(min_face=args.min_face),
+                                liveness=not args.no_liveness)
+    log_info(f'Attendance service listening on {args.host}:{args.port} with {service.workers} workers')
+    web.run_app(create_app(service), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
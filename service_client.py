@@ -0,0 +1,131 @@
+"""
+service_client.py
+Client for service.py: a blocking helper for the Streamlit app and a CLI to drive
+and load-test a running service.
+
+Usage: python service_client.py photos/ --url http://localhost:8080 --mode ws --concurrency 8 --repeat 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import urllib.parse
+import urllib.request
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def post_frame(url, data, threshold=70, source='Service', mark=True, timeout=30, shards=None, fallback=None):
+    """POST one encoded image to /recognize and return the decoded JSON result."""
+    params = {'threshold': threshold, 'source': source, 'mark': int(mark)}
+    if shards:
+        params['shards'] = ','.join(shards)
+    if fallback is not None:
+        params['fallback'] = int(fallback)
+    query = urllib.parse.urlencode(params)
+    request = urllib.request.Request(f"{url.rstrip('/')}/recognize?{query}", data=data,
+                                     headers={'Content-Type': 'image/jpeg'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def find_images(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+async def _run_http(session, url, frames, params, batch):
+    import aiohttp
+    if batch:
+        with aiohttp.MultipartWriter('form-data') as writer:
+            for data in frames:
+                writer.append(data, {'Content-Type': 'image/jpeg'})
+        async with session.post(f'{url}/recognize/batch', data=writer, params=params) as response:
+            response.raise_for_status()
+            return (await response.json())['frames']
+    async with session.post(f'{url}/recognize', data=frames[0], params=params,
+                            headers={'Content-Type': 'image/jpeg'}) as response:
+        response.raise_for_status()
+        return [await response.json()]
+
+
+async def drive(url, images, mode='http', concurrency=4, repeat=1, batch_size=8, params=None):
+    """Send every image `repeat` times from `concurrency` clients; returns (results, latencies)."""
+    import aiohttp
+    url = url.rstrip('/')
+    params = params or {}
+    jobs = asyncio.Queue()
+    chunk = batch_size if mode == 'batch' else 1
+    for _ in range(repeat):
+        for i in range(0, len(images), chunk):
+            jobs.put_nowait(images[i:i + chunk])
+    results, latencies = [], []
+
+    async def client(session):
+        ws = None
+        if mode == 'ws':
+            ws = await session.ws_connect(f'{url}/ws')
+            await ws.send_json(params)
+        try:
+            while not jobs.empty():
+                frames = jobs.get_nowait()
+                start = time.perf_counter()
+                if ws is not None:
+                    await ws.send_bytes(frames[0])
+                    results.append(await ws.receive_json())
+                else:
+                    results.extend(await _run_http(session, url, frames, params, mode == 'batch'))
+                latencies.append(time.perf_counter() - start)
+        finally:
+            if ws is not None:
+                await ws.close()
+
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*[client(session) for _ in range(concurrency)])
+    return results, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', help='Images or directories of images')
+    parser.add_argument('--url', default=os.environ.get('ATTENDANCE_SERVICE_URL', 'http://localhost:8080'))
+    parser.add_argument('--mode', default='http', choices=['http', 'batch', 'ws'])
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--threshold', type=float, default=70)
+    parser.add_argument('--source', default='Service')
+    parser.add_argument('--dry-run', action='store_true', help='Recognize without marking attendance')
+    args = parser.parse_args()
+
+    images = []
+    for path in find_images(args.paths):
+        with open(path, 'rb') as f:
+            images.append(f.read())
+    if not images:
+        parser.error('No images found')
+    params = {'threshold': args.threshold, 'source': args.source, 'mark': 0 if args.dry_run else 1}
+    started = time.perf_counter()
+    results, latencies = asyncio.run(drive(args.url, images, args.mode, args.concurrency,
+                                           args.repeat, args.batch_size, params))
+    elapsed = time.perf_counter() - started
+    faces = sum(len(r.get('faces', [])) for r in results)
+    known = sum(1 for r in results for face in r.get('faces', []) if face['user'])
+    marked = sum(1 for r in results for face in r.get('faces', []) if face['marked'])
+    errors = sum(1 for r in results if r.get('error'))
+    ms = np.asarray(latencies) * 1000.0
+    print(f'{len(results)} frames in {elapsed:.2f}s ({len(results) / elapsed:.1f} frames/s), '
+          f'{faces} faces, {known} recognized, {marked} marked, {errors} errors')
+    print(f'Request latency: p50 {np.percentile(ms, 50):.1f} ms  p95 {np.percentile(ms, 95):.1f} ms  '
+          f'max {ms.max():.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
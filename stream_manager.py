@@ -0,0 +1,424 @@
+"""
+stream_manager.py
+Multi-camera attendance: N capture sources feeding one shared detection/encoding pool.
+
+Each camera keeps only its freshest frame (utils.pipeline.LatestFrame), so an
+overloaded node drops stale frames per camera instead of building latency.
+Workers take frames round-robin from cameras that have one ready and none in
+flight, which gives every camera an equal share of the pool under overload and
+keeps each camera's tracker sequential. A single recognizer batches the faces
+of all cameras into one recognize_many call (one per shard scope), collapses repeated sightings of the
+same person across cameras, and marks attendance in one transaction per batch.
+With liveness on, a recognized person is only marked once their track has
+blinked (utils/liveness.py), checked by the worker that owns the camera.
+A camera can be scoped to gallery shards (departments) it is expected to see;
+its faces are then matched against those shards first (see FaceUtils).
+
+Usage: python stream_manager.py lobby=rtsp://10.0.0.5/stream gate=0 test=clip.mp4 --workers 4
+       python stream_manager.py lab=1 lobby=0 --scope lab=Physics,Chemistry
+"""
+import argparse
+import os
+import queue
+import threading
+import time
+from collections import deque
+import cv2
+import numpy as np
+from utils.pipeline import LatestFrame, StageStats
+from utils.tracking import FaceTracker
+from utils.detection import DetectionPolicy
+from utils.liveness import LivenessChecker, live_key, LIVE, PENDING
+from utils.presence import PresenceIndex
+from utils.logger import log_error, log_info
+from utils import metrics
+
+FRAME_LATENCY = metrics.histogram('attendance_frame_latency_seconds', 'Capture to recognized frame', loop='streams')
+
+
+def _open_source(source):
+    # Device indices arrive as strings from the command line
+    return cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+
+
+class CameraStream:
+    """One capture source: a reader thread, its freshest frame and its own tracker."""
+
+    def __init__(self, name, source, detect_every=5, realtime=None, on_frame=None, liveness=None, shards=None):
+        self.name = name
+        self.source = source
+        # Gallery shards this camera's faces are matched against first; None searches everything
+        self.shards = tuple(sorted(shards)) if shards else None
+        self.stats = StageStats()
+        self.latest = LatestFrame(self.stats)
+        # Liveness is judged per track, so it needs a tracker even when every frame is detected
+        self.liveness = liveness
+        self.tracker = FaceTracker(detect_every=detect_every) if detect_every > 1 or liveness else None
+        # Files are read at their native frame rate so they behave like live cameras
+        self.realtime = (not str(source).isdigit() and '://' not in str(source)) if realtime is None else realtime
+        self.on_frame = on_frame
+        self.busy = False
+        self.finished = False
+        self.last_result = None
+        self._capture = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self._capture = _open_source(self.source)
+        if not self._capture.isOpened():
+            log_error(f'Cannot open camera {self.name}: {self.source}')
+        self._thread = threading.Thread(target=self._capture_loop, name=f'capture-{self.name}', daemon=True)
+        self._thread.start()
+
+    def _capture_loop(self):
+        fps = self._capture.get(cv2.CAP_PROP_FPS) if self.realtime else 0
+        interval = 1.0 / fps if fps and fps > 0 else 0.0
+        next_at = time.perf_counter()
+        seq = 0
+        while not self._stop.is_set():
+            ret, frame = self._capture.read()
+            if not ret:
+                break
+            self.stats.incr('frames_in')
+            self.latest.put((seq, frame, time.perf_counter()))
+            seq += 1
+            if self.on_frame:
+                self.on_frame()
+            if interval:
+                next_at += interval
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        self.latest.close()
+        self.finished = True
+        if self.on_frame:
+            self.on_frame()
+
+    @property
+    def done(self):
+        # Capture ended and the last frame has been taken
+        return self.finished and not self.busy and self.latest.empty
+
+    def stop(self):
+        self._stop.set()
+        self.latest.close()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+        if self._capture is not None:
+            self._capture.release()
+
+
+class FairScheduler:
+    """Round-robin over cameras that have a fresh frame and nothing in flight."""
+
+    def __init__(self, cameras):
+        self.cameras = cameras
+        self._cursor = 0
+        self._cond = threading.Condition()
+
+    def notify(self):
+        with self._cond:
+            self._cond.notify()
+
+    def next(self, timeout=0.1):
+        deadline = time.perf_counter() + timeout
+        with self._cond:
+            while True:
+                count = len(self.cameras)
+                for offset in range(count):
+                    camera = self.cameras[(self._cursor + offset) % count]
+                    if camera.busy:
+                        continue
+                    item = camera.latest.get(timeout=0)
+                    if item is not None:
+                        camera.busy = True
+                        # Start after this camera next time, so a busy camera cannot starve the rest
+                        self._cursor = (self._cursor + offset + 1) % count
+                        return camera, item
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def release(self, camera):
+        with self._cond:
+            camera.busy = False
+            self._cond.notify()
+
+
+class SightingDeduper:
+    """
+    Collapse recognitions of one person across cameras and frames into one
+    attendance event: the best sighting per user in a batch is forwarded if the
+    shared PresenceIndex has them due (not present today, not within cooldown).
+    """
+
+    def __init__(self, presence):
+        self.presence = presence
+
+    def select(self, sightings, now=None):
+        """sightings: (camera, user, confidence); returns the best sighting per user that is due."""
+        best = {}
+        for camera, user, confidence in sightings:
+            user_id = user['id']
+            if user_id not in best or confidence > best[user_id][2]:
+                best[user_id] = (camera, user, confidence)
+        return [best[user_id] for user_id in self.presence.due(best, now)]
+
+    def confirm(self, user_ids):
+        self.presence.mark_present(user_ids)
+
+
+class StreamManager:
+    def __init__(self, face_utils, db=None, workers=None, threshold=70, min_face=80, detect_every=5,
+                 cooldown=30.0, max_batch=16, batch_wait=0.02, queue_size=None, source='Camera',
+                 liveness_budget_ms=None, presence=None, fallback=None):
+        self.face_utils = face_utils
+        self.db = db
+        self.workers = workers or os.cpu_count() or 1
+        self.threshold = threshold
+        # Detection resolution follows the smallest face of interest; encodings use full-res pixels
+        self.policy = DetectionPolicy(min_face=min_face, min_face_ratio=0)
+        self.detect_every = detect_every
+        # None disables liveness; otherwise each camera gets a LivenessChecker with this budget per frame
+        self.liveness_budget_ms = liveness_budget_ms
+        # Whether scoped cameras fall back to the whole gallery (None: the FaceUtils default)
+        self.fallback = fallback
+        self.max_batch = max_batch
+        self.batch_wait = batch_wait
+        self.source = source
+        self.cameras = []
+        self.scheduler = FairScheduler(self.cameras)
+        # Pass the process's PresenceIndex to share "present today" with other cameras and pages
+        self.deduper = SightingDeduper(presence if presence is not None else PresenceIndex(db, cooldown))
+        self.stats = StageStats()
+        self.events = deque(maxlen=500)
+        self._results = queue.Queue(maxsize=queue_size or self.workers * 2)
+        self._stop = threading.Event()
+        self._threads = []
+        self._recognizer = None
+
+    def add_camera(self, name, source, realtime=None, shards=None):
+        liveness = LivenessChecker(self.liveness_budget_ms) if self.liveness_budget_ms is not None else None
+        camera = CameraStream(name, source, self.detect_every, realtime, on_frame=self.scheduler.notify,
+                              liveness=liveness, shards=shards)
+        self.cameras.append(camera)
+        if self._threads:
+            camera.start()
+        return camera
+
+    def start(self):
+        for camera in self.cameras:
+            camera.start()
+        self._threads = [threading.Thread(target=self._worker_loop, name=f'detect-{i}', daemon=True)
+                         for i in range(self.workers)]
+        self._recognizer = threading.Thread(target=self._recognize_loop, name='recognize', daemon=True)
+        for thread in self._threads + [self._recognizer]:
+            thread.start()
+        return self
+
+    @property
+    def finished(self):
+        return self._recognizer is not None and not self._recognizer.is_alive()
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            picked = self.scheduler.next(timeout=0.1)
+            if picked is None:
+                if all(camera.done for camera in self.cameras):
+                    break
+                continue
+            camera, (seq, frame, captured_at) = picked
+            try:
+                boxes, encodings, tracks, pending = self.face_utils.process_frame(frame, self.policy, camera.tracker,
+                                                                                  self.stats)
+                # The camera is ours until released, so its liveness state is only touched here.
+                # It reuses process_frame's RGB conversion when detection or encoding made one.
+                statuses = camera.liveness.update(frame, tracks, rgb=self.face_utils.converted_rgb(frame)) \
+                    if camera.liveness else None
+                item = (camera, frame, boxes, encodings, tracks, pending, statuses, captured_at)
+                # Blocking put is the backpressure; the camera stays busy until it is accepted
+                while not self._stop.is_set():
+                    try:
+                        self._results.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+            finally:
+                self.scheduler.release(camera)
+
+    def _next_batch(self):
+        try:
+            batch = [self._results.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.perf_counter() + self.batch_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._results.get(timeout=remaining) if remaining > 0 else self._results.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _recognize_loop(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if not batch:
+                if not any(t.is_alive() for t in self._threads) and self._results.empty():
+                    break
+                continue
+            try:
+                self._recognize_batch(batch)
+            except Exception as e:
+                log_error(f'Stream recognition failed: {e}')
+
+    def _recognize_batch(self, batch):
+        start = time.perf_counter()
+        # One matrix search over the faces of every frame in the batch that share a scope
+        encodings = [np.asarray(item[3], dtype=np.float32).reshape(-1, 128) for item in batch]
+        scopes = {}
+        for index, item in enumerate(batch):
+            scopes.setdefault(item[0].shards, []).append(index)
+        recognized = [None] * len(batch)
+        for shards, indices in scopes.items():
+            matches, confidences, _ = self.face_utils.recognize_many(
+                np.concatenate([encodings[i] for i in indices]), threshold=1-self.threshold/100, shards=shards,
+                fallback=self.fallback)
+            offset = 0
+            for i in indices:
+                count = len(encodings[i])
+                recognized[i] = zip(matches[offset:offset + count], confidences[offset:offset + count])
+                offset += count
+        self.stats.record('match', time.perf_counter() - start)
+        self.stats.incr('batches')
+        self.stats.incr('batched_frames', len(batch))
+        sightings = []
+        for (camera, frame, boxes, _, tracks, pending, statuses, captured_at), faces in zip(batch, recognized):
+            results = []
+            for user, conf in faces:
+                accepted = user is not None and conf >= self.threshold
+                results.append((user if accepted else None, float(conf)))
+                if accepted and statuses is None:
+                    sightings.append((camera, user, float(conf)))
+            if camera.tracker is not None:
+                camera.tracker.assign(pending, results)
+                names = [t.label for t in tracks]
+            if statuses is not None:
+                # Identities are cached on tracks, so a person is forwarded whenever their track is live
+                # as that person; one re-identified by assign() above is pending until checked again
+                live = [statuses.get(live_key(t), PENDING) for t in tracks]
+                sightings += [(camera, t.user, t.confidence) for t, status in zip(tracks, live)
+                              if t.user and status == LIVE]
+                names = [t.label if status == LIVE else f'{t.label} ({status})' for t, status in zip(tracks, live)]
+            elif camera.tracker is None:
+                names = [user['name'] if user else 'Unknown' for user, _ in results]
+            camera.last_result = (frame, boxes, names)
+            camera.stats.incr('frames_out')
+            latency = time.perf_counter() - captured_at
+            camera.stats.record('latency', latency)
+            FRAME_LATENCY.observe(latency)
+        self._mark(self.deduper.select(sightings))
+
+    def _mark(self, selected):
+        if not selected:
+            return
+        inserted = [False] * len(selected)
+        if self.db is not None:
+            start = time.perf_counter()
+            inserted = self.db.mark_attendance_many([
+                (user['id'], user['name'], user['department'], conf, f'{self.source}: {camera.name}')
+                for camera, user, conf in selected
+            ])
+            self.stats.record('mark', time.perf_counter() - start)
+            self.deduper.confirm(user['id'] for _, user, _ in selected)
+        for (camera, user, conf), is_new in zip(selected, inserted):
+            self.stats.incr('marked' if is_new else 'already_marked')
+            self.events.append({'time': time.time(), 'camera': camera.name, 'user': user,
+                                'confidence': conf, 'marked': is_new})
+
+    def camera_stats(self):
+        report = {}
+        for camera in self.cameras:
+            snap = camera.stats.snapshot()
+            counters = snap['counters']
+            report[camera.name] = {
+                'captured': counters.get('frames_in', 0),
+                'processed': counters.get('frames_out', 0),
+                'dropped': counters.get('dropped_capture', 0),
+                'fps': snap['output_fps'],
+                'latency_ms': snap['stages'].get('latency', {}).get('mean_ms', 0.0),
+                'finished': camera.finished,
+            }
+        return report
+
+    def wait(self, timeout=None):
+        """Block until every source is exhausted (file sources) or timeout; returns finished."""
+        if self._recognizer is not None:
+            self._recognizer.join(timeout)
+        return self.finished
+
+    def stop(self):
+        self._stop.set()
+        for camera in self.cameras:
+            camera.stop()
+        self.scheduler.notify()
+        for thread in self._threads + ([self._recognizer] if self._recognizer else []):
+            thread.join(timeout=2.0)
+
+
+def parse_source(spec, index):
+    # "name=source" or just "source"
+    name, sep, source = spec.partition('=')
+    return (name, source) if sep else (f'cam{index}', spec)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sources', nargs='+', help='[name=]device index, RTSP/HTTP URL or video file')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--threshold', type=float, default=70, help='Confidence threshold (%%)')
+    parser.add_argument('--min-face', type=int, default=80, help='Smallest face to detect, in camera pixels')
+    parser.add_argument('--detect-every', type=int, default=5, help='Full detection every N frames (1 = no tracking)')
+    parser.add_argument('--cooldown', type=float, default=30.0, help='Seconds before a person is forwarded again')
+    parser.add_argument('--duration', type=float, default=None, help='Stop after this many seconds')
+    parser.add_argument('--fast', action='store_true', help='Read video files as fast as possible, not at their frame rate')
+    parser.add_argument('--dry-run', action='store_true', help='Recognize without marking attendance')
+    parser.add_argument('--liveness-ms', type=float, default=None,
+                        help='Require a blink before marking, spending at most this many ms per frame on it')
+    parser.add_argument('--scope', action='append', default=[], metavar='NAME=SHARD[,SHARD]',
+                        help='Match camera NAME against these gallery shards first (repeatable)')
+    args = parser.parse_args()
+
+    from face_utils import FaceUtils
+    from database import Database
+    manager = StreamManager(FaceUtils(), None if args.dry_run else Database(), workers=args.workers,
+                            threshold=args.threshold, min_face=args.min_face, detect_every=args.detect_every,
+                            cooldown=args.cooldown, liveness_budget_ms=args.liveness_ms)
+    scopes = dict(parse_source(spec, index) for index, spec in enumerate(args.scope))
+    for index, spec in enumerate(args.sources):
+        name, source = parse_source(spec, index)
+        shards = scopes[name].split(',') if name in scopes else None
+        manager.add_camera(name, source, realtime=False if args.fast else None, shards=shards)
+    log_info(f'Stream manager started with {len(manager.cameras)} cameras and {manager.workers} workers')
+    started = time.perf_counter()
+    manager.start()
+    try:
+        while not manager.wait(timeout=5.0):
+            if args.duration and time.perf_counter() - started >= args.duration:
+                break
+            for name, values in manager.camera_stats().items():
+                print(f"{name:>12}: {values['fps']:5.1f} fps  {values['latency_ms']:6.0f} ms  "
+                      f"captured {values['captured']}  processed {values['processed']}  dropped {values['dropped']}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        manager.stop()
+    counters = manager.stats.snapshot()['counters']
+    print(f"Marked {counters.get('marked', 0)}, already marked {counters.get('already_marked', 0)} "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
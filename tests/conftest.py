@@ -0,0 +1,31 @@
+"""
+conftest.py
+Shared fixtures: a throwaway database and gallery directory per test.
+"""
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(str(tmp_path / 'attendance.db'))
+    database.create_tables()
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def gallery_path(tmp_path):
+    return str(tmp_path / 'gallery')
+
+
+def unit_vectors(count, dim=128, seed=0):
+    rng = np.random.default_rng(seed)
+    data = rng.standard_normal((count, dim)).astype(np.float32)
+    return data / np.linalg.norm(data, axis=1, keepdims=True)
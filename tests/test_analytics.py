@@ -0,0 +1,106 @@
+from datetime import datetime
+import numpy as np
+import pytest
+from utils.analytics import AttendanceAnalytics
+
+# Two weeks from Monday 2026-03-02: (user, department, first arrival)
+ARRIVALS = [
+    ('a', 'Physics', '2026-03-02 08:50'), ('a', 'Physics', '2026-03-03 09:10'), ('a', 'Physics', '2026-03-09 09:00'),
+    ('b', 'Physics', '2026-03-02 09:30'),
+    ('c', 'Chemistry', '2026-03-04 08:00'), ('c', 'Chemistry', '2026-03-14 10:05'),
+]
+FROM, TO = '2026-03-02', '2026-03-15'
+
+
+@pytest.fixture
+def analytics(db):
+    db.register_users([('a', 'Ada', 'Physics'), ('b', 'Ben', 'Physics'), ('c', 'Cy', 'Chemistry')])
+    db.mark_attendance_many([(user_id, user_id.upper(), department, 90.0, 'Camera',
+                              datetime.strptime(when, '%Y-%m-%d %H:%M'))
+                             for user_id, department, when in ARRIVALS])
+    return AttendanceAnalytics(db)
+
+
+def test_daily_fills_empty_days(analytics):
+    daily = analytics.daily(FROM, TO)
+    assert len(daily) == 14
+    present = daily['Present']
+    assert present.loc['2026-03-02'] == 2 and present.loc['2026-03-05'] == 0 and present.sum() == 6
+    assert daily['Rate %'].loc['2026-03-02'] == pytest.approx(200 / 3)
+    assert analytics.daily(FROM, TO, 'Chemistry')['Present'].sum() == 2
+    assert analytics.open_days(FROM, TO) == 5
+
+
+def test_department_trend_averages_open_days(analytics):
+    trend = analytics.department_trend(FROM, TO, 'week')
+    rows = {(str(period.date()), department): (present, rate) for period, department, present, rate
+            in trend.itertuples(index=False)}
+    # Week one has three open days (Mon-Wed), week two two (Mon, Sat)
+    assert rows[('2026-03-02', 'Physics')] == pytest.approx((1.0, 50.0))
+    assert rows[('2026-03-02', 'Chemistry')] == pytest.approx((1 / 3, 100 / 3))
+    assert rows[('2026-03-09', 'Physics')] == pytest.approx((0.5, 25.0))
+    assert rows[('2026-03-09', 'Chemistry')] == pytest.approx((0.5, 50.0))
+
+
+def test_calendar_by_week(analytics):
+    # Starting on a Wednesday: Monday and Tuesday of the first week are outside the range
+    calendar = analytics.calendar('2026-03-04', TO)
+    assert list(calendar.columns) == ['2026-03-02', '2026-03-09']
+    assert np.isnan(calendar.loc['Mon', '2026-03-02']) and np.isnan(calendar.loc['Tue', '2026-03-02'])
+    assert calendar.loc['Wed', '2026-03-02'] == 1
+    assert calendar.loc['Thu', '2026-03-02'] == 0
+    assert calendar.loc['Mon', '2026-03-09'] == 1 and calendar.loc['Sat', '2026-03-09'] == 1
+    assert np.nansum(calendar.to_numpy()) == 3
+
+
+def test_calendar_by_month(analytics):
+    calendar = analytics.calendar('2026-02-27', '2026-03-03', period='month')
+    assert list(calendar.columns) == ['2026-02', '2026-03'] and list(calendar.index) == list(range(1, 32))
+    assert calendar.loc[27, '2026-02'] == 0 and calendar.loc[2, '2026-03'] == 2 and calendar.loc[3, '2026-03'] == 1
+    # February 2026 has no 29th, and March's range stops on the 3rd
+    assert np.isnan(calendar.loc[29, '2026-02']) and np.isnan(calendar.loc[4, '2026-03'])
+    assert np.isnan(calendar.loc[26, '2026-02'])
+
+
+def test_arrival_heatmap_buckets_by_hour(analytics):
+    heatmap = analytics.arrival_heatmap(FROM, TO)
+    assert list(heatmap.columns) == ['08:00', '09:00', '10:00']
+    assert heatmap.loc['Mon'].tolist() == [1, 2, 0]
+    assert heatmap.loc['Tue', '09:00'] == 1 and heatmap.loc['Wed', '08:00'] == 1 and heatmap.loc['Sat', '10:00'] == 1
+    assert heatmap.to_numpy().sum() == len(ARRIVALS)
+
+
+def test_arrival_distribution(analytics):
+    distribution = analytics.arrival_distribution(FROM, TO, bin_minutes=60)
+    assert distribution['Time'].tolist() == ['08:00', '09:00', '10:00']
+    assert distribution['Arrivals'].tolist() == [2, 3, 1]
+    np.testing.assert_allclose(distribution['Cumulative %'], [100 / 3, 500 / 6, 100.0])
+
+
+def test_punctuality(analytics):
+    frame = analytics.punctuality(FROM, TO, start='09:00', grace_minutes=5)
+    # Sorted by on-time share
+    assert frame['User ID'].tolist() == ['a', 'c', 'b']
+    ada = frame.iloc[0]
+    assert (ada['Name'], ada['Department'], ada['Days']) == ('Ada', 'Physics', 3)
+    # 3 of 5 open days; 09:10 is the one arrival after 09:05, by 5 minutes
+    assert ada['Attendance %'] == 60.0 and ada['On time %'] == 66.7 and ada['Late by (min)'] == 5.0
+    assert (ada['Mean arrival'], ada['Earliest'], ada['Latest']) == ('09:00', '08:50', '09:10')
+    assert ada['Spread (min)'] == pytest.approx(8.2)
+    cy, ben = frame.iloc[1], frame.iloc[2]
+    assert (cy['On time %'], cy['Late by (min)']) == (50.0, 60.0)
+    assert (ben['On time %'], ben['Late by (min)']) == (0.0, 25.0)
+
+
+def test_views_of_an_empty_range(analytics):
+    assert analytics.daily('2025-01-06', '2025-01-07')['Present'].tolist() == [0, 0]
+    assert analytics.department_trend('2025-01-06', '2025-01-07').empty
+    assert analytics.arrival_heatmap('2025-01-06', '2025-01-07').shape == (7, 0)
+    assert analytics.arrival_distribution('2025-01-06', '2025-01-07').empty
+    assert analytics.punctuality('2025-01-06', '2025-01-07').empty
+
+
+def test_views_are_recomputed_after_writes(analytics, db):
+    assert analytics.daily(FROM, TO)['Present'].sum() == 6
+    db.mark_attendance_many([('b', 'B', 'Physics', 90.0, 'Camera', datetime(2026, 3, 10, 9, 0))])
+    assert analytics.daily(FROM, TO)['Present'].sum() == 7
@@ -0,0 +1,141 @@
+import numpy as np
+import pytest
+from utils.ann_index import BruteForceIndex, IVFIndex, IVFPQIndex, make_index
+from utils.gallery import Gallery
+from conftest import unit_vectors
+
+SIZE = 1200
+SMALL = {'nlist': 32, 'nprobe': 4, 'min_train_size': 500, 'kmeans_iters': 5}
+
+
+def make_gallery(vectors, start=0):
+    gallery = Gallery(capacity=len(vectors))
+    extend(gallery, vectors, start)
+    return gallery
+
+
+def extend(gallery, vectors, start):
+    ids = [f'u{i}' for i in range(start, start + len(vectors))]
+    return gallery.extend(vectors, ids, ids, ['Physics'] * len(vectors))
+
+
+def noisy(vectors, noise=0.02, seed=1):
+    rng = np.random.default_rng(seed)
+    return (vectors + noise * rng.standard_normal(vectors.shape)).astype(np.float32)
+
+
+def nearest_ids(index, queries):
+    return index.gallery.ids[index.search(queries, k=1)[1][:, 0]].tolist()
+
+
+def cell_members(index):
+    return sorted(row for cell in index._lists for row in cell)
+
+
+@pytest.mark.parametrize('kind', ['ivf', 'ivfpq'])
+def test_recall_against_brute_force(kind):
+    vectors = unit_vectors(SIZE)
+    gallery = make_gallery(vectors)
+    index = make_index(kind, gallery, **SMALL)
+    index.rebuild()
+    assert index.is_trained and len(index.centroids) == 32
+    queries = noisy(vectors[::10])
+    expected = nearest_ids(BruteForceIndex(gallery), queries)
+    found = nearest_ids(index, queries)
+    assert np.mean(np.asarray(found) == expected) >= 0.95
+    # Re-ranked distances are exact for the rows found
+    dists, rows = index.search(queries[:5], k=3)
+    exact = np.linalg.norm(vectors[rows] - queries[:5, None, :], axis=2)
+    np.testing.assert_allclose(dists, exact, atol=1e-4)
+    assert (np.diff(dists, axis=1) >= 0).all()
+
+
+def test_probing_every_cell_is_exact():
+    vectors = unit_vectors(SIZE)
+    gallery = make_gallery(vectors)
+    index = IVFIndex(gallery, **dict(SMALL, nprobe=32))
+    index.rebuild()
+    queries = unit_vectors(20, seed=2)
+    expected = BruteForceIndex(gallery).search(queries, k=5)
+    dists, rows = index.search(queries, k=5)
+    np.testing.assert_array_equal(rows, expected[1])
+    np.testing.assert_allclose(dists, expected[0], atol=1e-4)
+
+
+def test_pq_without_rerank_still_finds_near_duplicates():
+    vectors = unit_vectors(SIZE)
+    index = IVFPQIndex(make_gallery(vectors), rerank=0, **SMALL)
+    index.rebuild()
+    queries = noisy(vectors[::10])
+    assert np.mean(np.asarray(nearest_ids(index, queries)) == [f'u{i}' for i in range(0, SIZE, 10)]) >= 0.9
+
+
+@pytest.mark.parametrize('kind', ['ivf', 'ivfpq'])
+def test_untrained_index_falls_back_to_brute_force(kind):
+    gallery = make_gallery(unit_vectors(100))
+    index = make_index(kind, gallery, **SMALL)
+    index.rebuild()
+    assert not index.is_trained
+    queries = unit_vectors(5, seed=2)
+    expected = BruteForceIndex(gallery).search(queries, k=3)
+    for actual, wanted in zip(index.search(queries, k=3), expected):
+        np.testing.assert_array_equal(actual, wanted)
+    # Searching an empty gallery returns no columns
+    assert make_index(kind, Gallery(), **SMALL).search(queries, k=3)[1].shape == (5, 0)
+
+
+@pytest.mark.parametrize('kind', ['ivf', 'ivfpq'])
+def test_adds_and_removes_after_training(kind):
+    vectors = unit_vectors(SIZE + 200)
+    gallery = make_gallery(vectors[:SIZE])
+    index = make_index(kind, gallery, **SMALL)
+    index.rebuild()
+    centroids = index.centroids
+    index.add(extend(gallery, vectors[SIZE:], SIZE))
+    # Below retrain_growth, new rows go into the existing cells
+    assert index.centroids is centroids and index.trained_size == SIZE
+    assert cell_members(index) == list(range(SIZE + 200))
+    new = np.arange(SIZE, SIZE + 200, 10)
+    assert nearest_ids(index, noisy(vectors[new])) == [f'u{i}' for i in new]
+    # Remove a few rows, including the last one; the rows swapped into their slots stay findable
+    removed = [0, 7, SIZE + 199, 300]
+    for user_id in (f'u{i}' for i in removed):
+        [row] = gallery.rows_for(user_id)
+        index.remove(row, gallery.remove_row(row))
+    assert cell_members(index) == list(range(len(gallery)))
+    found = nearest_ids(index, noisy(vectors[removed + [SIZE + 198, SIZE + 197]]))
+    assert found[-2:] == [f'u{SIZE + 198}', f'u{SIZE + 197}']
+    assert not set(found[:4]) & {f'u{i}' for i in removed}
+    if kind == 'ivfpq':
+        np.testing.assert_array_equal(index._codes[:len(gallery)], index._encode(gallery.encodings))
+
+
+@pytest.mark.parametrize('kind', ['ivf', 'ivfpq'])
+def test_retrains_as_the_gallery_grows(kind):
+    vectors = unit_vectors(2 * SIZE)
+    gallery = make_gallery(vectors[:400])
+    index = make_index(kind, gallery, **dict(SMALL, nlist=None))
+    index.rebuild()
+    # Crossing min_train_size trains the index
+    index.add(extend(gallery, vectors[400:SIZE], 400))
+    assert index.is_trained and index.trained_size == SIZE
+    assert len(index.centroids) == int(4 * np.sqrt(SIZE))
+    # Doubling the gallery retrains with more cells
+    index.add(extend(gallery, vectors[SIZE:], SIZE))
+    assert index.trained_size == 2 * SIZE and len(index.centroids) == int(4 * np.sqrt(2 * SIZE))
+    assert cell_members(index) == list(range(2 * SIZE))
+    queries = noisy(vectors[::20])
+    assert np.mean(np.asarray(nearest_ids(index, queries)) == [f'u{i}' for i in range(0, 2 * SIZE, 20)]) >= 0.95
+    # Shrinking below min_train_size and rebuilding drops the training
+    for row in range(len(gallery) - 1, 99, -1):
+        gallery.remove_row(row)
+    index.rebuild()
+    assert not index.is_trained
+
+
+def test_make_index_rejects_bad_parameters():
+    with pytest.raises(ValueError):
+        make_index('hnsw', Gallery())
+    with pytest.raises(ValueError):
+        IVFPQIndex(Gallery(), m=5)
+    assert isinstance(make_index('exact', Gallery()), BruteForceIndex)
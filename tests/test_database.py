@@ -0,0 +1,158 @@
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+import pytest
+from database import Database
+
+DAY = datetime(2026, 3, 2, 9, 0)
+
+
+def event(user_id, department='Physics', when=DAY, confidence=90.0, source='Camera'):
+    return (user_id, f'Name {user_id}', department, confidence, source, when)
+
+
+def rollups(db):
+    with db._read() as conn:
+        daily = dict(conn.execute('SELECT date, present FROM daily_summary WHERE present > 0').fetchall())
+        departments = {(d, dept): n for d, dept, n in conn.execute(
+            'SELECT date, department, present FROM department_daily WHERE present > 0')}
+        expected_daily = dict(conn.execute('SELECT date, COUNT(*) FROM attendance GROUP BY date').fetchall())
+        expected_departments = {(d, dept): n for d, dept, n in conn.execute(
+            'SELECT date, department, COUNT(*) FROM attendance GROUP BY date, department')}
+    return (daily, departments), (expected_daily, expected_departments)
+
+
+def test_batch_marks_each_person_once_per_day(db):
+    assert db.mark_attendance_many([event('a'), event('b'), event('a')]) == [True, True, False]
+    assert db.mark_attendance_many([event('a'), event('a', when=DAY + timedelta(days=1))]) == [False, True]
+    assert db.count_attendance() == 3
+
+
+def test_rollups_match_attendance_after_deletes(db):
+    db.register_users([('a', 'A', 'Physics'), ('b', 'B', 'Chemistry'), ('c', 'C', 'Physics')])
+    events = [event(user_id, department, DAY + timedelta(days=offset))
+              for offset in range(3) for user_id, department in (('a', 'Physics'), ('b', 'Chemistry'), ('c', 'Physics'))]
+    db.mark_attendance_many(events)
+    assert db.get_daily_presence('2026-03-02', '2026-03-04') == [('2026-03-02', 3), ('2026-03-03', 3),
+                                                                  ('2026-03-04', 3)]
+    db.delete_user('b')
+    db.delete_user('c')
+    actual, expected = rollups(db)
+    assert actual == expected
+    assert db.get_daily_presence('2026-03-02', '2026-03-04', 'Chemistry') == []
+    assert db.get_department_presence('2026-03-02', '2026-03-02') == [('2026-03-02', 'Physics', 1)]
+    assert db.count_users_by_department() == [('Physics', 1)]
+
+
+def test_rollups_are_backfilled_for_existing_attendance(tmp_path):
+    path = str(tmp_path / 'attendance.db')
+    db = Database(path)
+    db.mark_attendance_many([event('a'), event('b', 'Chemistry')])
+    with sqlite3.connect(path) as conn:
+        conn.execute('DROP TABLE daily_summary')
+        conn.execute('DROP TABLE department_daily')
+    db.close()
+    db = Database(path)
+    try:
+        actual, expected = rollups(db)
+        assert actual == expected and expected[0] == {'2026-03-02': 2}
+    finally:
+        db.close()
+
+
+def test_keyset_pages_cover_every_row_once(db):
+    # Several rows share a (date, time), so the id has to break ties
+    db.mark_attendance_many([event(f'u{i:03d}', when=DAY + timedelta(days=i % 4, minutes=i % 3))
+                             for i in range(103)])
+    expected = [row[0] for chunk in db.iter_attendance(chunk_size=7) for row in chunk]
+    pages, after = [], None
+    while True:
+        page = db.get_attendance_page(limit=10, after=after)
+        pages.extend(row[0] for row in page)
+        if len(page) < 10:
+            break
+        after = (page[-1][4], page[-1][5], page[-1][0])
+    assert len(pages) == len(set(pages)) == 103
+    assert pages == expected
+
+
+def test_filtered_pages_and_counts(db):
+    db.mark_attendance_many([event(f'u{i}', 'Physics' if i % 2 else 'Chemistry', DAY + timedelta(days=i % 3))
+                             for i in range(30)])
+    filters = {'date_from': '2026-03-03', 'date_to': '2026-03-04', 'department': 'Physics'}
+    rows = db.get_attendance_page(limit=100, **filters)
+    assert len(rows) == db.count_attendance(**filters) == 10
+    assert all(row[3] == 'Physics' and '2026-03-03' <= row[4] <= '2026-03-04' for row in rows)
+
+
+def test_cached_reads_see_new_writes(db):
+    assert db.get_attendance_page(limit=10) == []
+    db.mark_attendance_many([event('a')])
+    assert [row[1] for row in db.get_attendance_page(limit=10)] == ['a']
+    db.mark_attendance_many([event('b')])
+    assert db.count_attendance() == 2
+
+
+def test_concurrent_writers_and_readers(tmp_path):
+    db = Database(str(tmp_path / 'attendance.db'), pool_size=2)
+    errors, inserted = [], []
+
+    def write():
+        try:
+            for day in range(5):
+                # Everyone marks the same people, so exactly one insert per (user, day) may win
+                result = db.mark_attendance_many([event(f'u{i}', when=DAY + timedelta(days=day)) for i in range(20)])
+                inserted.append(sum(result))
+        except Exception as e:
+            errors.append(e)
+
+    def read():
+        try:
+            for _ in range(50):
+                db.cache.clear()
+                assert db.count_attendance() <= 100
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write) for _ in range(4)] + \
+              [threading.Thread(target=read) for _ in range(4)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors
+        assert sum(inserted) == db.count_attendance() == 100
+        assert db.pool_stats()['write_errors'] == 0
+    finally:
+        db.close()
+
+
+def test_read_connections_are_read_only(db):
+    with db._read() as conn:
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("INSERT INTO users VALUES ('a', 'A', 'Physics', '')")
+
+
+def test_read_pool_times_out_when_exhausted(tmp_path):
+    db = Database(str(tmp_path / 'attendance.db'), pool_size=1, timeout=0.2)
+    try:
+        with db._read():
+            with pytest.raises(sqlite3.OperationalError):
+                with db._read():
+                    pass
+        assert db.pool_stats()['read_timeouts'] == 1
+    finally:
+        db.close()
+
+
+def test_failed_write_rolls_back_and_writer_keeps_going(db):
+    def write(conn):
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute("INSERT INTO users VALUES ('a', 'A', 'Physics', '')")
+        raise ValueError('boom')
+    with pytest.raises(ValueError):
+        db._write(write)
+    assert db.count_users() == 0
+    db.register_user('b', 'B', 'Physics')
+    assert db.count_users() == 1
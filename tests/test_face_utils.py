@@ -0,0 +1,107 @@
+import threading
+import numpy as np
+import pytest
+from face_utils import FaceUtils
+from conftest import unit_vectors
+
+
+def make_face_utils(gallery_path, count, **kwargs):
+    face_utils = FaceUtils(gallery_path, legacy_path=None, **kwargs)
+    vectors = unit_vectors(count)
+    ids = [f'u{i}' for i in range(count)]
+    face_utils.add_encodings(vectors, ids, [f'Name {i}' for i in range(count)], ['Physics'] * count)
+    return face_utils, vectors, ids
+
+
+def test_recognize_many_matches_enrolled_faces(gallery_path):
+    face_utils, vectors, ids = make_face_utils(gallery_path, 50)
+    matches, confidences, _ = face_utils.recognize_many(vectors[:10], threshold=0.3)
+    assert [m['id'] for m in matches] == ids[:10]
+    assert np.all(confidences > 99)
+
+
+def test_search_never_sees_rows_move_during_deletes(gallery_path):
+    # Deleting swap-moves the last row into the hole; a search racing it must not
+    # report the person who moved into a row instead of the one it matched
+    face_utils, vectors, ids = make_face_utils(gallery_path, 400, max_templates=1)
+    stop = threading.Event()
+    errors = []
+
+    def churn():
+        rng = np.random.default_rng(1)
+        while not stop.is_set():
+            i = int(rng.integers(100, 400))
+            face_utils.delete_user(ids[i])
+            face_utils.add_encodings(vectors[i:i + 1], [ids[i]], [f'Name {i}'], ['Physics'])
+
+    writer = threading.Thread(target=churn)
+    writer.start()
+    try:
+        for _ in range(300):
+            matches, _, _ = face_utils.recognize_many(vectors[:100], threshold=0.3)
+            wrong = [(ids[i], m and m['id']) for i, m in enumerate(matches) if m is None or m['id'] != ids[i]]
+            if wrong:
+                errors.append(wrong[:3])
+                break
+    finally:
+        stop.set()
+        writer.join()
+    assert not errors
+
+
+def make_departments(gallery_path, **kwargs):
+    face_utils = FaceUtils(gallery_path, legacy_path=None, **kwargs)
+    vectors = unit_vectors(6)
+    departments = ['Physics', 'Chemistry', 'Biology'] * 2
+    face_utils.add_encodings(vectors, [f'u{i}' for i in range(6)], [f'Name {i}' for i in range(6)], departments)
+    return face_utils, vectors
+
+
+def test_scoped_search_only_matches_its_shards(gallery_path):
+    face_utils, vectors = make_departments(gallery_path)
+    matches, _, _ = face_utils.recognize_many(vectors, threshold=0.3, shards=['Physics'], fallback=False)
+    assert [m and m['id'] for m in matches] == ['u0', None, None, 'u3', None, None]
+    matches, _, _ = face_utils.recognize_many(vectors, threshold=0.3, shards=['Physics', 'Biology'], fallback=False)
+    assert [m and m['id'] for m in matches] == ['u0', None, 'u2', 'u3', None, 'u5']
+
+
+def test_scoped_search_falls_back_to_the_whole_gallery(gallery_path):
+    face_utils, vectors = make_departments(gallery_path, fallback=True)
+    matches, _, _ = face_utils.recognize_many(vectors, threshold=0.3, shards=['Physics'])
+    assert [m['id'] for m in matches] == [f'u{i}' for i in range(6)]
+    # The call's fallback overrides the default
+    match, _ = face_utils.recognize(vectors[1], threshold=0.3, shards=['Physics'], fallback=False)
+    assert match is None
+
+
+def test_shard_map_groups_departments(gallery_path):
+    face_utils, vectors = make_departments(gallery_path, shard_map={'Physics': 'Science', 'Chemistry': 'Science'})
+    assert face_utils.shard_names() == ['Biology', 'Science']
+    matches, _, _ = face_utils.recognize_many(vectors, threshold=0.3, shards=['Science'], fallback=False)
+    assert [m and m['id'] for m in matches] == ['u0', 'u1', None, 'u3', 'u4', None]
+
+
+def test_scope_follows_gallery_changes(gallery_path):
+    face_utils, vectors = make_departments(gallery_path)
+    face_utils.recognize_many(vectors, threshold=0.3, shards=['Physics'], fallback=False)
+    # Deleting swap-moves rows, so the scope is no longer one contiguous run
+    face_utils.delete_user('u0')
+    face_utils.add_encodings(unit_vectors(1, seed=7), ['u6'], ['Name 6'], ['Physics'])
+    matches, _, _ = face_utils.recognize_many(np.concatenate([vectors, unit_vectors(1, seed=7)]), threshold=0.3,
+                                              shards=['Physics'], fallback=False)
+    assert [m and m['id'] for m in matches] == [None, None, None, 'u3', None, None, 'u6']
+
+
+def test_shard_subset_loads_read_only(gallery_path):
+    face_utils, vectors = make_departments(gallery_path)
+    face_utils.save_encodings()
+    subset = FaceUtils(gallery_path, legacy_path=None, shards=['Chemistry'])
+    assert sorted(subset.gallery.ids.tolist()) == ['u1', 'u4']
+    matches, _, _ = subset.recognize_many(vectors, threshold=0.3)
+    assert [m and m['id'] for m in matches] == [None, 'u1', None, None, 'u4', None]
+    with pytest.raises(ValueError):
+        subset.add_encodings(vectors[:1], ['u9'], ['Name 9'], ['Chemistry'])
+    with pytest.raises(ValueError):
+        subset.delete_user('u1')
+    with pytest.raises(ValueError):
+        subset.save_encodings()
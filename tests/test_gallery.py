@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from utils.gallery import Gallery
+from conftest import unit_vectors
+
+
+def make_gallery(ids, departments=None):
+    gallery = Gallery(capacity=2)
+    gallery.extend(unit_vectors(len(ids)), ids, [f'Name {i}' for i in ids], departments or ['Physics'] * len(ids))
+    return gallery
+
+
+def test_extend_grows_past_capacity():
+    gallery = make_gallery(['a', 'b', 'c', 'a'])
+    assert len(gallery) == 4 and gallery.capacity >= 4
+    assert gallery.rows_for('a') == [0, 3]
+    np.testing.assert_allclose(gallery.sq_norms, 1.0, rtol=1e-5)
+
+
+def test_remove_row_swaps_the_last_row_in():
+    vectors = unit_vectors(4)
+    gallery = make_gallery(['a', 'b', 'c', 'd'], ['Physics', 'Physics', 'Chemistry', 'Biology'])
+    assert gallery.remove_row(1) == 3
+    assert gallery.ids.tolist() == ['a', 'd', 'c']
+    np.testing.assert_array_equal(gallery.encodings[1], vectors[3])
+    assert gallery.rows_for('d') == [1] and 'b' not in gallery
+    assert gallery.rows_in(['Biology']).tolist() == [1]
+    assert gallery.rows_in(['Physics']).tolist() == [0]
+    # The vacated slot holds no references
+    assert gallery._ids[3] is None
+
+
+def test_remove_last_row_moves_nothing():
+    gallery = make_gallery(['a', 'b'])
+    assert gallery.remove_row(1) is None
+    assert gallery.ids.tolist() == ['a']
+    with pytest.raises(IndexError):
+        gallery.remove_row(1)
+
+
+def test_remove_user_with_interleaved_templates():
+    gallery = make_gallery(['a', 'b', 'a', 'c', 'a'])
+    vectors = unit_vectors(5)
+    assert gallery.remove('a') == 3
+    assert sorted(gallery.ids.tolist()) == ['b', 'c']
+    # Every remaining row still carries its own encoding
+    for user_id, original in (('b', 1), ('c', 3)):
+        [row] = gallery.rows_for(user_id)
+        np.testing.assert_array_equal(gallery.encodings[row], vectors[original])
+    assert gallery.remove('a') == 0
+
+
+def test_distance_matrix_matches_numpy():
+    gallery = make_gallery(['a', 'b', 'c'])
+    queries = unit_vectors(2, seed=1)
+    expected = np.linalg.norm(queries[:, None, :] - gallery.encodings[None, :, :], axis=2)
+    np.testing.assert_allclose(gallery.distance_matrix(queries), expected, atol=1e-5)
+
+
+def test_first_change_copies_an_attached_matrix():
+    matrix = unit_vectors(3)
+    matrix.flags.writeable = False
+    gallery = Gallery()
+    gallery.attach(matrix, ['a', 'b', 'c'], ['A', 'B', 'C'], ['Physics'] * 3)
+    assert gallery.is_shared
+    version = gallery.version
+    gallery.remove('a')
+    assert not gallery.is_shared and gallery.version > version
+    np.testing.assert_array_equal(matrix, unit_vectors(3))
@@ -0,0 +1,182 @@
+import json
+import os
+import numpy as np
+import pytest
+from utils.gallery import Gallery
+from utils.gallery_store import RECORD_HEADER, GalleryStore
+from conftest import unit_vectors
+
+
+def open_store(path, keep=None):
+    store = GalleryStore(path, fsync=False)
+    gallery = Gallery()
+    store.load(gallery, keep)
+    return store, gallery
+
+
+def journal_path(store):
+    return store._file('journal', store.generation, 'log')
+
+
+def test_journal_replays_adds_and_deletes(gallery_path):
+    store, _ = open_store(gallery_path)
+    vectors = unit_vectors(3)
+    store.append_adds(vectors, ['a', 'b', 'c'], ['A', 'B', 'C'], ['Physics'] * 3, [0.5, 1.0, 1.0])
+    store.append_delete('b')
+    store.close()
+    reopened, gallery = open_store(gallery_path)
+    assert reopened.journal_records == 4
+    assert sorted(gallery.ids.tolist()) == ['a', 'c']
+    [row] = gallery.rows_for('a')
+    np.testing.assert_array_equal(gallery.encodings[row], vectors[0])
+    assert gallery.qualities[row] == pytest.approx(0.5)
+
+
+@pytest.mark.parametrize('cut', [1, 9, 20])
+def test_torn_tail_is_skipped_and_cut_off_by_the_writer(gallery_path, cut):
+    store, _ = open_store(gallery_path)
+    store.append_adds(unit_vectors(2), ['a', 'b'], ['A', 'B'], ['Physics'] * 2)
+    store.close()
+    path = journal_path(store)
+    intact = os.path.getsize(path)
+    # A crash mid-append leaves part of a third record behind
+    store, _ = open_store(gallery_path)
+    store.append_add(unit_vectors(1, seed=1)[0], 'c', 'C', 'Physics')
+    store.close()
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - cut)
+    torn = os.path.getsize(path)
+    reopened, gallery = open_store(gallery_path)
+    assert sorted(gallery.ids.tolist()) == ['a', 'b']
+    assert os.path.getsize(path) == torn
+    # The first append cuts the tail off, so records after it replay
+    reopened.append_delete('a')
+    reopened.close()
+    assert os.path.getsize(path) == intact + RECORD_HEADER.size + len(json.dumps(['a']))
+    _, gallery = open_store(gallery_path)
+    assert gallery.ids.tolist() == ['b']
+
+
+def test_reader_leaves_an_append_in_progress_alone(gallery_path):
+    writer, _ = open_store(gallery_path)
+    writer.append_add(unit_vectors(1)[0], 'a', 'A', 'Physics')
+    path = journal_path(writer)
+    with open(path, 'rb') as f:
+        record = f.read()
+    # The writer has written half of its next record when a reader loads
+    with open(path, 'ab') as f:
+        f.write(record[:len(record) // 2])
+    _, gallery = open_store(gallery_path)
+    assert gallery.ids.tolist() == ['a']
+    with open(path, 'ab') as f:
+        f.write(record[len(record) // 2:])
+    writer.append_add(unit_vectors(1, seed=1)[0], 'b', 'B', 'Physics')
+    writer.close()
+    reader, gallery = open_store(gallery_path)
+    assert reader.journal_records == 3
+    assert gallery.ids.tolist() == ['a', 'a', 'b']
+
+
+def test_corrupt_record_stops_replay(gallery_path):
+    store, _ = open_store(gallery_path)
+    store.append_adds(unit_vectors(2), ['a', 'b'], ['A', 'B'], ['Physics'] * 2)
+    store.close()
+    with open(journal_path(store), 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xFF]))
+    _, gallery = open_store(gallery_path)
+    assert gallery.ids.tolist() == ['a']
+
+
+def test_checkpoint_load_round_trip(gallery_path):
+    store, gallery = open_store(gallery_path)
+    vectors = unit_vectors(4)
+    gallery.extend(vectors, ['a', 'b', 'c', 'a'], ['A', 'B', 'C', 'A'], ['Physics', 'Chemistry', 'Physics', 'Physics'],
+                   [0.9, 0.8, 0.7, 0.6])
+    store.checkpoint(gallery)
+    store.close()
+    reopened, loaded = open_store(gallery_path)
+    assert reopened.generation == 1 and reopened.journal_records == 0
+    assert loaded.is_shared
+    # Rows come back grouped by department, each with its metadata and quality
+    assert loaded.departments.tolist() == ['Chemistry', 'Physics', 'Physics', 'Physics']
+    originals = {(i, round(float(q), 3)): v for i, q, v in zip(['a', 'b', 'c', 'a'], [0.9, 0.8, 0.7, 0.6], vectors)}
+    for row in range(len(loaded)):
+        expected = originals[(loaded.ids[row], round(float(loaded.qualities[row]), 3))]
+        np.testing.assert_array_equal(loaded.encodings[row], expected)
+    assert loaded.record(loaded.rows_for('b')[0]) == {'id': 'b', 'name': 'B', 'department': 'Chemistry'}
+
+
+def test_partial_load_maps_only_kept_departments(gallery_path):
+    store, gallery = open_store(gallery_path)
+    gallery.extend(unit_vectors(3), ['a', 'b', 'c'], ['A', 'B', 'C'], ['Physics', 'Chemistry', 'Physics'])
+    store.checkpoint(gallery)
+    store.append_add(unit_vectors(1, seed=1)[0], 'd', 'D', 'Chemistry')
+    store.close()
+    partial, loaded = open_store(gallery_path, keep=lambda department: department == 'Chemistry')
+    assert sorted(loaded.ids.tolist()) == ['b', 'd']
+    with pytest.raises(ValueError):
+        partial.checkpoint(loaded)
+
+
+def test_partial_load_of_separate_departments(gallery_path):
+    store, gallery = open_store(gallery_path)
+    vectors = unit_vectors(4)
+    gallery.extend(vectors, ['a', 'b', 'c', 'd'], ['A', 'B', 'C', 'D'], ['Physics', 'Chemistry', 'Biology', 'Physics'])
+    store.checkpoint(gallery)
+    store.close()
+    # Biology and Physics are not next to each other in the snapshot, so their rows are copied out
+    _, loaded = open_store(gallery_path, keep=lambda department: department != 'Chemistry')
+    assert loaded.ids.tolist() == ['c', 'a', 'd'] and not loaded.is_shared
+    np.testing.assert_array_equal(loaded.encodings, vectors[[2, 0, 3]])
+    # One department is a single run and stays a view of the mapped file
+    _, loaded = open_store(gallery_path, keep=lambda department: department == 'Physics')
+    assert loaded.ids.tolist() == ['a', 'd'] and loaded.is_shared
+
+
+def test_partial_load_of_a_snapshot_without_department_ranges(gallery_path):
+    store, gallery = open_store(gallery_path)
+    gallery.extend(unit_vectors(3), ['a', 'b', 'c'], ['A', 'B', 'C'], ['Physics', 'Chemistry', 'Physics'])
+    store.checkpoint(gallery)
+    store.close()
+    meta_path = store._file('meta', store.generation, 'json')
+    with open(meta_path) as f:
+        meta = json.load(f)
+    del meta['department_ranges']
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    _, loaded = open_store(gallery_path, keep=lambda department: department == 'Physics')
+    assert sorted(loaded.ids.tolist()) == ['a', 'c']
+
+
+def test_checkpoint_keeps_the_previous_generation(gallery_path):
+    store, gallery = open_store(gallery_path)
+    for generation in range(1, 4):
+        gallery.add(unit_vectors(1, seed=generation)[0], f'u{generation}', 'U', 'Physics')
+        store.checkpoint(gallery)
+    store.close()
+    assert store.generation == 3
+    names = sorted(name for name in os.listdir(gallery_path) if name != 'CURRENT')
+    # A reader that read CURRENT just before the last switch can still open generation 2
+    assert names == ['journal-000002.log', 'journal-000003.log', 'matrix-000002.npy', 'matrix-000003.npy',
+                     'meta-000002.json', 'meta-000003.json']
+    _, loaded = open_store(gallery_path)
+    assert sorted(loaded.ids.tolist()) == ['u1', 'u2', 'u3']
+
+
+def test_load_rereads_current_after_a_concurrent_checkpoint(gallery_path, monkeypatch):
+    store, gallery = open_store(gallery_path)
+    gallery.add(unit_vectors(1)[0], 'a', 'A', 'Physics')
+    store.checkpoint(gallery)
+    store.checkpoint(gallery)
+    store.close()
+    reader = GalleryStore(gallery_path, fsync=False)
+    # The first read sees generation 0, whose files two checkpoints have since removed
+    generations = [0]
+    read_current = reader._read_current
+    monkeypatch.setattr(reader, '_read_current', lambda: generations.pop() if generations else read_current())
+    loaded = Gallery()
+    reader.load(loaded)
+    assert reader.generation == 2 and loaded.ids.tolist() == ['a']
@@ -0,0 +1,143 @@
+import sys
+import time
+import types
+import cv2
+import numpy as np
+import pytest
+from utils.liveness import LIVE, PENDING, SPOOF, LivenessChecker, eye_aspect_ratio, is_live, live_key, texture_score
+from utils.tracking import Track
+
+BOX = (50, 150, 150, 50)
+OPEN = [(0, 0), (3, -4), (7, -4), (10, 0), (7, 4), (3, 4)]
+CLOSED = [(0, 0), (3, -1), (7, -1), (10, 0), (7, 1), (3, 1)]
+ADA = {'id': 'u1', 'name': 'Ada', 'department': 'Physics'}
+BEN = {'id': 'u2', 'name': 'Ben', 'department': 'Physics'}
+
+
+def skin(seed=0):
+    rng = np.random.default_rng(seed)
+    noise = rng.normal(128, 40, (240, 320, 3)).astype(np.float32)
+    return cv2.GaussianBlur(noise, (0, 0), 3).clip(0, 255).astype(np.uint8)
+
+
+def screen(seed=0):
+    # Fine periodic pattern, like a halftone print or a display's pixel grid
+    y, x = np.mgrid[:240, :320]
+    return np.clip(skin(seed) + (10 * np.sin(x * 2.4 + y * 0.3))[..., None], 0, 255).astype(np.uint8)
+
+
+@pytest.fixture
+def eyes(monkeypatch):
+    """Landmarks with the eyes open, or closed while eyes['closed'] is set."""
+    state = {'closed': False, 'calls': 0, 'delay': 0.0}
+
+    def face_landmarks(rgb, boxes):
+        state['calls'] += 1
+        time.sleep(state['delay'])
+        eye = CLOSED if state['closed'] else OPEN
+        return [{'left_eye': eye, 'right_eye': eye} for _ in boxes]
+    monkeypatch.setitem(sys.modules, 'face_recognition', types.SimpleNamespace(face_landmarks=face_landmarks))
+    return state
+
+
+def track(track_id=0, user=ADA, box=BOX):
+    t = Track(track_id, box)
+    t.user = user
+    return t
+
+
+def blink(checker, frame, tracks, eyes):
+    for closed in (False, True, False):
+        eyes['closed'] = closed
+        statuses = checker.update(frame, tracks)
+    return statuses
+
+
+def test_eye_aspect_ratio():
+    assert eye_aspect_ratio(OPEN) == pytest.approx(0.8)
+    assert eye_aspect_ratio(CLOSED) == pytest.approx(0.2)
+    assert eye_aspect_ratio([(0, 0)] * 6) == 0.0
+
+
+def test_texture_score_separates_skin_from_screens():
+    assert texture_score(skin(), BOX) < 10 < texture_score(screen(), BOX)
+    assert is_live(skin(), [BOX]) == [True]
+    assert is_live(screen(), [BOX]) == [False]
+    # Faces smaller than the patch are scaled up; empty crops score 0
+    assert texture_score(skin(), (50, 90, 90, 50)) < 10
+    assert texture_score(skin(), (300, 10, 310, 0)) == 0.0
+
+
+def test_open_closed_open_is_live(eyes):
+    checker = LivenessChecker(budget_ms=100)
+    t = track()
+    assert checker.update(skin(), [t]) == {(0, 'u1'): PENDING}
+    assert blink(checker, skin(), [t], eyes) == {live_key(t): LIVE}
+    assert checker.details(t)['blinks'] == 1
+
+
+def test_no_blink_stays_pending(eyes):
+    checker = LivenessChecker(budget_ms=100)
+    t = track()
+    for _ in range(20):
+        statuses = checker.update(skin(), [t])
+    assert statuses[live_key(t)] == PENDING
+
+
+def test_screen_texture_is_a_spoof_even_with_a_blink(eyes):
+    checker = LivenessChecker(budget_ms=100, texture_every=1, texture_samples=3)
+    t = track()
+    statuses = blink(checker, screen(), [t], eyes)
+    assert statuses[live_key(t)] == SPOOF
+    # Decided spoofs are not sampled again
+    calls = eyes['calls']
+    checker.update(screen(), [t])
+    assert eyes['calls'] == calls
+
+
+def test_live_tracks_keep_texture_checks(eyes):
+    checker = LivenessChecker(budget_ms=100, texture_every=2, texture_samples=3)
+    t = track()
+    assert blink(checker, skin(), [t], eyes)[live_key(t)] == LIVE
+    calls = eyes['calls']
+    statuses = [checker.update(screen(), [t])[live_key(t)] for _ in range(8)]
+    assert statuses[-1] == SPOOF
+    # Rechecks score texture only, without landmarks
+    assert eyes['calls'] == calls
+
+
+def test_budget_limits_samples_per_update(eyes):
+    eyes['delay'] = 0.003
+    checker = LivenessChecker(budget_ms=4.0)
+    tracks = [track(i, box=(50, 60 + 30 * i, 80, 30 + 30 * i)) for i in range(8)]
+    sampled = []
+    for _ in range(8):
+        checker.update(skin(), tracks)
+        sampled.append(checker.last_checked)
+    # At least one track per update, never all of them, and everyone gets a turn
+    assert all(1 <= count < len(tracks) for count in sampled)
+    assert all(checker.details(t)['samples'] > 0 for t in tracks)
+
+
+def test_reidentified_track_must_blink_again(eyes):
+    checker = LivenessChecker(budget_ms=100)
+    t = track()
+    statuses = blink(checker, skin(), [t], eyes)
+    assert statuses[live_key(t)] == LIVE
+    # The tracker re-identifies the same track as someone else (a photo held up in the box)
+    t.user = BEN
+    assert statuses.get(live_key(t), PENDING) == PENDING
+    assert checker.update(skin(), [t])[live_key(t)] == PENDING
+    assert checker.status(t) == PENDING
+    # Going back to the person who blinked keeps their result
+    t.user = ADA
+    assert checker.update(skin(), [t])[live_key(t)] == LIVE
+
+
+def test_state_of_unseen_tracks_is_forgotten(eyes):
+    checker = LivenessChecker(budget_ms=100, forget_after=2)
+    gone, stays = track(0), track(1, box=(50, 300, 150, 200))
+    checker.update(skin(), [gone, stays])
+    for _ in range(3):
+        checker.update(skin(), [stays])
+    assert checker.details(gone) is None and checker.details(stays) is not None
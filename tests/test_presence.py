@@ -0,0 +1,56 @@
+from datetime import date, datetime, timedelta
+import utils.presence
+from utils.presence import PresenceIndex
+
+
+class Today:
+    """Stand-in for datetime.date whose today() the test moves forward."""
+    current = date(2026, 3, 2)
+
+    @classmethod
+    def today(cls):
+        return cls.current
+
+
+def test_due_drops_repeats_and_starts_the_cooldown():
+    presence = PresenceIndex(cooldown=30)
+    assert presence.due(['a', 'b', 'a'], now=100.0) == ['a', 'b']
+    assert presence.due(['a', 'b'], now=129.0) == []
+    assert presence.due(['a', 'c'], now=130.0) == ['a', 'c']
+
+
+def test_present_users_are_never_due():
+    presence = PresenceIndex(cooldown=30)
+    presence.mark_present(['a'])
+    assert presence.due(['a', 'b'], now=1000.0) == ['b']
+    assert presence.is_present('a') and not presence.is_present('b')
+    assert presence.present() == frozenset({'a'}) and len(presence) == 1
+
+
+def test_seeded_from_todays_attendance(db):
+    yesterday = datetime.now() - timedelta(days=1)
+    db.mark_attendance_many([('a', 'A', 'Physics', 90.0, 'Camera'),
+                             ('b', 'B', 'Physics', 90.0, 'Camera', yesterday)])
+    presence = PresenceIndex(db)
+    assert presence.present() == frozenset({'a'})
+    assert presence.due(['a', 'b']) == ['b']
+
+
+def test_day_change_reloads_and_forgets_cooldowns(monkeypatch):
+    monkeypatch.setattr(utils.presence, 'date', Today)
+
+    class Attendance:
+        rows = []
+
+        def get_attendance_today(self):
+            return self.rows
+
+    db = Attendance()
+    presence = PresenceIndex(db, cooldown=3600)
+    presence.mark_present(['a'])
+    assert presence.due(['b'], now=0.0) == ['b']
+    db.rows = [(1, 'c')]
+    monkeypatch.setattr(Today, 'current', Today.current + timedelta(days=1))
+    # Yesterday's presence and cooldowns are gone; today's marks come from the database
+    assert presence.due(['a', 'b', 'c'], now=1.0) == ['a', 'b']
+    assert presence.present() == frozenset({'c'})
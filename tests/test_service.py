@@ -0,0 +1,45 @@
+import asyncio
+from face_utils import FaceUtils
+from service import AttendanceService
+from utils.ann_index import IVFIndex
+from utils.detection import DetectionPolicy
+from conftest import unit_vectors
+
+
+def test_reload_keeps_index_and_settings(db, gallery_path):
+    policy = DetectionPolicy(min_face=80)
+    face_utils = FaceUtils(gallery_path, index='ivf', legacy_path=None, detection=policy, max_templates=3,
+                           template_reduce='weighted', fallback=False, nprobe=4)
+    face_utils.add_encodings(unit_vectors(4), ['u1'] * 4, ['Ada'] * 4, ['Physics'] * 4)
+    service = AttendanceService(face_utils, db, workers=1, executor='thread')
+    try:
+        face_utils.add_encodings(unit_vectors(2, seed=1), ['u2'] * 2, ['Ben'] * 2, ['Physics'] * 2)
+        count = asyncio.run(service.reload_gallery())
+    finally:
+        service.close()
+    reloaded = service.face_utils
+    assert reloaded is not face_utils
+    # u1's four templates were capped at three
+    assert count == 5
+    assert isinstance(reloaded.index, IVFIndex)
+    assert reloaded.index.nprobe == 4
+    assert (reloaded.max_templates, reloaded.template_reduce, reloaded.fallback) == (3, 'weighted', False)
+    assert reloaded.detection is policy
+
+
+def test_spoofed_faces_are_recognized_but_not_marked(db, gallery_path):
+    face_utils = FaceUtils(gallery_path, legacy_path=None)
+    vectors = unit_vectors(2)
+    face_utils.add_encodings(vectors, ['u1', 'u2'], ['Ada', 'Ben'], ['Physics'] * 2)
+    service = AttendanceService(face_utils, db, workers=1, executor='thread')
+    try:
+        # As encode_jpeg returns it: the second face failed the texture check
+        encoded = [{'boxes': [[0, 10, 10, 0], [0, 30, 10, 20]], 'encodings': vectors, 'live': [True, False],
+                    'size': [40, 10]}]
+        [result] = service._match_and_mark(encoded, threshold=70, source='Service', mark=True)
+    finally:
+        service.close()
+    ada, ben = result['faces']
+    assert (ada['user']['id'], ada['live'], ada['marked']) == ('u1', True, True)
+    assert (ben['user']['id'], ben['live'], ben['marked']) == ('u2', False, False)
+    assert [row[1] for row in db.get_attendance_page(limit=10)] == ['u1']
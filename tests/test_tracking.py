@@ -0,0 +1,116 @@
+import numpy as np
+from utils.tracking import FaceTracker, box_jumped, iou_matrix
+
+FRAME = np.zeros((480, 640, 3), dtype=np.uint8)
+BOX = (100, 200, 200, 100)
+ADA = {'id': 'u1', 'name': 'Ada', 'department': 'Physics'}
+
+
+def detector(*frames):
+    """detect_fn returning the given boxes on successive calls, counting the calls."""
+    calls = []
+
+    def detect(frame):
+        calls.append(frame)
+        return frames[min(len(calls), len(frames)) - 1]
+    return detect, calls
+
+
+def identify(tracker, detect, user=ADA):
+    tracks, pending = tracker.step(FRAME, detect)
+    tracker.assign(pending, [(user, 95.0)] * len(pending))
+    return tracks, pending
+
+
+def test_iou_matrix():
+    overlaps = iou_matrix([BOX], [BOX, (100, 250, 200, 150), (300, 400, 400, 300)])
+    np.testing.assert_allclose(overlaps, [[1.0, 1 / 3, 0.0]])
+    assert iou_matrix([], [BOX]).shape == (0, 1)
+
+
+def test_detects_every_n_frames_and_keeps_track_ids():
+    tracker = FaceTracker(detect_every=3)
+    detect, calls = detector([BOX])
+    ids = set()
+    for _ in range(7):
+        tracks, _ = tracker.step(FRAME, detect)
+        ids.update(t.id for t in tracks)
+    # Frames 0, 3 and 6
+    assert len(calls) == tracker.detections == 3
+    assert ids == {0}
+
+
+def test_only_new_tracks_are_encoded_until_reidentification():
+    tracker = FaceTracker(detect_every=1, reidentify_every=4)
+    detect, _ = detector([BOX])
+    tracks, pending = identify(tracker, detect)
+    assert pending == tracks and tracks[0].label == 'Ada'
+    waits = [len(tracker.step(FRAME, detect)[1]) for _ in range(4)]
+    assert waits == [0, 0, 0, 1]
+
+
+def test_unknown_tracks_are_retried_sooner():
+    tracker = FaceTracker(detect_every=1, reidentify_every=100, retry_unknown_every=2)
+    detect, _ = detector([BOX])
+    identify(tracker, detect, user=None)
+    assert [len(tracker.step(FRAME, detect)[1]) for _ in range(2)] == [0, 1]
+
+
+def test_missed_tracks_expire():
+    tracker = FaceTracker(detect_every=1, max_missed=2)
+    detect, _ = detector([BOX], [], [], [])
+    tracker.step(FRAME, detect)
+    visible = [tracker.step(FRAME, detect)[0] for _ in range(2)]
+    assert visible == [[], []] and len(tracker.tracks) == 1
+    tracker.step(FRAME, detect)
+    assert tracker.tracks == []
+
+
+def test_small_moves_keep_the_identity():
+    tracker = FaceTracker(detect_every=1)
+    detect, _ = detector([BOX], [(105, 208, 205, 108)])
+    identify(tracker, detect)
+    [track], pending = tracker.step(FRAME, detect)
+    assert pending == [] and track.user is ADA and track.box == (105, 208, 205, 108)
+
+
+def test_someone_stepping_into_the_box_is_encoded_again():
+    # A closer face over the departing one still overlaps it by IoU >= 0.3
+    closer = (90, 220, 225, 85)
+    assert iou_matrix([BOX], [closer])[0, 0] >= 0.3 and box_jumped(BOX, closer, 0.25, 1.3)
+    tracker = FaceTracker(detect_every=1, reidentify_every=150)
+    detect, _ = detector([BOX], [closer])
+    [first], _ = identify(tracker, detect)
+    [track], pending = tracker.step(FRAME, detect)
+    assert track is first
+    assert pending == [track] and track.user is None and track.label == 'Unknown'
+
+
+def test_track_matched_again_after_a_miss_is_encoded_again():
+    tracker = FaceTracker(detect_every=1, reidentify_every=150)
+    detect, _ = detector([BOX], [], [BOX])
+    identify(tracker, detect)
+    tracker.step(FRAME, detect)
+    [track], pending = tracker.step(FRAME, detect)
+    assert pending == [track] and track.user is None
+
+
+def test_assign_caches_identity_per_track():
+    tracker = FaceTracker(detect_every=1)
+    other = {'id': 'u2', 'name': 'Ben', 'department': 'Physics'}
+    detect, _ = detector([BOX, (100, 500, 200, 400)])
+    tracks, pending = tracker.step(FRAME, detect)
+    tracker.assign(pending, [(ADA, 91.0), (None, 40.0)])
+    assert [t.label for t in tracks] == ['Ada', 'Unknown']
+    tracker.assign(pending[1:], [(other, 88.0)])
+    assert [(t.label, t.confidence) for t in tracks] == [('Ada', 91.0), ('Ben', 88.0)]
+
+
+def test_reset_forces_detection():
+    tracker = FaceTracker(detect_every=10)
+    detect, calls = detector([BOX])
+    tracker.step(FRAME, detect)
+    tracker.step(FRAME, detect)
+    tracker.reset()
+    tracks, _ = tracker.step(FRAME, detect)
+    assert len(calls) == 2 and tracker.tracks == tracks
@@ -0,0 +1,215 @@
+"""
+analytics.py
+Range-bounded attendance analytics for the Analytics page.
+
+Every view is one aggregate query over [date_from, date_to] (the rollup tables,
+or a GROUP BY on attendance) followed by NumPy over the compact columns it
+returns, so a semester comes back from SQLite as a few thousand rows however
+many people were marked. Views are materialized per range and parameters in
+their own QueryCache and recomputed only after the database changes. Returned
+frames are shared between callers and must not be mutated.
+"""
+from datetime import date, datetime, time
+import numpy as np
+import pandas as pd
+from utils.query_cache import QueryCache, cached_query
+from utils import metrics
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+PERIODS = {'day': 'D', 'week': 'W-MON', 'month': 'MS'}
+# Arrival histograms are queried at this resolution; the hourly heatmap sums it up
+ARRIVAL_BIN_MINUTES = 5
+
+VIEW_SECONDS = metrics.histogram('attendance_analytics_seconds', 'Analytics view computed on a cache miss')
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value))
+
+
+def _as_seconds(value):
+    # 'HH:MM', 'HH:MM:SS' or a datetime.time to seconds since midnight
+    if isinstance(value, time):
+        return value.hour * 3600 + value.minute * 60 + value.second
+    parts = [int(p) for p in str(value).split(':')]
+    return parts[0] * 3600 + parts[1] * 60 + (parts[2] if len(parts) > 2 else 0)
+
+
+def _days(date_from, date_to):
+    start, end = _as_date(date_from), _as_date(date_to)
+    return np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1)
+
+
+def _offsets(dates, days):
+    # Position of each 'YYYY-MM-DD' string in the day range
+    return (np.asarray(dates, dtype='datetime64[D]') - days[0]).astype(np.int64)
+
+
+def _weekday(days):
+    # 1970-01-01 was a Thursday; Monday is 0
+    return (days.astype(np.int64) + 3) % 7
+
+
+def _clock(seconds):
+    seconds = np.asarray(seconds, dtype=np.int64)
+    return pd.Series([f'{s // 3600:02d}:{s // 60 % 60:02d}' for s in seconds.tolist()], dtype=object)
+
+
+class AttendanceAnalytics:
+    def __init__(self, db, cache_size=64):
+        self.db = db
+        self.cache = QueryCache(cache_size)
+
+    def data_version(self):
+        return self.db.data_version()
+
+    @cached_query
+    def headcount(self, department=None):
+        """Registered users, of one department or everyone (today's count; history is not kept)."""
+        counts = dict(self.db.count_users_by_department())
+        return counts.get(department, 0) if department else sum(counts.values())
+
+    @cached_query
+    @metrics.timed(VIEW_SECONDS)
+    def daily(self, date_from, date_to, department=None):
+        """Every day of the range with Present (0 on days nobody came) and Rate % of the headcount."""
+        days = _days(date_from, date_to)
+        present = np.zeros(len(days), dtype=np.int64)
+        rows = self.db.get_daily_presence(str(_as_date(date_from)), str(_as_date(date_to)), department)
+        if rows:
+            dates, counts = zip(*rows)
+            present[_offsets(dates, days)] = counts
+        enrolled = self.headcount(department)
+        rate = present * (100.0 / enrolled) if enrolled else np.zeros(len(days))
+        return pd.DataFrame({'Present': present, 'Rate %': rate}, index=pd.DatetimeIndex(days, name='Date'))
+
+    def open_days(self, date_from, date_to):
+        """Days of the range on which anyone was marked present (weekends and holidays drop out)."""
+        return int((self.daily(date_from, date_to)['Present'].to_numpy() > 0).sum())
+
+    @cached_query
+    @metrics.timed(VIEW_SECONDS)
+    def department_trend(self, date_from, date_to, period='week'):
+        """
+        Long frame of Period, Department, Present (mean per open day of the period)
+        and Rate % of the department's headcount.
+        """
+        days = _days(date_from, date_to)
+        rows = self.db.get_department_presence(str(_as_date(date_from)), str(_as_date(date_to)))
+        if not rows:
+            return pd.DataFrame(columns=['Period', 'Department', 'Present', 'Rate %'])
+        dates, departments, counts = zip(*rows)
+        names, columns = np.unique(np.asarray(departments, dtype=object), return_inverse=True)
+        matrix = np.zeros((len(days), len(names)))
+        matrix[_offsets(dates, days), columns] = counts
+        # Days nobody came are left out of the means instead of counting as zero
+        matrix[matrix.sum(axis=1) == 0] = np.nan
+        frame = pd.DataFrame(matrix, index=pd.DatetimeIndex(days, name='Period'), columns=list(names))
+        if period != 'day':
+            frame = frame.resample(PERIODS[period], label='left', closed='left').mean()
+        enrolled = self.db.count_users_by_department()
+        headcount = np.array([dict(enrolled).get(name, 0) for name in names], dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate = np.where(headcount > 0, frame.to_numpy() * 100.0 / headcount, np.nan)
+        return pd.DataFrame({
+            'Period': np.repeat(frame.index.to_numpy(), len(names)),
+            'Department': np.tile(names, len(frame)),
+            'Present': frame.to_numpy().ravel(),
+            'Rate %': rate.ravel(),
+        }).dropna(subset=['Present'])
+
+    @cached_query
+    @metrics.timed(VIEW_SECONDS)
+    def calendar(self, date_from, date_to, department=None, period='week'):
+        """
+        Present count laid out for a heatmap: weekday x week (period='week') or day of
+        month x month (period='month'). Cells outside the range are NaN.
+        """
+        days = _days(date_from, date_to)
+        present = self.daily(date_from, date_to, department)['Present'].to_numpy()
+        if period == 'week':
+            weekday = _weekday(days)
+            mondays = days - weekday
+            columns = ((mondays - mondays[0]) // 7).astype(np.int64)
+            matrix = np.full((7, columns[-1] + 1), np.nan)
+            matrix[weekday, columns] = present
+            labels = [str(mondays[0] + 7 * i) for i in range(matrix.shape[1])]
+            return pd.DataFrame(matrix, index=list(WEEKDAYS), columns=labels)
+        months = days.astype('datetime64[M]')
+        day_of_month = (days - months.astype('datetime64[D]')).astype(np.int64)
+        columns = (months - months[0]).astype(np.int64)
+        matrix = np.full((31, columns[-1] + 1), np.nan)
+        matrix[day_of_month, columns] = present
+        labels = [str(months[0] + i) for i in range(matrix.shape[1])]
+        return pd.DataFrame(matrix, index=list(range(1, 32)), columns=labels)
+
+    @cached_query
+    @metrics.timed(VIEW_SECONDS)
+    def arrival_heatmap(self, date_from, date_to, department=None):
+        """First arrivals per weekday x hour of day, over the hours anyone arrived."""
+        days = _days(date_from, date_to)
+        # Same query as the default arrival_distribution, so the two share one result
+        bin_seconds = ARRIVAL_BIN_MINUTES * 60
+        rows = self.db.get_arrival_counts(str(_as_date(date_from)), str(_as_date(date_to)), bin_seconds, department)
+        matrix = np.zeros((7, 24), dtype=np.int64)
+        if not rows:
+            return pd.DataFrame(matrix[:, :0], index=list(WEEKDAYS))
+        dates, bins, counts = (np.asarray(column) for column in zip(*rows))
+        hours = bins.astype(np.int64) * bin_seconds // 3600
+        np.add.at(matrix, (_weekday(days[_offsets(dates, days)]), hours), counts)
+        first, last = int(hours.min()), int(hours.max())
+        return pd.DataFrame(matrix[:, first:last + 1], index=list(WEEKDAYS),
+                            columns=[f'{h:02d}:00' for h in range(first, last + 1)])
+
+    @cached_query
+    @metrics.timed(VIEW_SECONDS)
+    def arrival_distribution(self, date_from, date_to, department=None, bin_minutes=ARRIVAL_BIN_MINUTES):
+        """First arrivals per bin_minutes of the day (Time is the bin start) with Cumulative %."""
+        bin_seconds = int(bin_minutes * 60)
+        rows = self.db.get_arrival_counts(str(_as_date(date_from)), str(_as_date(date_to)), bin_seconds,
+                                          department)
+        if not rows:
+            return pd.DataFrame(columns=['Time', 'Arrivals', 'Cumulative %'])
+        _, bins, counts = (np.asarray(column) for column in zip(*rows))
+        bins = bins.astype(np.int64)
+        histogram = np.bincount(bins - bins.min(), weights=counts).astype(np.int64)
+        starts = (np.arange(len(histogram)) + bins.min()) * bin_seconds
+        return pd.DataFrame({'Time': _clock(starts), 'Arrivals': histogram,
+                             'Cumulative %': np.cumsum(histogram) * 100.0 / histogram.sum()})
+
+    @cached_query
+    @metrics.timed(VIEW_SECONDS)
+    def punctuality(self, date_from, date_to, start='09:00', grace_minutes=5, department=None):
+        """
+        One row per person present in the range: days present, attendance % of the open
+        days, on-time % (first arrival no later than start + grace), mean arrival and its
+        spread, average minutes late on late days, earliest and latest arrival.
+        """
+        late_after = _as_seconds(start) + int(grace_minutes * 60)
+        rows = self.db.get_arrival_stats(str(_as_date(date_from)), str(_as_date(date_to)), late_after, department)
+        columns = ['User ID', 'Name', 'Department', 'Days', 'Attendance %', 'On time %', 'Mean arrival',
+                   'Spread (min)', 'Late by (min)', 'Earliest', 'Latest']
+        if not rows:
+            return pd.DataFrame(columns=columns)
+        user_ids, days, late, total, squares, earliest, latest, late_seconds = zip(*rows)
+        users = {row[0]: row for row in self.db.get_all_users()}
+        days = np.asarray(days, dtype=np.float64)
+        late = np.asarray(late, dtype=np.float64)
+        mean = np.asarray(total, dtype=np.float64) / days
+        spread = np.sqrt(np.maximum(np.asarray(squares, dtype=np.float64) / days - mean * mean, 0.0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            late_by = np.where(late > 0, np.asarray(late_seconds, dtype=np.float64) / late / 60.0, 0.0)
+        open_days = max(self.open_days(date_from, date_to), 1)
+        frame = pd.DataFrame({
+            'User ID': user_ids, 'Name': [users[i][1] if i in users else '' for i in user_ids],
+            'Department': [users[i][2] if i in users else '' for i in user_ids], 'Days': days.astype(np.int64),
+            'Attendance %': np.minimum(days * 100.0 / open_days, 100.0).round(1),
+            'On time %': ((days - late) * 100.0 / days).round(1),
+            'Mean arrival': _clock(mean.round()), 'Spread (min)': (spread / 60.0).round(1),
+            'Late by (min)': late_by.round(1), 'Earliest': _clock(earliest), 'Latest': _clock(latest),
+        }, columns=columns)
+        return frame.sort_values(['On time %', 'Days'], ascending=False, ignore_index=True)
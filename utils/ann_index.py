@@ -0,0 +1,315 @@
+"""
+ann_index.py
+Nearest-neighbour indexes over a Gallery: exact brute force, IVF and IVF-PQ.
+"""
+import numpy as np
+
+
+def top_k(dists, k):
+    """Sorted (distances, columns) of the k smallest entries in each row of dists."""
+    count, n = dists.shape
+    k = min(k, n)
+    if k < n:
+        cols = np.argpartition(dists, k - 1, axis=1)[:, :k]
+    else:
+        cols = np.broadcast_to(np.arange(n), (count, n))
+    picked = np.take_along_axis(dists, cols, axis=1)
+    order = np.argsort(picked, axis=1)
+    return np.take_along_axis(picked, order, axis=1), np.take_along_axis(cols, order, axis=1)
+
+
+def _sq_dists(data, centroids, centroid_sq):
+    d2 = data @ centroids.T
+    d2 *= -2.0
+    d2 += centroid_sq
+    d2 += np.einsum('ij,ij->i', data, data)[:, None]
+    return d2
+
+
+def assign_nearest(data, centroids, chunk=8192):
+    centroid_sq = np.einsum('ij,ij->i', centroids, centroids)
+    labels = np.empty(len(data), dtype=np.int32)
+    for start in range(0, len(data), chunk):
+        block = data[start:start + chunk]
+        labels[start:start + chunk] = np.argmin(_sq_dists(block, centroids, centroid_sq), axis=1)
+    return labels
+
+
+def kmeans(data, k, iters=10, seed=0):
+    """Plain Lloyd's k-means; empty clusters are re-seeded from random points."""
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    k = min(k, len(data))
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iters):
+        labels = assign_nearest(data, centroids)
+        counts = np.bincount(labels, minlength=k)
+        order = np.argsort(labels, kind='stable')
+        present = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[present]
+        centroids[present] = np.add.reduceat(data[order], starts, axis=0) / counts[present, None]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+    return centroids
+
+
+class BruteForceIndex:
+    """Exact linear scan; the reference every other index is measured against."""
+
+    def __init__(self, gallery):
+        self.gallery = gallery
+
+    def rebuild(self):
+        pass
+
+    def add(self, rows):
+        pass
+
+    def remove(self, row, moved):
+        pass
+
+    def search(self, encodings, k=1):
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, self.gallery.dim)
+        if not len(self.gallery):
+            return (np.full((len(queries), 0), np.inf, dtype=np.float32),
+                    np.full((len(queries), 0), -1, dtype=np.int64))
+        return top_k(self.gallery.distance_matrix(queries), k)
+
+
+class IVFIndex(BruteForceIndex):
+    """
+    Inverted-file index: a k-means coarse quantizer splits the gallery into
+    nlist cells and a query only scans the nprobe nearest cells.
+    Raising nprobe trades latency for recall; nprobe == nlist is exact.
+    Until the gallery reaches min_train_size it falls back to brute force.
+    """
+
+    def __init__(self, gallery, nlist=None, nprobe=8, min_train_size=2048,
+                 retrain_growth=2.0, kmeans_iters=10, seed=0):
+        super().__init__(gallery)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.retrain_growth = retrain_growth
+        self.kmeans_iters = kmeans_iters
+        self.seed = seed
+        self.centroids = None
+        self.trained_size = 0
+        self._assign = np.empty(0, dtype=np.int32)
+        self._lists = []
+        self._list_arrays = []
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def _target_nlist(self, size):
+        if self.nlist:
+            return self.nlist
+        return max(1, int(4 * np.sqrt(size)))
+
+    def _ensure_assign_capacity(self, size):
+        if size > len(self._assign):
+            assign = np.empty(max(size, 2 * len(self._assign), 16), dtype=np.int32)
+            assign[:len(self._assign)] = self._assign
+            self._assign = assign
+
+    def rebuild(self):
+        size = len(self.gallery)
+        if size < self.min_train_size:
+            self.centroids = None
+            self.trained_size = 0
+            self._lists, self._list_arrays = [], []
+            return
+        data = self.gallery.encodings
+        nlist = min(self._target_nlist(size), size)
+        rng = np.random.default_rng(self.seed)
+        sample = data if size <= 256 * nlist else data[np.sort(rng.choice(size, 256 * nlist, replace=False))]
+        self.centroids = kmeans(sample, nlist, iters=self.kmeans_iters, seed=self.seed)
+        self.trained_size = size
+        self._ensure_assign_capacity(size)
+        self._assign[:size] = assign_nearest(data, self.centroids)
+        self._reindex(size)
+
+    def _reindex(self, size):
+        nlist = len(self.centroids)
+        labels = self._assign[:size]
+        order = np.argsort(labels, kind='stable')
+        bounds = np.searchsorted(labels[order], np.arange(nlist + 1))
+        self._lists = [order[bounds[c]:bounds[c + 1]].tolist() for c in range(nlist)]
+        self._list_arrays = [None] * nlist
+
+    def add(self, rows):
+        size = len(self.gallery)
+        if not self.is_trained:
+            if size >= self.min_train_size:
+                self.rebuild()
+            return
+        if size >= self.trained_size * self.retrain_growth:
+            self.rebuild()
+            return
+        rows = np.asarray(list(rows), dtype=np.int64)
+        self._ensure_assign_capacity(size)
+        labels = assign_nearest(self.gallery.encodings[rows], self.centroids)
+        self._assign[rows] = labels
+        for row, label in zip(rows.tolist(), labels.tolist()):
+            self._lists[label].append(row)
+            self._list_arrays[label] = None
+
+    def remove(self, row, moved):
+        if not self.is_trained:
+            return
+        label = int(self._assign[row])
+        self._lists[label].remove(row)
+        self._list_arrays[label] = None
+        if moved is not None:
+            moved_label = int(self._assign[moved])
+            members = self._lists[moved_label]
+            members[members.index(moved)] = row
+            self._list_arrays[moved_label] = None
+            self._assign[row] = moved_label
+
+    def _cell(self, label):
+        cell = self._list_arrays[label]
+        if cell is None:
+            cell = self._list_arrays[label] = np.asarray(self._lists[label], dtype=np.int64)
+        return cell
+
+    def _probe(self, queries):
+        nprobe = min(self.nprobe, len(self.centroids))
+        centroid_sq = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        return top_k(_sq_dists(queries, self.centroids, centroid_sq), nprobe)[1]
+
+    def _candidates(self, probes):
+        return np.concatenate([self._cell(label) for label in probes.tolist()])
+
+    def _score(self, query, rows):
+        vecs = self.gallery.encodings[rows]
+        d2 = vecs @ query
+        d2 *= -2.0
+        d2 += self.gallery.sq_norms[rows]
+        d2 += np.dot(query, query)
+        np.maximum(d2, 0.0, out=d2)
+        return np.sqrt(d2, out=d2)
+
+    def search(self, encodings, k=1):
+        if not self.is_trained:
+            return super().search(encodings, k)
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, self.gallery.dim)
+        out_dists = np.full((len(queries), k), np.inf, dtype=np.float32)
+        out_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        for i, (query, probes) in enumerate(zip(queries, self._probe(queries))):
+            rows = self._candidates(probes)
+            if not len(rows):
+                continue
+            dists, cols = top_k(self._score(query, rows)[None, :], k)
+            found = dists.shape[1]
+            out_dists[i, :found] = dists[0]
+            out_rows[i, :found] = rows[cols[0]]
+        return out_dists, out_rows
+
+
+class IVFPQIndex(IVFIndex):
+    """
+    IVF with product-quantized codes: each vector is also stored as m one-byte
+    sub-codes (16 bytes instead of 512). Cells are scanned with asymmetric
+    distance tables, and only the best `rerank` candidates per query are
+    re-scored against the float32 matrix. rerank=0 never touches the matrix,
+    so a memory-mapped gallery can stay paged out.
+    """
+
+    def __init__(self, gallery, m=16, rerank=64, **params):
+        super().__init__(gallery, **params)
+        if gallery.dim % m:
+            raise ValueError('m must divide the encoding dimension')
+        self.m = m
+        self.rerank = rerank
+        self.codebooks = None
+        self._codes = np.empty((0, m), dtype=np.uint8)
+
+    def _split(self, data):
+        return np.asarray(data, dtype=np.float32).reshape(len(data), self.m, -1)
+
+    def _encode(self, data):
+        sub = self._split(data)
+        codes = np.empty((len(data), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = assign_nearest(np.ascontiguousarray(sub[:, j]), self.codebooks[j])
+        return codes
+
+    def _ensure_assign_capacity(self, size):
+        super()._ensure_assign_capacity(size)
+        if len(self._assign) > len(self._codes):
+            codes = np.empty((len(self._assign), self.m), dtype=np.uint8)
+            codes[:len(self._codes)] = self._codes
+            self._codes = codes
+
+    def rebuild(self):
+        super().rebuild()
+        if not self.is_trained:
+            self.codebooks = None
+            return
+        size = len(self.gallery)
+        rng = np.random.default_rng(self.seed)
+        data = self.gallery.encodings
+        sample = data if size <= 65536 else data[np.sort(rng.choice(size, 65536, replace=False))]
+        sub = self._split(sample)
+        self.codebooks = np.stack([
+            kmeans(np.ascontiguousarray(sub[:, j]), 256, iters=self.kmeans_iters, seed=self.seed + j)
+            for j in range(self.m)
+        ])
+        self._codes[:size] = self._encode(data)
+
+    def add(self, rows):
+        retrain = not self.is_trained or len(self.gallery) >= self.trained_size * self.retrain_growth
+        super().add(rows)
+        if self.is_trained and not retrain:
+            rows = np.asarray(list(rows), dtype=np.int64)
+            self._codes[rows] = self._encode(self.gallery.encodings[rows])
+
+    def remove(self, row, moved):
+        super().remove(row, moved)
+        if self.is_trained and moved is not None:
+            self._codes[row] = self._codes[moved]
+
+    def search(self, encodings, k=1):
+        if not self.is_trained:
+            return super().search(encodings, k)
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, self.gallery.dim)
+        out_dists = np.full((len(queries), k), np.inf, dtype=np.float32)
+        out_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        subspace = np.arange(self.m)
+        for i, (query, probes) in enumerate(zip(queries, self._probe(queries))):
+            rows = self._candidates(probes)
+            if not len(rows):
+                continue
+            # (m, 256) table of squared distances from each query slice to each sub-centroid
+            table = ((self.codebooks - self._split(query[None, :])[0][:, None, :]) ** 2).sum(axis=2)
+            approx = table[subspace, self._codes[rows]].sum(axis=1)
+            keep = max(k, self.rerank)
+            if keep < len(rows):
+                part = np.argpartition(approx, keep - 1)[:keep]
+                rows, approx = rows[part], approx[part]
+            if self.rerank:
+                scored = self._score(query, rows)
+            else:
+                scored = np.sqrt(np.maximum(approx, 0.0)).astype(np.float32)
+            dists, cols = top_k(scored[None, :], k)
+            found = dists.shape[1]
+            out_dists[i, :found] = dists[0]
+            out_rows[i, :found] = rows[cols[0]]
+        return out_dists, out_rows
+
+
+INDEX_TYPES = {
+    'exact': BruteForceIndex,
+    'ivf': IVFIndex,
+    'ivfpq': IVFPQIndex,
+}
+
+
+def make_index(kind, gallery, **params):
+    if kind not in INDEX_TYPES:
+        raise ValueError(f'Unknown index type: {kind}')
+    return INDEX_TYPES[kind](gallery, **params)
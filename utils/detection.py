@@ -0,0 +1,182 @@
+"""
+detection.py
+Detection policy: how large an image face_recognition's detector actually sees.
+
+dlib's detectors only find faces above a fixed size (about 80 px for HOG, 40 px
+for the CNN, halved per upsample), so running them at full resolution on a
+24-megapixel photo buys nothing but latency. The policy picks the smallest scale
+at which the expected minimum face is still detectable, optionally gates or
+crops with a cheap OpenCV detector first, and returns boxes in the coordinates
+of the image it was given so encodings are computed from full-resolution pixels.
+"""
+import os
+import threading
+import cv2
+import numpy as np
+from utils.tracking import iou_matrix
+
+# Smallest face (px) each dlib detector finds without upsampling
+DETECTOR_MIN_FACE = {'hog': 80, 'cnn': 40}
+PREFILTERS = (None, 'haar', 'dnn')
+
+HAAR_CASCADE = 'haarcascade_frontalface_default.xml'
+# res10 SSD face detector used with prefilter='dnn' (not shipped with opencv-python)
+DNN_MODEL = os.environ.get('FACE_DNN_MODEL', 'models/res10_300x300_ssd_iter_140000.caffemodel')
+DNN_CONFIG = os.environ.get('FACE_DNN_CONFIG', 'models/deploy.prototxt')
+
+
+class DetectionPolicy:
+    """
+    min_face: smallest face to find, in pixels of the input image.
+    min_face_ratio: the same as a fraction of the shorter image side; the larger
+        of the two wins, so big photos are not searched for tiny faces.
+    max_side: optional cap on the longer side of the image given to dlib.
+    scale: fixed scale, overriding the adaptive choice (1.0 = full resolution).
+    prefilter: None, 'haar' or 'dnn'. prefilter_mode='gate' skips dlib on frames
+        where the prefilter sees nothing; 'roi' runs dlib only on padded crops
+        around prefilter hits.
+    """
+
+    def __init__(self, min_face=40, min_face_ratio=0.04, model='hog', upsample=1, max_side=None,
+                 scale=None, prefilter=None, prefilter_mode='gate', roi_margin=0.5):
+        if model not in DETECTOR_MIN_FACE:
+            raise ValueError(f'Unknown detector model: {model}')
+        if prefilter not in PREFILTERS:
+            raise ValueError(f'Unknown prefilter: {prefilter}')
+        if prefilter_mode not in ('gate', 'roi'):
+            raise ValueError(f'Unknown prefilter mode: {prefilter_mode}')
+        self.min_face = min_face
+        self.min_face_ratio = min_face_ratio
+        self.model = model
+        self.upsample = int(upsample)
+        self.max_side = max_side
+        self.fixed_scale = scale
+        self.prefilter = prefilter
+        self.prefilter_mode = prefilter_mode
+        self.roi_margin = roi_margin
+        # cv2 detectors are not safe to share between threads
+        self._local = threading.local()
+
+    def __getstate__(self):
+        # Picklable for process pools; detectors are rebuilt lazily in each process
+        state = dict(self.__dict__)
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def __repr__(self):
+        return (f'DetectionPolicy(model={self.model!r}, upsample={self.upsample}, min_face={self.min_face}, '
+                f'min_face_ratio={self.min_face_ratio}, scale={self.fixed_scale}, prefilter={self.prefilter!r})')
+
+    def detectable_face(self):
+        """Smallest face, in pixels of the image dlib sees, that the detector will find."""
+        return DETECTOR_MIN_FACE[self.model] / 2 ** self.upsample
+
+    def scale_for(self, shape):
+        height, width = shape[:2]
+        if self.fixed_scale is not None:
+            scale = self.fixed_scale
+        else:
+            min_face = max(self.min_face, self.min_face_ratio * min(height, width))
+            scale = self.detectable_face() / max(min_face, 1)
+        if self.max_side:
+            scale = min(scale, self.max_side / max(height, width))
+        # Never upscale by resizing; upsample is the detector's own (better) way to do that
+        return min(scale, 1.0)
+
+    def detect(self, rgb):
+        """Face boxes (top, right, bottom, left) in rgb's own coordinates."""
+        height, width = rgb.shape[:2]
+        scale = self.scale_for(rgb.shape)
+        small = self._resize(rgb, scale) if scale < 1 else rgb
+        if self.prefilter is None:
+            boxes = self._dlib(small)
+        else:
+            candidates = self._prefilter(small)
+            if not candidates:
+                boxes = []
+            elif self.prefilter_mode == 'gate':
+                boxes = self._dlib(small)
+            else:
+                boxes = self._detect_rois(small, candidates)
+        if scale < 1:
+            # Map back with the exact per-axis ratio of the resized image
+            sy, sx = height / small.shape[0], width / small.shape[1]
+            boxes = [(int(round(t * sy)), int(round(r * sx)), int(round(b * sy)), int(round(l * sx)))
+                     for t, r, b, l in boxes]
+        # Clip to the image; dlib can return boxes that overhang the border
+        return [(max(t, 0), min(r, width), min(b, height), max(l, 0)) for t, r, b, l in boxes]
+
+    def _resize(self, rgb, scale):
+        # Resized into a per-thread buffer instead of a fresh allocation per frame
+        size = (max(int(round(rgb.shape[1] * scale)), 1), max(int(round(rgb.shape[0] * scale)), 1))
+        buffer = getattr(self._local, 'small', None)
+        if buffer is None or buffer.shape[:2] != (size[1], size[0]):
+            buffer = self._local.small = np.empty((size[1], size[0], rgb.shape[2]), dtype=rgb.dtype)
+        return cv2.resize(rgb, size, dst=buffer, interpolation=cv2.INTER_AREA)
+
+    def warm_up(self, rgb):
+        """Run the prefilter and dlib detector once on rgb, so loading them is not paid by a real frame."""
+        if self.prefilter is not None:
+            self._prefilter(rgb)
+        self._dlib(rgb)
+
+    def _dlib(self, rgb):
+        # Imported on first use: importing face_recognition loads every dlib model
+        import face_recognition
+        return face_recognition.face_locations(rgb, number_of_times_to_upsample=self.upsample, model=self.model)
+
+    def _detect_rois(self, small, candidates):
+        height, width = small.shape[:2]
+        boxes = []
+        for top, right, bottom, left in candidates:
+            pad = int(max(bottom - top, right - left) * self.roi_margin)
+            y0, x0 = max(top - pad, 0), max(left - pad, 0)
+            y1, x1 = min(bottom + pad, height), min(right + pad, width)
+            crop = np.ascontiguousarray(small[y0:y1, x0:x1])
+            for t, r, b, l in self._dlib(crop):
+                box = (t + y0, r + x0, b + y0, l + x0)
+                # Padded crops of neighbouring faces can both contain the same face
+                if not boxes or iou_matrix([box], boxes).max() < 0.5:
+                    boxes.append(box)
+        return boxes
+
+    def _prefilter(self, rgb):
+        if self.prefilter == 'haar':
+            return self._haar(rgb)
+        return self._dnn(rgb)
+
+    def _haar(self, rgb):
+        cascade = getattr(self._local, 'haar', None)
+        if cascade is None:
+            if not hasattr(cv2, 'CascadeClassifier'):
+                raise IOError('Haar prefilter needs an OpenCV build with the objdetect module')
+            cascade = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, HAAR_CASCADE))
+            if cascade.empty():
+                raise IOError(f'Haar cascade {HAAR_CASCADE} not found in {cv2.data.haarcascades}')
+            self._local.haar = cascade
+        gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+        min_size = max(int(self.detectable_face() * 0.75), 20)
+        found = cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=3, minSize=(min_size, min_size))
+        return [(int(y), int(x + w), int(y + h), int(x)) for x, y, w, h in found]
+
+    def _dnn(self, rgb, confidence=0.5):
+        net = getattr(self._local, 'dnn', None)
+        if net is None:
+            if not (os.path.exists(DNN_MODEL) and os.path.exists(DNN_CONFIG)):
+                raise IOError(f'DNN prefilter needs {DNN_MODEL} and {DNN_CONFIG} (set FACE_DNN_MODEL/FACE_DNN_CONFIG)')
+            net = self._local.dnn = cv2.dnn.readNetFromCaffe(DNN_CONFIG, DNN_MODEL)
+        height, width = rgb.shape[:2]
+        # The res10 model was trained on BGR input with these channel means
+        bgr = cv2.cvtColor(cv2.resize(rgb, (300, 300)), cv2.COLOR_RGB2BGR)
+        blob = cv2.dnn.blobFromImage(bgr, 1.0, (300, 300), (104.0, 177.0, 123.0))
+        net.setInput(blob)
+        detections = net.forward()[0, 0]
+        boxes = []
+        for det in detections[detections[:, 2] >= confidence]:
+            left, top, right, bottom = (det[3:7] * [width, height, width, height]).astype(int)
+            boxes.append((int(top), int(right), int(bottom), int(left)))
+        return boxes
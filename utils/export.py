@@ -0,0 +1,87 @@
+"""
+export.py
+Chunked CSV/Parquet export of attendance records straight from a database cursor.
+"""
+import csv
+import io
+import os
+import time
+
+ATTENDANCE_COLUMNS = ['ID', 'User ID', 'Name', 'Department', 'Date', 'Time', 'Confidence', 'Source']
+
+
+def iter_csv(chunks, columns=ATTENDANCE_COLUMNS):
+    """Turn an iterable of row chunks into CSV text chunks, header first."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def write_csv(db, path, chunk_size=5000, **filters):
+    count = 0
+
+    def counted(chunks):
+        nonlocal count
+        for rows in chunks:
+            count += len(rows)
+            yield rows
+
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        for text in iter_csv(counted(db.iter_attendance(chunk_size=chunk_size, **filters))):
+            f.write(text)
+    return count
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def write_parquet(db, path, chunk_size=50000, **filters):
+    """Write one Parquet row group per chunk; requires the optional pyarrow package."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('Parquet export needs pyarrow: pip install pyarrow')
+    schema = pa.schema([
+        ('id', pa.int64()), ('user_id', pa.string()), ('name', pa.string()),
+        ('department', pa.string()), ('date', pa.string()), ('time', pa.string()),
+        ('confidence', pa.float64()), ('source', pa.string()),
+    ])
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in db.iter_attendance(chunk_size=chunk_size, **filters):
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema))
+            count += len(rows)
+    return count
+
+
+def remove_old_exports(directory, max_age):
+    """Delete export files in directory older than max_age seconds; returns how many were removed."""
+    if not os.path.isdir(directory):
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            # Being written or downloaded right now
+            pass
+    return removed
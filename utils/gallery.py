@@ -0,0 +1,222 @@
+"""
+gallery.py
+Contiguous in-memory store of face encodings and their metadata.
+A person may own several rows (templates), each with a quality score in [0, 1].
+Rows are also indexed by department, the unit FaceUtils shards recognition by.
+"""
+import numpy as np
+
+ENCODING_DIM = 128
+
+
+class Gallery:
+    def __init__(self, dim=ENCODING_DIM, capacity=256):
+        self.dim = dim
+        self.size = 0
+        self._matrix = np.empty((capacity, dim), dtype=np.float32)
+        self._sq_norms = np.empty(capacity, dtype=np.float32)
+        self._qualities = np.empty(capacity, dtype=np.float32)
+        self._ids = np.empty(capacity, dtype=object)
+        self._names = np.empty(capacity, dtype=object)
+        self._departments = np.empty(capacity, dtype=object)
+        # user_id -> rows holding that user's encodings; department -> set of its rows
+        self._rows = {}
+        self._department_rows = {}
+        # Bumped by every change to the rows, so derived data knows when to rebuild
+        self.version = 0
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, user_id):
+        return user_id in self._rows
+
+    @property
+    def capacity(self):
+        return self._matrix.shape[0]
+
+    # Views over the live rows; they are invalidated by the next add/remove.
+    @property
+    def encodings(self):
+        return self._matrix[:self.size]
+
+    @property
+    def sq_norms(self):
+        return self._sq_norms[:self.size]
+
+    @property
+    def qualities(self):
+        return self._qualities[:self.size]
+
+    @property
+    def ids(self):
+        return self._ids[:self.size]
+
+    @property
+    def names(self):
+        return self._names[:self.size]
+
+    @property
+    def departments(self):
+        return self._departments[:self.size]
+
+    def rows_for(self, user_id):
+        return list(self._rows.get(user_id, ()))
+
+    def department_names(self):
+        return sorted(self._department_rows)
+
+    def rows_in(self, departments):
+        """Sorted rows of every template in the given departments."""
+        rows = [row for department in departments for row in self._department_rows.get(department, ())]
+        rows = np.fromiter(rows, dtype=np.intp, count=len(rows))
+        rows.sort()
+        return rows
+
+    def record(self, row):
+        return {
+            'id': self._ids[row],
+            'name': self._names[row],
+            'department': self._departments[row]
+        }
+
+    @property
+    def is_shared(self):
+        # True while rows are still served from a read-only (memory-mapped) matrix
+        return not self._matrix.flags.writeable
+
+    def attach(self, matrix, ids, names, departments, qualities=None):
+        """
+        Serve rows straight from a read-only matrix (e.g. np.load(..., mmap_mode='r'))
+        so processes share its pages. The first mutation copies it into private memory.
+        """
+        count = matrix.shape[0]
+        if not (count == len(ids) == len(names) == len(departments)):
+            raise ValueError('encodings and metadata must have the same length')
+        self.clear()
+        self._matrix = matrix
+        self._sq_norms = np.einsum('ij,ij->i', matrix, matrix).astype(np.float32)
+        self._qualities = np.ones(count, dtype=np.float32) if qualities is None else \
+            np.asarray(qualities, dtype=np.float32).reshape(count).copy()
+        for attr, values in (('_ids', ids), ('_names', names), ('_departments', departments)):
+            column = np.empty(count, dtype=object)
+            column[:] = list(values)
+            setattr(self, attr, column)
+        for row, (user_id, department) in enumerate(zip(self._ids, self._departments)):
+            self._rows.setdefault(user_id, []).append(row)
+            self._department_rows.setdefault(department, set()).add(row)
+        self.size = count
+        self.version += 1
+
+    def _reserve(self, needed):
+        if needed <= self.capacity and not self.is_shared:
+            return
+        capacity = max(needed, 2 * self.capacity, 16) if needed > self.capacity else self.capacity
+        matrix = np.empty((capacity, self.dim), dtype=np.float32)
+        matrix[:self.size] = self._matrix[:self.size]
+        sq_norms = np.empty(capacity, dtype=np.float32)
+        sq_norms[:self.size] = self._sq_norms[:self.size]
+        qualities = np.empty(capacity, dtype=np.float32)
+        qualities[:self.size] = self._qualities[:self.size]
+        self._matrix, self._sq_norms, self._qualities = matrix, sq_norms, qualities
+        for attr in ('_ids', '_names', '_departments'):
+            old = getattr(self, attr)
+            new = np.empty(capacity, dtype=object)
+            new[:self.size] = old[:self.size]
+            setattr(self, attr, new)
+
+    def add(self, encoding, user_id, name, department, quality=1.0):
+        self._reserve(self.size + 1)
+        row = self.size
+        vec = self._matrix[row]
+        vec[:] = np.asarray(encoding, dtype=np.float32).reshape(self.dim)
+        self._sq_norms[row] = np.dot(vec, vec)
+        self._qualities[row] = quality
+        self._ids[row] = user_id
+        self._names[row] = name
+        self._departments[row] = department
+        self._rows.setdefault(user_id, []).append(row)
+        self._department_rows.setdefault(department, set()).add(row)
+        self.size += 1
+        self.version += 1
+        return row
+
+    def extend(self, encodings, ids, names, departments, qualities=None):
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        count = encodings.shape[0]
+        if not (count == len(ids) == len(names) == len(departments)):
+            raise ValueError('encodings and metadata must have the same length')
+        self._reserve(self.size + count)
+        start, stop = self.size, self.size + count
+        self._matrix[start:stop] = encodings
+        block = self._matrix[start:stop]
+        self._sq_norms[start:stop] = np.einsum('ij,ij->i', block, block)
+        self._qualities[start:stop] = 1.0 if qualities is None else np.asarray(qualities, dtype=np.float32)
+        self._ids[start:stop] = list(ids)
+        self._names[start:stop] = list(names)
+        self._departments[start:stop] = list(departments)
+        for row in range(start, stop):
+            self._rows.setdefault(self._ids[row], []).append(row)
+            self._department_rows.setdefault(self._departments[row], set()).add(row)
+        self.size = stop
+        self.version += 1
+        return range(start, stop)
+
+    def remove_row(self, row):
+        """Swap-remove one row. Returns the old index of the row moved into its slot, or None."""
+        if not 0 <= row < self.size:
+            raise IndexError(row)
+        self._reserve(self.size)
+        last = self.size - 1
+        user_rows = self._rows[self._ids[row]]
+        user_rows.remove(row)
+        if not user_rows:
+            del self._rows[self._ids[row]]
+        department_rows = self._department_rows[self._departments[row]]
+        department_rows.discard(row)
+        if not department_rows:
+            del self._department_rows[self._departments[row]]
+        moved = None
+        if row != last:
+            self._matrix[row] = self._matrix[last]
+            self._sq_norms[row] = self._sq_norms[last]
+            self._qualities[row] = self._qualities[last]
+            self._ids[row] = self._ids[last]
+            self._names[row] = self._names[last]
+            self._departments[row] = self._departments[last]
+            last_rows = self._rows[self._ids[row]]
+            last_rows[last_rows.index(last)] = row
+            department_rows = self._department_rows[self._departments[row]]
+            department_rows.discard(last)
+            department_rows.add(row)
+            moved = last
+        self._ids[last] = self._names[last] = self._departments[last] = None
+        self.size = last
+        self.version += 1
+        return moved
+
+    def remove(self, user_id):
+        # Highest rows first so a swap never moves one of this user's own rows
+        rows = sorted(self._rows.get(user_id, ()), reverse=True)
+        for row in rows:
+            self.remove_row(row)
+        return len(rows)
+
+    def clear(self):
+        self._ids[:self.size] = None
+        self._names[:self.size] = None
+        self._departments[:self.size] = None
+        self._rows = {}
+        self._department_rows = {}
+        self.size = 0
+        self.version += 1
+
+    def distance_matrix(self, encodings):
+        """Euclidean distances from each of F encodings to every row, shape (F, N)."""
+        q = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        d2 = q @ self.encodings.T
+        d2 *= -2.0
+        d2 += self.sq_norms
+        d2 += np.einsum('ij,ij->i', q, q)[:, None]
+        np.maximum(d2, 0.0, out=d2)
+        return np.sqrt(d2, out=d2)
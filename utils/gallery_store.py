@@ -0,0 +1,271 @@
+"""
+gallery_store.py
+On-disk gallery format: a memory-mapped float32 snapshot plus an append-only journal.
+
+Layout of the gallery directory:
+    CURRENT                 generation number of the live snapshot
+    matrix-<gen>.npy        (N, 128) float32 encodings sorted by department, loaded with mmap_mode='r'
+    meta-<gen>.json         ids, names, departments and template qualities for the N rows,
+                            and the [start, stop) rows of each department
+    journal-<gen>.log       adds and tombstones written since that snapshot
+
+Enrollment and deletion append one checksummed record to the journal (O(1) I/O).
+A checkpoint writes a new generation and switches CURRENT with an atomic rename,
+so a crash at any point leaves either the old or the new generation intact. The
+previous generation is kept until the next checkpoint, so a reader that read
+CURRENT just before the rename can still open its files.
+The store assumes a single writer process; any number of processes may read.
+Readers replay up to the first torn or corrupt record, which may be an append
+still in progress, and leave the file alone; the writer cuts a torn tail off
+before its first append.
+Because rows are grouped by department, a reader that loads only some departments
+maps just their slices of the snapshot; such a partial load cannot be checkpointed.
+"""
+import json
+import os
+import pickle
+import struct
+import zlib
+import numpy as np
+
+JOURNAL_MAGIC = b'GJ'
+OP_ADD = b'A'
+OP_DELETE = b'D'
+# magic, op, payload length, crc32 of payload
+RECORD_HEADER = struct.Struct('<2scII')
+
+
+def _fsync_write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _parse_journal(data):
+    """Intact (op, payload) records of a journal, and the offset where they end."""
+    records, offset = [], 0
+    while offset + RECORD_HEADER.size <= len(data):
+        magic, op, length, crc = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        payload = data[start:start + length]
+        if magic != JOURNAL_MAGIC or len(payload) != length or zlib.crc32(payload) != crc:
+            break
+        records.append((op, payload))
+        offset = start + length
+    return records, offset
+
+
+def _fsync_dir(path):
+    # Directory fsync makes the rename durable; not supported on Windows
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class GalleryStore:
+    def __init__(self, path, fsync=True, compact_min_records=256, compact_ratio=0.25):
+        self.path = path
+        self.fsync = fsync
+        self.compact_min_records = compact_min_records
+        self.compact_ratio = compact_ratio
+        self.generation = None
+        self.snapshot_count = 0
+        self.journal_records = 0
+        self._journal = None
+        # Set when only some departments were loaded; checkpointing would drop the others
+        self.partial = False
+
+    def _file(self, kind, generation, ext):
+        return os.path.join(self.path, f'{kind}-{generation:06d}.{ext}')
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, 'CURRENT'))
+
+    def _read_current(self):
+        with open(os.path.join(self.path, 'CURRENT')) as f:
+            return int(f.read().strip())
+
+    def load(self, gallery, keep=None):
+        """
+        Attach the snapshot to gallery (memory-mapped) and replay the journal on top.
+        keep(department) -> bool loads only the matching departments' rows.
+        """
+        if not self.exists():
+            self.checkpoint(gallery)
+            self.partial = keep is not None
+            return
+        self.close()
+        for attempt in range(2):
+            generation = self._read_current()
+            try:
+                matrix = np.load(self._file('matrix', generation, 'npy'), mmap_mode='r')
+                with open(self._file('meta', generation, 'json'), encoding='utf-8') as f:
+                    meta = json.load(f)
+                break
+            except FileNotFoundError:
+                # Two checkpoints in another process went by since CURRENT was read; read it again
+                if attempt:
+                    raise
+        ids, names, departments = meta['ids'], meta['names'], meta['departments']
+        # Snapshots written before multi-template galleries have no qualities
+        qualities = meta.get('qualities')
+        if keep is not None:
+            rows = self._kept_rows(departments, meta.get('department_ranges'), keep)
+            if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+                # One contiguous run stays a view of the mapped file
+                matrix = matrix[rows[0]:rows[-1] + 1]
+            else:
+                matrix = np.ascontiguousarray(matrix[rows])
+            ids, names, departments = ([column[r] for r in rows] for column in (ids, names, departments))
+            qualities = [qualities[r] for r in rows] if qualities is not None else None
+        gallery.attach(matrix, ids, names, departments, qualities)
+        self.generation = generation
+        self.snapshot_count = len(meta['ids'])
+        self.partial = keep is not None
+        self.journal_records = self._replay(gallery, keep)
+
+    @staticmethod
+    def _kept_rows(departments, ranges, keep):
+        if ranges is None:
+            # Snapshots written before department ordering: test every row
+            return np.flatnonzero([keep(department) for department in departments])
+        spans = sorted(tuple(span) for department, span in ranges.items() if keep(department))
+        if not spans:
+            return np.zeros(0, dtype=np.intp)
+        return np.concatenate([np.arange(start, stop) for start, stop in spans])
+
+    def _replay(self, gallery, keep=None):
+        path = self._file('journal', self.generation, 'log')
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'rb') as f:
+            records, _ = _parse_journal(f.read())
+        for op, payload in records:
+            if op == OP_ADD:
+                vec_bytes = gallery.dim * 4
+                encoding = np.frombuffer(payload[:vec_bytes], dtype=np.float32)
+                fields = json.loads(payload[vec_bytes:].decode('utf-8'))
+                if keep is None or keep(fields[2]):
+                    gallery.add(encoding, *fields[:3], quality=fields[3] if len(fields) > 3 else 1.0)
+            elif op == OP_DELETE:
+                gallery.remove(json.loads(payload.decode('utf-8'))[0])
+        return len(records)
+
+    def _open_journal(self):
+        # Only the writer appends, so only the writer may cut off a torn tail left by a
+        # crash mid-append; records appended after it would never be replayed
+        if self._journal is None:
+            path = self._file('journal', self.generation, 'log')
+            self._journal = open(path, 'a+b')
+            self._journal.seek(0)
+            _, end = _parse_journal(self._journal.read())
+            if end < self._journal.tell():
+                self._journal.truncate(end)
+        return self._journal
+
+    def _append(self, records):
+        journal = self._open_journal()
+        journal.write(b''.join(
+            RECORD_HEADER.pack(JOURNAL_MAGIC, op, len(payload), zlib.crc32(payload)) + payload
+            for op, payload in records
+        ))
+        journal.flush()
+        if self.fsync:
+            os.fsync(journal.fileno())
+        self.journal_records += len(records)
+
+    def append_adds(self, encodings, ids, names, departments, qualities=None):
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(len(ids), -1)
+        qualities = [1.0] * len(ids) if qualities is None else [float(q) for q in qualities]
+        self._append([
+            (OP_ADD, encoding.tobytes() + json.dumps([user_id, name, department, quality]).encode('utf-8'))
+            for encoding, user_id, name, department, quality in zip(encodings, ids, names, departments, qualities)
+        ])
+
+    def append_add(self, encoding, user_id, name, department, quality=1.0):
+        self.append_adds([encoding], [user_id], [name], [department], [quality])
+
+    def append_delete(self, user_id):
+        self._append([(OP_DELETE, json.dumps([user_id]).encode('utf-8'))])
+
+    def needs_compaction(self):
+        limit = max(self.compact_min_records, self.compact_ratio * self.snapshot_count)
+        return self.journal_records >= limit
+
+    def checkpoint(self, gallery):
+        """
+        Write gallery as a new generation and switch CURRENT atomically. The generation
+        before the previous one is dropped; the previous one stays for readers mid-load.
+        """
+        if self.partial:
+            raise ValueError(f'{self.path} was loaded with only some departments; checkpointing would drop the rest')
+        os.makedirs(self.path, exist_ok=True)
+        previous = self.generation if self.generation is not None else (
+            self._read_current() if self.exists() else None)
+        generation = 0 if previous is None else previous + 1
+        # Grouped by department (stable, so a person's templates keep their order)
+        departments = gallery.departments.tolist()
+        order = sorted(range(len(departments)), key=departments.__getitem__)
+        ranges = {}
+        for position, row in enumerate(order):
+            ranges.setdefault(departments[row], [position, position])[1] = position + 1
+        matrix_path = self._file('matrix', generation, 'npy')
+        with open(matrix_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(gallery.encodings[order], dtype=np.float32).reshape(-1, gallery.dim))
+            f.flush()
+            os.fsync(f.fileno())
+        meta = {
+            'count': len(gallery),
+            'ids': gallery.ids[order].tolist(),
+            'names': gallery.names[order].tolist(),
+            'departments': [departments[row] for row in order],
+            'qualities': gallery.qualities[order].tolist(),
+            'department_ranges': ranges
+        }
+        _fsync_write(self._file('meta', generation, 'json'), json.dumps(meta).encode('utf-8'))
+        _fsync_write(self._file('journal', generation, 'log'), b'')
+        tmp = os.path.join(self.path, 'CURRENT.tmp')
+        _fsync_write(tmp, str(generation).encode())
+        os.replace(tmp, os.path.join(self.path, 'CURRENT'))
+        _fsync_dir(self.path)
+        self.close()
+        self.generation = generation
+        self.snapshot_count = len(gallery)
+        self.journal_records = 0
+        if previous is not None:
+            self._remove_generations_before(previous)
+
+    def _remove_generations_before(self, generation):
+        for name in os.listdir(self.path):
+            stem, _, ext = name.partition('.')
+            kind, _, number = stem.partition('-')
+            if kind in ('matrix', 'meta', 'journal') and number.isdigit() and int(number) < generation:
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    # Still mapped by another process on Windows; removed by a later checkpoint
+                    pass
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+
+def migrate_pickle(pickle_path, store, gallery):
+    """One-time import of a legacy encodings.pkl into store; returns the number of rows."""
+    with open(pickle_path, 'rb') as f:
+        data = pickle.load(f)
+    gallery.clear()
+    if data['ids']:
+        gallery.extend(data['encodings'], data['ids'], data['names'], data['departments'])
+    store.checkpoint(gallery)
+    return len(gallery)
@@ -0,0 +1,289 @@
+"""
+metrics.py
+Process-wide counters, gauges and latency histograms for the hot paths, exported
+in Prometheus text format.
+
+Metrics are module-level objects created once at import. When metrics are
+disabled (ATTENDANCE_METRICS=0 or set_enabled(False)) every update is a single
+flag check. Histograms count into fixed buckets instead of keeping samples, so
+memory stays flat and quantiles are estimated from buckets as Prometheus does.
+"""
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds; spans a fast gallery match (~0.1 ms) up to CNN detection on a large frame
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_NULL_TIMER = nullcontext()
+
+
+class Registry:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        # name -> (type, help); (name, labels) -> metric, both in creation order
+        self._families = {}
+        self._metrics = {}
+
+    def register(self, metric):
+        with self._lock:
+            family = self._families.setdefault(metric.name, (metric.kind, metric.help))
+            if family[0] != metric.kind:
+                raise ValueError(f'{metric.name} is already registered as a {family[0]}')
+            # Asking twice for the same name and labels returns the first metric
+            return self._metrics.setdefault((metric.name, metric.labels), metric)
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def families(self):
+        with self._lock:
+            return dict(self._families)
+
+    def reset(self):
+        for metric in self.metrics():
+            metric.reset()
+
+
+REGISTRY = Registry(enabled=os.environ.get('ATTENDANCE_METRICS', '1').lower() not in ('0', 'false', 'no'))
+
+
+def set_enabled(enabled):
+    REGISTRY.enabled = bool(enabled)
+
+
+def is_enabled():
+    return REGISTRY.enabled
+
+
+def _label_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help='', labels=None):
+        self.name, self.help = name, help
+        self.labels = tuple(sorted((labels or {}).items()))
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        if not REGISTRY.enabled:
+            return
+        with self._lock:
+            self.value += amount
+
+    def reset(self):
+        with self._lock:
+            self.value = 0
+
+    def samples(self):
+        return [(self.name, (), self.value)]
+
+    def summary(self):
+        return {'value': self.value}
+
+
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help='', labels=None, function=None):
+        self.name, self.help = name, help
+        self.labels = tuple(sorted((labels or {}).items()))
+        # function() is read at export time instead of tracking every change
+        self.function = function
+        self.value = 0
+
+    def set(self, value):
+        if REGISTRY.enabled:
+            self.value = value
+
+    def reset(self):
+        if self.function is None:
+            self.value = 0
+
+    def current(self):
+        if self.function is not None:
+            try:
+                return self.function()
+            except Exception:
+                return float('nan')
+        return self.value
+
+    def samples(self):
+        return [(self.name, (), self.current())]
+
+    def summary(self):
+        return {'value': self.current()}
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help='', labels=None, buckets=LATENCY_BUCKETS):
+        self.name, self.help = name, help
+        self.labels = tuple(sorted((labels or {}).items()))
+        self.bounds = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # Last slot is the +Inf bucket
+            self.counts = [0] * (len(self.bounds) + 1)
+            self.count = 0
+            self.sum = 0.0
+
+    def observe(self, value):
+        if not REGISTRY.enabled:
+            return
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def time(self):
+        """Context manager observing the duration of its block (a no-op when disabled)."""
+        return _Timer(self) if REGISTRY.enabled else _NULL_TIMER
+
+    def quantile(self, q):
+        """Estimate by linear interpolation inside the bucket holding the q-th observation."""
+        with self._lock:
+            counts, total = list(self.counts), self.count
+        if not total:
+            return None
+        rank, seen = q * total, 0
+        for index, count in enumerate(counts):
+            if seen + count >= rank and count:
+                lower = self.bounds[index - 1] if index else 0.0
+                if index == len(self.bounds):
+                    # Beyond the largest bucket all we know is the lower bound
+                    return lower
+                return lower + (self.bounds[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+    def samples(self):
+        with self._lock:
+            counts, total, value_sum = list(self.counts), self.count, self.sum
+        out, cumulative = [], 0
+        for bound, count in zip(self.bounds + (float('inf'),), counts):
+            cumulative += count
+            out.append((self.name + '_bucket', (('le', _number(float(bound))),), cumulative))
+        out.append((self.name + '_sum', (), value_sum))
+        out.append((self.name + '_count', (), total))
+        return out
+
+    def summary(self):
+        ms = {f'p{int(q * 100)}_ms': (v * 1000 if v is not None else None)
+              for q, v in ((q, self.quantile(q)) for q in (0.5, 0.95, 0.99))}
+        return dict(count=self.count, mean_ms=self.sum / self.count * 1000 if self.count else None, **ms)
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+def counter(name, help='', **labels):
+    return REGISTRY.register(Counter(name, help, labels))
+
+
+def gauge(name, help='', function=None, **labels):
+    return REGISTRY.register(Gauge(name, help, labels, function))
+
+
+def histogram(name, help='', buckets=LATENCY_BUCKETS, **labels):
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
+
+
+def timed(metric):
+    """Decorator observing each call's duration in histogram metric."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not REGISTRY.enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metric.observe(time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+def snapshot():
+    """One row per metric and label set, for display."""
+    return [dict(name=m.name, type=m.kind, labels=dict(m.labels), **m.summary()) for m in REGISTRY.metrics()]
+
+
+def export_prometheus():
+    """All metrics in the Prometheus text exposition format."""
+    families = REGISTRY.families()
+    by_name = {}
+    for metric in REGISTRY.metrics():
+        by_name.setdefault(metric.name, []).append(metric)
+    lines = []
+    for name, metrics in by_name.items():
+        kind, help_text = families[name]
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for metric in metrics:
+            for sample, extra, value in metric.samples():
+                lines.append(f'{sample}{_label_text(metric.labels, extra)} {_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = export_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood stderr
+        pass
+
+
+def start_http_server(port, host='127.0.0.1'):
+    """Serve GET /metrics from a daemon thread, for processes without their own web server."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
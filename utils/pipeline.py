@@ -0,0 +1,241 @@
+"""
+pipeline.py
+Threaded capture -> detect/encode -> consume pipeline for live camera attendance.
+
+The capture thread always holds only the freshest frame; frames a busy worker
+never picked up are counted as dropped instead of queueing up latency.
+Workers run detection and encoding and hand results to the consumer through a
+bounded queue, so a slow consumer throttles the workers, which in turn makes
+the capture stage drop frames rather than grow memory.
+"""
+import queue
+import threading
+import time
+from collections import deque
+import cv2
+import numpy as np
+from utils import metrics
+
+FRAME_LATENCY = metrics.histogram('attendance_frame_latency_seconds', 'Capture to recognized frame', loop='camera')
+FRAMES_DROPPED = metrics.counter('attendance_frames_dropped_total', 'Frames skipped to stay real time')
+
+
+class StageStats:
+    """Thread-safe rolling latency windows and counters per pipeline stage."""
+
+    def __init__(self, window=120):
+        self.window = window
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._counters = {}
+        self._started = time.perf_counter()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            samples = self._latencies.get(stage)
+            if samples is None:
+                samples = self._latencies[stage] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def incr(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            latencies = {stage: list(samples) for stage, samples in self._latencies.items()}
+            counters = dict(self._counters)
+        elapsed = max(time.perf_counter() - self._started, 1e-9)
+        stages = {}
+        for stage, samples in latencies.items():
+            ms = np.asarray(samples) * 1000.0
+            stages[stage] = {'mean_ms': float(ms.mean()), 'p95_ms': float(np.percentile(ms, 95))}
+        return {'stages': stages, 'counters': counters,
+                'output_fps': counters.get('frames_out', 0) / elapsed}
+
+    def format(self):
+        snap = self.snapshot()
+        lines = [f"Output FPS: {snap['output_fps']:.2f}"]
+        for stage, values in snap['stages'].items():
+            lines.append(f"{stage:>10}: {values['mean_ms']:7.1f} ms mean  {values['p95_ms']:7.1f} ms p95")
+        counters = snap['counters']
+        lines.append(f"Captured: {counters.get('frames_in', 0)}  Processed: {counters.get('frames_out', 0)}  "
+                     f"Dropped: {counters.get('dropped_capture', 0) + counters.get('dropped_stale', 0)}")
+        return '\n'.join(lines)
+
+
+class LatestFrame:
+    """Single-slot mailbox: put() overwrites an unconsumed frame, get() takes it."""
+
+    def __init__(self, stats=None):
+        self._cond = threading.Condition()
+        self._item = None
+        self._closed = False
+        self.stats = stats
+
+    def put(self, item):
+        with self._cond:
+            if self._item is not None and self.stats is not None:
+                self.stats.incr('dropped_capture')
+                FRAMES_DROPPED.inc()
+            self._item = item
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        with self._cond:
+            if self._item is None and not self._closed:
+                self._cond.wait(timeout)
+            item, self._item = self._item, None
+            return item
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def empty(self):
+        return self._item is None
+
+
+class DisplayThrottle:
+    """At most `fps` UI refreshes per second; skipped frames are never drawn or encoded for display."""
+
+    def __init__(self, fps=10):
+        self.interval = 1.0 / fps if fps else 0.0
+        self._last = None
+
+    def ready(self):
+        now = time.perf_counter()
+        if self._last is not None and now - self._last < self.interval:
+            return False
+        self._last = now
+        return True
+
+
+class FrameResult:
+    def __init__(self, seq, frame, boxes, encodings, captured_at, tracks=None, pending=None, statuses=None):
+        self.seq = seq
+        self.frame = frame
+        self.boxes = boxes
+        self.encodings = encodings
+        self.captured_at = captured_at
+        # With a tracker: all visible tracks (aligned with boxes) and the ones
+        # that were encoded this frame (aligned with encodings)
+        self.tracks = tracks
+        self.pending = pending
+        # With a liveness checker: live_key(track) -> 'live' | 'spoof' | 'pending'
+        self.statuses = statuses
+
+
+class FramePipeline:
+    def __init__(self, capture, face_utils, workers=2, queue_size=4, scale=None, tracker=None, policy=None,
+                 liveness=None):
+        self.capture = capture
+        self.face_utils = face_utils
+        # Frames go to detection at full size; the policy picks the detection resolution and
+        # encodings use full-resolution pixels. scale shrinks frames up front as before.
+        self.policy = policy
+        self.tracker = tracker
+        # Tracking is sequential by nature, so a tracker gets a single worker
+        self.workers = 1 if tracker is not None else workers
+        # LivenessChecker run on the worker after tracking, reusing its RGB conversion; needs the tracker
+        if liveness is not None and tracker is None:
+            raise ValueError('Liveness is judged per track and needs a tracker')
+        self.liveness = liveness
+        self.scale = scale
+        self.stats = StageStats()
+        self._latest = LatestFrame(self.stats)
+        self._results = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._threads = []
+        self._last_seq = -1
+        self.finished = False
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._capture_loop, name='capture', daemon=True)]
+        self._threads += [threading.Thread(target=self._worker_loop, name=f'detect-{i}', daemon=True)
+                          for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def _capture_loop(self):
+        seq = 0
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            ret, frame = self.capture.read()
+            if not ret:
+                break
+            self.stats.record('capture', time.perf_counter() - start)
+            self.stats.incr('frames_in')
+            self._latest.put((seq, frame, time.perf_counter()))
+            seq += 1
+        self._latest.close()
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            item = self._latest.get(timeout=0.1)
+            if item is None:
+                if self._latest.closed:
+                    break
+                continue
+            seq, frame, captured_at = item
+            small = cv2.resize(frame, (0, 0), fx=self.scale, fy=self.scale) if self.scale not in (None, 1) else frame
+            boxes, encodings, tracks, pending = self.face_utils.process_frame(small, self.policy, self.tracker,
+                                                                              self.stats)
+            statuses = None
+            if self.liveness is not None:
+                start = time.perf_counter()
+                statuses = self.liveness.update(small, tracks, rgb=self.face_utils.converted_rgb(small))
+                self.stats.record('liveness', time.perf_counter() - start)
+            result = FrameResult(seq, small, boxes, encodings, captured_at, tracks, pending, statuses)
+            # Blocking put is the backpressure: a full queue stalls workers, not memory
+            while not self._stop.is_set():
+                try:
+                    self._results.put(result, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+    def get(self, timeout=1.0):
+        """Next processed frame in capture order, or None if nothing arrived in time."""
+        deadline = time.perf_counter() + timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                self._check_finished()
+                return None
+            try:
+                result = self._results.get(timeout=min(remaining, 0.1))
+            except queue.Empty:
+                if self._check_finished():
+                    return None
+                continue
+            if result.seq < self._last_seq:
+                # A faster worker already delivered a newer frame
+                self.stats.incr('dropped_stale')
+                FRAMES_DROPPED.inc()
+                continue
+            self._last_seq = result.seq
+            self.stats.incr('frames_out')
+            latency = time.perf_counter() - result.captured_at
+            self.stats.record('latency', latency)
+            FRAME_LATENCY.observe(latency)
+            return result
+
+    def _check_finished(self):
+        if self._results.empty() and not any(t.is_alive() for t in self._threads):
+            self.finished = True
+        return self.finished
+
+    def stop(self):
+        self._stop.set()
+        self._latest.close()
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+        self.capture.release()
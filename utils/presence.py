@@ -0,0 +1,85 @@
+"""
+presence.py
+Process-wide "present today" index, so repeat recognitions never reach SQLite.
+
+One PresenceIndex is shared by every session, camera and request of a process.
+It holds the user ids with attendance for today, warmed from the database at
+startup and on each day boundary, plus the time each user was last forwarded
+for marking. A recognition is forwarded only if the user is not present yet and
+was not forwarded within `cooldown` seconds; everything else is dropped with a
+set lookup under one lock. Marks made by other processes are learned the first
+time the database reports them as already marked.
+"""
+import threading
+import time
+from datetime import date
+from utils import metrics
+
+SUPPRESSED = {reason: metrics.counter('attendance_presence_suppressed_total',
+                                      'Recognitions dropped before any database work', reason=reason)
+              for reason in ('present', 'cooldown')}
+PRESENT = metrics.gauge('attendance_presence_users', 'Users present today in the presence index')
+
+
+class PresenceIndex:
+    def __init__(self, db=None, cooldown=30.0):
+        self.db = db
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._present = set()
+        self._last_sent = {}
+        self._day = None
+        self.warm()
+
+    def warm(self):
+        """(Re)load today's attendance from the database and forget cooldowns."""
+        today = date.today()
+        present = {row[1] for row in self.db.get_attendance_today()} if self.db is not None else set()
+        with self._lock:
+            self._day = today
+            self._present = present
+            self._last_sent = {}
+        PRESENT.set(len(present))
+
+    def _roll_over(self):
+        if date.today() != self._day:
+            self.warm()
+
+    def is_present(self, user_id):
+        self._roll_over()
+        return user_id in self._present
+
+    def due(self, user_ids, now=None):
+        """
+        The user_ids (in order, without repeats) to forward for marking now. Each
+        returned id starts its cooldown, so concurrent callers do not both forward it.
+        """
+        self._roll_over()
+        now = time.monotonic() if now is None else now
+        selected = []
+        with self._lock:
+            for user_id in user_ids:
+                if user_id in self._present:
+                    SUPPRESSED['present'].inc()
+                elif now - self._last_sent.get(user_id, now - self.cooldown) < self.cooldown:
+                    SUPPRESSED['cooldown'].inc()
+                else:
+                    self._last_sent[user_id] = now
+                    selected.append(user_id)
+        return selected
+
+    def mark_present(self, user_ids):
+        # Present for the rest of the day, whether this call inserted the row or an earlier one did
+        self._roll_over()
+        with self._lock:
+            self._present.update(user_ids)
+            count = len(self._present)
+        PRESENT.set(count)
+
+    def present(self):
+        self._roll_over()
+        with self._lock:
+            return frozenset(self._present)
+
+    def __len__(self):
+        return len(self._present)
@@ -0,0 +1,65 @@
+"""
+quality.py
+Quality score of a face crop, used to rank an identity's templates.
+
+The score is the product of three parts in [0, 1]:
+  size       shorter box side against IDEAL_FACE pixels
+  sharpness  variance of the Laplacian of the crop, normalized to a fixed size
+  frontal    yaw (nose off the eye midline) and roll (tilted eye line) from
+             face_recognition landmarks; 1.0 when no landmarks are given
+"""
+import cv2
+import numpy as np
+
+IDEAL_FACE = 100
+# Laplacian variance of a sharp face crop resized to SHARPNESS_SIZE
+SHARP_VARIANCE = 150.0
+SHARPNESS_SIZE = 96
+MAX_ROLL_DEGREES = 30.0
+
+
+def _center(points):
+    return np.mean(np.asarray(points, dtype=np.float32), axis=0)
+
+
+def frontal_score(landmarks):
+    """1.0 for a level, frontal face, falling to 0 as yaw or roll grow."""
+    try:
+        left, right = _center(landmarks['left_eye']), _center(landmarks['right_eye'])
+        nose = _center(landmarks['nose_tip'])
+    except KeyError:
+        return 1.0
+    eye_vec = right - left
+    eye_dist = float(np.hypot(*eye_vec))
+    if eye_dist < 1:
+        return 0.0
+    # Horizontal offset of the nose from the eye midpoint, along the eye line
+    yaw = abs(float(np.dot(nose - (left + right) / 2, eye_vec)) / eye_dist) / eye_dist
+    roll = abs(np.degrees(np.arctan2(eye_vec[1], eye_vec[0])))
+    roll = min(roll, 180 - roll)
+    return float(np.clip(1 - 2 * yaw, 0, 1) * np.clip(1 - roll / MAX_ROLL_DEGREES, 0, 1))
+
+
+def sharpness_score(image, box):
+    top, right, bottom, left = box
+    crop = image[max(top, 0):bottom, max(left, 0):right]
+    if crop.size == 0:
+        return 0.0
+    gray = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY) if crop.ndim == 3 else crop
+    # Fixed size so the score does not depend on how large the face is
+    gray = cv2.resize(gray, (SHARPNESS_SIZE, SHARPNESS_SIZE), interpolation=cv2.INTER_AREA)
+    return float(min(1.0, cv2.Laplacian(gray, cv2.CV_32F).var() / SHARP_VARIANCE))
+
+
+def face_quality(image, box, landmarks=None):
+    """Quality parts and overall score of the face at box (top, right, bottom, left) in image."""
+    top, right, bottom, left = box
+    size = min(1.0, min(bottom - top, right - left) / IDEAL_FACE)
+    sharpness = sharpness_score(image, box)
+    frontal = frontal_score(landmarks) if landmarks else 1.0
+    return {
+        'size': size,
+        'sharpness': sharpness,
+        'frontal': frontal,
+        'score': size * sharpness * frontal,
+    }
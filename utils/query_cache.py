@@ -0,0 +1,76 @@
+"""
+query_cache.py
+Bounded LRU cache for query results, invalidated by a data version.
+
+Every entry remembers the data version it was computed at. Writers bump the
+version after committing, so a read is served from memory until something
+has actually changed, without having to know which queries a write affects.
+"""
+import functools
+import threading
+from collections import OrderedDict
+from datetime import date
+
+
+class QueryCache:
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.version = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def bump(self):
+        with self._lock:
+            self.version += 1
+
+    def get_or_compute(self, key, compute, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # Computed outside the lock; a concurrent miss on the same key just computes twice
+        value = compute()
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'maxsize': self.maxsize,
+                'version': self.version,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+def cached_query(method):
+    """
+    Cache a read method of an object exposing `cache` (QueryCache) and
+    `data_version()`. Today's date is part of the key so date-relative
+    queries such as "attendance today" roll over at midnight.
+    Cached results are shared between callers and must not be mutated.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (method.__name__, date.today(), args, tuple(sorted(kwargs.items())))
+        return self.cache.get_or_compute(key, lambda: method(self, *args, **kwargs), self.data_version())
+    return wrapper
@@ -0,0 +1,186 @@
+"""
+tracking.py
+Detect-once, track-between face tracking with per-track identity caching.
+
+Full detection runs only every `detect_every` frames (or as soon as a track is
+lost); in between, boxes are carried forward by a cheap follower. Each track
+remembers who it was recognized as, so only new or stale tracks need the
+expensive 128-d encoding. Boxes use face_recognition's (top, right, bottom, left).
+A track whose detection jumps in position or size, or that is matched again after
+being missed, may have been taken over by someone else, so it is encoded again.
+"""
+import threading
+import cv2
+import numpy as np
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """Pairwise intersection-over-union of two lists of (top, right, bottom, left) boxes."""
+    if not len(boxes_a) or not len(boxes_b):
+        return np.zeros((len(boxes_a), len(boxes_b)))
+    a = np.asarray(boxes_a, dtype=np.float64)[:, None, :]
+    b = np.asarray(boxes_b, dtype=np.float64)[None, :, :]
+    inter_h = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    inter_w = np.clip(np.minimum(a[..., 1], b[..., 1]) - np.maximum(a[..., 3], b[..., 3]), 0, None)
+    inter = inter_h * inter_w
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 1] - a[..., 3])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 1] - b[..., 3])
+    return inter / np.maximum(area_a + area_b - inter, 1e-9)
+
+
+def box_jumped(old, new, max_shift, max_scale):
+    """True if new's center is over max_shift box sizes from old's, or its size changed over max_scale times."""
+    old_size = max(old[2] - old[0], old[1] - old[3], 1)
+    new_size = max(new[2] - new[0], new[1] - new[3], 1)
+    shift = np.hypot((new[0] + new[2] - old[0] - old[2]) / 2, (new[1] + new[3] - old[1] - old[3]) / 2)
+    return shift > max_shift * old_size or max(old_size, new_size) > max_scale * min(old_size, new_size)
+
+
+def _create_cv_tracker():
+    # KCF is fast but lives in opencv-contrib; MIL ships with every opencv-python build
+    for factory in ('TrackerKCF_create', 'TrackerMIL_create'):
+        for namespace in (cv2, getattr(cv2, 'legacy', None)):
+            if namespace is not None and hasattr(namespace, factory):
+                return getattr(namespace, factory)()
+    return None
+
+
+class Track:
+    def __init__(self, track_id, box):
+        self.id = track_id
+        self.box = tuple(int(v) for v in box)
+        self.user = None
+        self.confidence = 0.0
+        self.identified_at = None
+        self.missed = 0
+        self.hits = 1
+        self.follower = None
+
+    @property
+    def label(self):
+        return self.user['name'] if self.user else 'Unknown'
+
+
+class FaceTracker:
+    """
+    follow='hold' keeps boxes where they were last detected (right for a kiosk
+    where people stand still); follow='opencv' moves them with an OpenCV
+    KCF/MIL tracker and forces a re-detection when one loses its target.
+    Recognized tracks are re-encoded every `reidentify_every` frames, and
+    unknown ones every `retry_unknown_every` frames. A matched detection whose
+    center moved over `max_shift` box sizes or whose size changed over
+    `max_scale` times drops the track's identity and is encoded again.
+    """
+
+    def __init__(self, detect_every=5, iou_threshold=0.3, max_missed=2, follow='hold',
+                 reidentify_every=150, retry_unknown_every=5, max_shift=0.25, max_scale=1.3):
+        self.detect_every = max(1, int(detect_every))
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.max_shift = max_shift
+        self.max_scale = max_scale
+        self.follow = follow
+        self.reidentify_every = reidentify_every
+        self.retry_unknown_every = retry_unknown_every
+        self.tracks = []
+        self.frame_index = -1
+        self._next_id = 0
+        self._force_detection = True
+        self.detections = 0
+        # step() may run on a pipeline worker while assign() runs on the consumer
+        self._lock = threading.Lock()
+
+    def step(self, frame, detect_fn):
+        """
+        Advance one frame. detect_fn(frame) -> boxes is only called when needed.
+        Returns (tracks, pending): the visible tracks and the subset that needs encoding.
+        """
+        with self._lock:
+            self.frame_index += 1
+            if self._force_detection or self.frame_index % self.detect_every == 0:
+                self._update_from_detections(frame, detect_fn(frame))
+                self.detections += 1
+            else:
+                self._follow(frame)
+            visible = [t for t in self.tracks if t.missed == 0]
+            pending = [t for t in visible if self._needs_encoding(t)]
+            for track in pending:
+                # Encoding is in flight; don't request it again on the next frames
+                track.identified_at = self.frame_index
+            return visible, pending
+
+    def _needs_encoding(self, track):
+        if track.identified_at is None:
+            return True
+        interval = self.reidentify_every if track.user else self.retry_unknown_every
+        return self.frame_index - track.identified_at >= interval
+
+    def _update_from_detections(self, frame, boxes):
+        self._force_detection = False
+        boxes = [tuple(int(v) for v in box) for box in boxes]
+        overlaps = iou_matrix([t.box for t in self.tracks], boxes)
+        matched_tracks, matched_boxes = set(), set()
+        # Greedy assignment, best overlap first
+        for flat in np.argsort(overlaps, axis=None)[::-1]:
+            ti, bi = np.unravel_index(flat, overlaps.shape)
+            if overlaps[ti, bi] < self.iou_threshold:
+                break
+            if ti in matched_tracks or bi in matched_boxes:
+                continue
+            matched_tracks.add(ti)
+            matched_boxes.add(bi)
+            track = self.tracks[ti]
+            if track.missed or box_jumped(track.box, boxes[bi], self.max_shift, self.max_scale):
+                # Possibly someone else stepping into the box: the cached identity no longer holds
+                track.user = None
+                track.confidence = 0.0
+                track.identified_at = None
+            track.box = boxes[bi]
+            track.missed = 0
+            track.hits += 1
+            self._start_follower(track, frame)
+        for ti, track in enumerate(self.tracks):
+            if ti not in matched_tracks:
+                track.missed += 1
+        self.tracks = [t for t in self.tracks if t.missed <= self.max_missed]
+        for bi, box in enumerate(boxes):
+            if bi not in matched_boxes:
+                track = Track(self._next_id, box)
+                self._next_id += 1
+                self._start_follower(track, frame)
+                self.tracks.append(track)
+
+    def _start_follower(self, track, frame):
+        if self.follow != 'opencv':
+            return
+        track.follower = _create_cv_tracker()
+        if track.follower is not None:
+            top, right, bottom, left = track.box
+            track.follower.init(frame, (left, top, right - left, bottom - top))
+
+    def _follow(self, frame):
+        if self.follow != 'opencv':
+            return
+        for track in self.tracks:
+            if track.follower is None or track.missed:
+                continue
+            ok, (x, y, w, h) = track.follower.update(frame)
+            if ok:
+                track.box = (int(y), int(x + w), int(y + h), int(x))
+            else:
+                track.missed += 1
+                self._force_detection = True
+
+    def assign(self, tracks, results):
+        """Cache recognition results ((user or None, confidence) per track) on the tracks."""
+        with self._lock:
+            for track, (user, confidence) in zip(tracks, results):
+                track.user = user
+                track.confidence = confidence
+                track.identified_at = self.frame_index
+
+    def reset(self):
+        with self._lock:
+            self.tracks = []
+            self.frame_index = -1
+            self._force_detection = True
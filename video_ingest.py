@@ -0,0 +1,228 @@
+"""
+video_ingest.py
+Headless batch ingestion of recorded video: sample frames, detect and encode in a
+process pool, merge recognitions per person, then mark attendance once per person.
+Faces failing the single-frame texture check (printed photos, screens) are dropped
+before matching; --no-liveness keeps them, for footage from trusted cameras.
+
+Usage: python video_ingest.py recordings/ --workers 4 --stride 5 --threshold 70
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2
+import numpy as np
+from utils.detection import DetectionPolicy
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+# Per-process FaceUtils, created by _init_worker
+_worker_face_utils = None
+
+
+def _init_worker(gallery_path):
+    global _worker_face_utils
+    from face_utils import FaceUtils
+    # Workers only detect and encode; matching happens in the parent, so they load no gallery rows
+    _worker_face_utils = FaceUtils(gallery_path, shards=())
+
+
+def plan_segments(frame_count, workers, stride=1, min_segment=200):
+    """Split [0, frame_count) into stride-aligned segments, a few per worker for load balancing."""
+    if frame_count <= 0:
+        return [(0, None)]
+    count = max(1, min(workers * 4, frame_count // max(min_segment, stride)))
+    size = -(-frame_count // count)
+    size = -(-size // stride) * stride
+    return [(start, min(start + size, frame_count)) for start in range(0, frame_count, size)]
+
+
+def _scene_signature(frame):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+
+def process_segment(path, start, stop, stride=5, scene_threshold=0.0, policy=None, liveness=True):
+    """
+    Detect and encode faces on sampled frames of one segment (runs in a worker process).
+    With liveness, faces failing the texture check are counted as spoofs instead of encoded.
+    """
+    face_utils = _worker_face_utils
+    cap = cv2.VideoCapture(path)
+    if start:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    encodings, frame_indices = [], []
+    sampled = spoofs = 0
+    previous = None
+    index = start
+    while stop is None or index < stop:
+        if index % stride:
+            # grab() demuxes without decoding, which is most of the cost of a skipped frame
+            if not cap.grab():
+                break
+            index += 1
+            continue
+        ret, frame = cap.read()
+        if not ret:
+            break
+        index += 1
+        if scene_threshold > 0:
+            signature = _scene_signature(frame)
+            if previous is not None and np.abs(signature - previous).mean() < scene_threshold:
+                continue
+            previous = signature
+        sampled += 1
+        boxes, frame_encodings, _, _ = face_utils.process_frame(frame, policy)
+        if boxes and liveness:
+            live = face_utils.basic_liveness(frame, boxes)
+            spoofs += len(boxes) - sum(live)
+            frame_encodings = [e for e, is_live in zip(frame_encodings, live) if is_live]
+        if len(frame_encodings):
+            encodings.extend(frame_encodings)
+            frame_indices.extend([index - 1] * len(frame_encodings))
+    cap.release()
+    return {
+        'start': start,
+        'stop': index,
+        'sampled': sampled,
+        'spoofs': spoofs,
+        'encodings': np.asarray(encodings, dtype=np.float32).reshape(-1, 128),
+        'frame_indices': frame_indices,
+    }
+
+
+def merge_recognitions(face_utils, segments, threshold, fps, shards=None, fallback=None):
+    """Recognize all encodings at once (within shards, see FaceUtils) and aggregate sightings per person."""
+    encodings = [s['encodings'] for s in segments if len(s['encodings'])]
+    if not encodings:
+        return {}
+    encodings = np.concatenate(encodings)
+    frame_indices = np.concatenate([s['frame_indices'] for s in segments if len(s['encodings'])])
+    matches, confidences, _ = face_utils.recognize_many(encodings, threshold=1-threshold/100, shards=shards,
+                                                        fallback=fallback)
+    people = {}
+    for user, conf, frame_index in zip(matches, confidences, frame_indices):
+        if not user or conf < threshold:
+            continue
+        seen_at = frame_index / fps if fps else 0.0
+        person = people.get(user['id'])
+        if person is None:
+            people[user['id']] = {'user': user, 'sightings': 1, 'best_confidence': float(conf),
+                                  'first_seen_s': seen_at, 'last_seen_s': seen_at}
+        else:
+            person['sightings'] += 1
+            person['best_confidence'] = max(person['best_confidence'], float(conf))
+            person['first_seen_s'] = min(person['first_seen_s'], seen_at)
+            person['last_seen_s'] = max(person['last_seen_s'], seen_at)
+    return people
+
+
+def ingest_video(path, face_utils, db=None, workers=None, stride=5, scene_threshold=0.0,
+                 threshold=70, min_sightings=2, min_face=80, progress=None, source='Video', shards=None,
+                 fallback=None, liveness=True):
+    """
+    Process one video file. progress(done, total) is called as segments finish.
+    If db is given, attendance is marked once per person seen at least min_sightings times.
+    min_face (px) sets the detection resolution; encodings always use full-resolution frames.
+    shards and fallback scope recognition to gallery shards (see FaceUtils.recognize_many).
+    liveness=False skips the texture check, for footage from trusted cameras.
+    """
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError(f'Cannot open video: {path}')
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+    cap.release()
+
+    plan = plan_segments(frame_count, workers, stride)
+    policy = DetectionPolicy(min_face=min_face, min_face_ratio=0)
+    segments = []
+    with ProcessPoolExecutor(max_workers=min(workers, len(plan)), initializer=_init_worker,
+                             initargs=(face_utils.gallery_path,)) as pool:
+        futures = [pool.submit(process_segment, path, start, stop, stride, scene_threshold, policy, liveness)
+                   for start, stop in plan]
+        for done, future in enumerate(as_completed(futures), 1):
+            segments.append(future.result())
+            if progress:
+                progress(done, len(futures))
+
+    people = merge_recognitions(face_utils, segments, threshold, fps, shards, fallback)
+    accepted = [p for p in people.values() if p['sightings'] >= min_sightings]
+    marked = []
+    if db is not None:
+        accepted.sort(key=lambda p: p['first_seen_s'])
+        inserted = db.mark_attendance_many([
+            (p['user']['id'], p['user']['name'], p['user']['department'], p['best_confidence'], source)
+            for p in accepted
+        ])
+        marked = [p['user']['id'] for p, is_new in zip(accepted, inserted) if is_new]
+    elapsed = time.perf_counter() - started
+    frames = max((s['stop'] for s in segments), default=0)
+    return {
+        'file': path,
+        'frames': frames,
+        'sampled': sum(s['sampled'] for s in segments),
+        'faces': sum(len(s['encodings']) for s in segments),
+        'spoofs': sum(s['spoofs'] for s in segments),
+        'people': accepted,
+        'marked': marked,
+        'elapsed_s': elapsed,
+        'frames_per_s': frames / elapsed if elapsed else 0.0,
+        'video_s': frames / fps if fps else None,
+    }
+
+
+def find_videos(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(VIDEO_EXTENSIONS):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', help='Video files or directories of recordings')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--stride', type=int, default=5, help='Process every Nth frame')
+    parser.add_argument('--scene-threshold', type=float, default=0.0,
+                        help='Skip sampled frames whose mean 32x32 gray difference is below this (0 = off)')
+    parser.add_argument('--threshold', type=float, default=70, help='Confidence threshold (%%)')
+    parser.add_argument('--min-sightings', type=int, default=2)
+    parser.add_argument('--min-face', type=int, default=80, help='Smallest face to detect, in video pixels')
+    parser.add_argument('--dry-run', action='store_true', help='Report recognitions without marking attendance')
+    parser.add_argument('--shards', nargs='+', default=None, help='Match against these gallery shards first')
+    parser.add_argument('--no-liveness', action='store_true',
+                        help='Keep faces that fail the print/screen texture check (trusted footage only)')
+    parser.add_argument('--json', help='Write the per-file reports to this file')
+    args = parser.parse_args()
+
+    from face_utils import FaceUtils
+    from database import Database
+    face_utils = FaceUtils()
+    db = None if args.dry_run else Database()
+    reports = []
+    for path in find_videos(args.paths):
+        def progress(done, total, path=path):
+            print(f'\r{os.path.basename(path)}: {done}/{total} segments', end='', flush=True)
+        report = ingest_video(path, face_utils, db, workers=args.workers, stride=args.stride,
+                              scene_threshold=args.scene_threshold, threshold=args.threshold,
+                              min_sightings=args.min_sightings, min_face=args.min_face, progress=progress,
+                              shards=args.shards, liveness=not args.no_liveness)
+        print(f"\r{os.path.basename(path)}: {report['frames']} frames, {report['sampled']} sampled, "
+              f"{len(report['people'])} people, {len(report['marked'])} marked, {report['spoofs']} spoofs, "
+              f"{report['frames_per_s']:.0f} frames/s")
+        reports.append(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    main()